@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the transfer engine against the local mock server.
+
+Every engine configuration runs in a fresh process so that peak RSS and CPU
+time are not shared between runs, while the mock server keeps running in this
+process.
+
+    python benchmarks/engine.py --test-length 5
+    python benchmarks/engine.py --bandwidth 125M --latency 0.02 --json
+"""
+
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import timeit
+from typing import Dict
+
+from speedtest.mockserver import MockSpeedtestServer, parse_size
+from speedtest.speedtest import SocketOptions, Speedtest
+
+CONFIGURATIONS = {
+    'default': {},
+    'single': {'threads': 1},
+    'threads-16': {'threads': 16},
+    'no-tcp-info': {'tcp_info_interval': None},
+    'no-pre-allocate': {'pre_allocate': False},
+    'nodelay-4M-buffers': {'socket_options': {'nodelay': True, 'rcvbuf': 4 << 20, 'sndbuf': 4 << 20}},
+}
+
+
+def run_engine(config_url: str, server_list_url: str, options: Dict, connection) -> None:
+    """
+    Run one full test in a child process and send the measurements back.
+    """
+    options = dict(options)
+    threads = options.pop('threads', None)
+    pre_allocate = options.pop('pre_allocate', True)
+    if 'socket_options' in options:
+        options['socket_options'] = SocketOptions(**options['socket_options'])
+
+    phases = {}
+    start = timeit.default_timer()
+    test = Speedtest(config_url=config_url, server_list_url=server_list_url, **options)
+    phases['get_config'] = timeit.default_timer() - start
+
+    for phase, call in (
+        ('get_servers', lambda: test.get_servers()),
+        ('get_best_server', lambda: test.get_best_server()),
+        ('download', lambda: test.download(threads=threads)),
+        ('upload', lambda: test.upload(threads=threads, pre_allocate=pre_allocate)),
+    ):
+        start = timeit.default_timer()
+        call()
+        phases[phase] = timeit.default_timer() - start
+
+    results = test.results.dict()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+    measurements = {'phases': phases, 'peak_rss': peak_rss}
+    for phase in ('download', 'upload'):
+        bps = results[phase]
+        cpu = results['cpu'][phase]
+        measurements[phase] = {
+            'bps': bps,
+            'bytes': results['bytes_received' if phase == 'download' else 'bytes_sent'],
+            'cpu_seconds': cpu['process'],
+            'cores_per_gbps': cpu['utilization'] / (bps / 1e9) if bps else None,
+            'client_bound': cpu['client_bound'],
+        }
+    connection.send(measurements)
+    connection.close()
+
+
+def benchmark(server: MockSpeedtestServer, options: Dict) -> Dict:
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=run_engine, args=(server.config_url, server.server_list_url, options, sender))
+    process.start()
+    sender.close()
+    measurements = receiver.recv()
+    process.join()
+    return measurements
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the speedtest engine against a local mock server.")
+    parser.add_argument('--test-length', type=int, default=5, help="length of each transfer phase in seconds (default: 5)")
+    parser.add_argument('--latency', type=float, default=0, help="server side response delay in seconds")
+    parser.add_argument('--bandwidth', type=parse_size, help="cap the server throughput in bytes per second, e.g. 125M")
+    parser.add_argument('--config', type=str, nargs='+', choices=CONFIGURATIONS, default=list(CONFIGURATIONS), help="engine configurations to run")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args()
+
+    report = {}
+    with MockSpeedtestServer(test_length=args.test_length, latency=args.latency, bandwidth=args.bandwidth) as server:
+        for name in args.config:
+            report[name] = benchmark(server, CONFIGURATIONS[name])
+            if not args.json:
+                print(f"finished {name}", file=sys.stderr)
+
+    if args.json:
+        print(json.dumps(report, indent=4))
+        return
+
+    tabulate = "{:<20}{:>12}{:>12}{:>12}{:>12}{:>10}{:>10}{:>10}{:>10}".format
+    print(tabulate('Configuration', 'Down Mbps', 'Up Mbps', 'Down CPU/G', 'Up CPU/G', 'RSS MB', 'Setup s', 'Down s', 'Up s'))
+    for name, measurements in report.items():
+        phases = measurements['phases']
+        down, up = measurements['download'], measurements['upload']
+        print(tabulate(
+            name,
+            "{:.1F}".format(down['bps'] / 1e6),
+            "{:.1F}".format(up['bps'] / 1e6),
+            "{:.3F}".format(down['cores_per_gbps'] or 0),
+            "{:.3F}".format(up['cores_per_gbps'] or 0),
+            "{:.1F}".format(measurements['peak_rss'] / 2**20),
+            "{:.2F}".format(phases['get_config'] + phases['get_servers'] + phases['get_best_server']),
+            "{:.2F}".format(phases['download']),
+            "{:.2F}".format(phases['upload'])
+        ))
+
+
+if __name__ == '__main__':
+    main()
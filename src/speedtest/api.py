@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from socketserver import ThreadingMixIn, UnixStreamServer
+from time import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, Union
+from urllib.parse import parse_qs, urlparse
+
+from . import core, utils
+from .history import History
+from .metrics import CONTENT_TYPE, MetricsRegistry
+from .push import Pusher
+from .speedtest import SpeedtestSession
+
+#region single-flight
+
+class Flight:
+    """
+    A call in progress that other callers may wait for.
+    """
+    __slots__ = ('done', 'result', 'finished', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.finished = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into one call and remember the
+    result of the last `capacity` keys together with the time it finished.
+    """
+    def __init__(self, capacity: int=64):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.flights: Dict[Hashable, Flight] = {}
+        self.results: Dict[Hashable, Tuple[Any, float]] = {}
+
+    def cached(self, key: Hashable, max_age: Optional[float]) -> Optional[Tuple[Any, float]]:
+        """
+        Return the last result of `key` and when it finished if it is at most
+        `max_age` seconds old.
+        """
+        if max_age is None:
+            return None
+        with self.lock:
+            cached = self.results.get(key)
+        if cached and time() - cached[1] <= max_age:
+            return cached
+        return None
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Tuple[Any, float]:
+        """
+        Call `function` unless a call for `key` is already in flight, in which
+        case wait for that one and share its result or exception.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if leader:
+            try:
+                flight.result = function()
+            except Exception as error:
+                flight.error = error
+            finally:
+                flight.finished = time()
+                with self.lock:
+                    del self.flights[key]
+                    if flight.error is None:
+                        self.results.pop(key, None)
+                        self.results[key] = (flight.result, flight.finished)
+                        if len(self.results) > self.capacity:
+                            del self.results[next(iter(self.results))]
+                flight.done.set()
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, flight.finished
+
+#endregion single-flight
+
+#region service
+
+class QueueFull(Exception):
+    pass
+
+
+class SpeedtestService:
+    """
+    Run ping and bandwidth tests on behalf of API clients. Concurrent requests
+    for the same test share one run, results younger than the `max_age` of a
+    request are answered from memory, and at most `max_pending` requests may
+    wait for a test at a time. Fresh results are appended to `ping_history`
+    and `bandwidth_history` if given, and pushed in the background by `pusher`.
+    All fresh results are recorded in `metrics`.
+    """
+    def __init__(self, session: SpeedtestSession, threads: Optional[int]=None, max_pending: int=16, ping_history: Optional[History]=None, bandwidth_history: Optional[History]=None, pusher: Optional[Pusher]=None, metrics: Optional[MetricsRegistry]=None):
+        self.session = session
+        self.threads = threads
+        self.ping_history = ping_history
+        self.bandwidth_history = bandwidth_history
+        self.pusher = pusher
+        self.metrics = metrics or MetricsRegistry()
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.flights = SingleFlight()
+
+    def _run(self, key: Hashable, function: Callable[[], Any], max_age: Optional[float]) -> Tuple[Any, float, bool]:
+        if cached := self.flights.cached(key, max_age):
+            return (*cached, True)
+        if not self.pending.acquire(blocking=False):
+            raise QueueFull()
+        try:
+            return (*self.flights.do(key, function), False)
+        finally:
+            self.pending.release()
+
+    def _save(self, history: Optional[History], name: str, row: Dict) -> None:
+        # A result that could not be saved is still worth answering with
+        if history:
+            try:
+                history.append([row])
+            except (OSError, sqlite3.Error) as error:
+                utils.logger.error(f"Could not save the {name} result to {history.path}: {error}")
+        if self.pusher:
+            try:
+                self.pusher.spool.write(name, [row])
+            except OSError as error:
+                utils.logger.error(f"Could not spool the {name} result: {error}")
+                return
+            threading.Thread(target=self.pusher.push, name='push', daemon=True).start()
+
+    def ping(self, target: str, count: int, size: int, max_age: Optional[float]=None, method: str='icmp') -> Tuple[core.PingResult, float, bool]:
+        """
+        Return a ping result, when it finished and whether it came from memory.
+        """
+        def function():
+            result = core.test_ping(target, count, size, method=method)
+            self._save(self.ping_history, 'ping', result.row())
+            self.metrics.observe_ping(result)
+            return result
+
+        return self._run(('ping', target, count, size, method), function, max_age)
+
+    def bandwidth(self, max_age: Optional[float]=None) -> Tuple[core.BandwidthResult, float, bool]:
+        """
+        Return a bandwidth result, when it finished and whether it came from memory.
+        """
+        def function():
+            result = core.test_bandwidth(self.threads, session=self.session)
+            self._save(self.bandwidth_history, 'bandwidth', result.row())
+            self.metrics.observe_bandwidth(result)
+            return result
+
+        return self._run(('bandwidth',), function, max_age)
+
+#endregion service
+
+#region http
+
+class APIRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serve `GET /ping` and `GET /bandwidth` as JSON. Both accept a `max_age`
+    in seconds, `/ping` also accepts `target`, `count`, `size` and `method`. `GET /metrics`
+    returns the metrics of all tests run so far for Prometheus.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, data: Dict) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '5')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        service: SpeedtestService = self.server.service
+        url = urlparse(self.path)
+        if url.path == '/metrics':
+            body = service.metrics.render()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        defaults = self.server.ping_defaults
+        try:
+            max_age = float(query['max_age']) if 'max_age' in query else None
+            target = query.get('target', defaults['target'])
+            count = int(query.get('count', defaults['count']))
+            size = int(query.get('size', defaults['size']))
+            method = query.get('method', defaults['method'])
+            if method not in core.METHODS:
+                raise ValueError(f"Unknown ping method {method}, expected one of: {', '.join(core.METHODS)}")
+        except ValueError as error:
+            self._send_json(400, {'error': str(error)})
+            return
+
+        try:
+            if url.path == '/ping':
+                result, finished, cached = service.ping(target, count, size, max_age, method)
+            elif url.path == '/bandwidth':
+                result, finished, cached = service.bandwidth(max_age)
+            else:
+                self._send_json(404, {'error': f"Unknown endpoint {url.path}"})
+                return
+        except QueueFull:
+            self._send_json(503, {'error': "Too many pending requests"})
+        except PermissionError as perm_error:
+            utils.logger.error(str(perm_error))
+            self._send_json(500, {'error': "You need root privileges in order to run this command, or try method=icmp-dgram, tcp or http."})
+        except Exception as error:
+            utils.logger.error(str(error))
+            self._send_json(500, {'error': str(error)})
+        else:
+            self._send_json(200, {'cached': cached, 'age': time() - finished, 'result': result.dict()})
+
+
+class APIServerMixin:
+    daemon_threads = True
+
+    def configure(self, service: SpeedtestService, ping_defaults: Dict[str, Union[str, int]]) -> None:
+        self.service = service
+        self.ping_defaults = ping_defaults
+
+
+class APIServer(APIServerMixin, ThreadingHTTPServer):
+    """
+    Serve the API over TCP, by default only to this host.
+    """
+    def __init__(self, host: str='127.0.0.1', port: int=8000):
+        super().__init__((host, port), APIRequestHandler)
+
+
+class UnixAPIServer(APIServerMixin, ThreadingMixIn, UnixStreamServer):
+    """
+    Serve the API on a Unix domain socket at `path`, replacing a stale socket
+    left behind by a previous run.
+    """
+    def __init__(self, path: Union[str, Path]):
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(str(path), APIRequestHandler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+#endregion http
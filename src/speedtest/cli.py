@@ -1,16 +1,123 @@
 #!/usr/bin/env python3
 
 import argparse
-import csv
 import errno
+import json
+import signal
 import sys
+import threading
 from collections import namedtuple
+from datetime import datetime as dt
+from datetime import timezone
 from time import time
+from typing import Dict, Iterable, List, Optional
 
 from . import core, utils
 from .__init__ import __version__, package_name
-from .config import BANDWIDTHFILE, BRIGHT, CONFIGFILE, GREEN, LOGFILE, MAGENTA, PINGFILE, RESET_ALL, YELLOW
-
+from .api import APIServer, SpeedtestService, UnixAPIServer
+from .config import BRIGHT, CONFIGFILE, DIM, GREEN, HISTORYDB, LOGFILE, MAGENTA, RESET_ALL, YELLOW
+from .daemon import BatchWriter, Daemon
+from .export import FORMATS, export, read_mark, write_mark
+from .history import BACKENDS, COLUMNS, LEVELS, History, migrate, open_history
+from .metrics import MetricsRegistry, MetricsServer
+from .push import open_pusher
+from .retention import RetentionPolicy, compact
+from .speedtest import InterfaceCountersError, SocketOptions, SpeedtestSession, Tracer
+from .stats import Samples, aggregate
+
+
+def print_stats(buckets: List[Dict], as_json: bool) -> None:
+    """
+    Print the summaries computed by `stats.aggregate` as table or as JSON.
+    """
+    if as_json:
+        print(json.dumps(buckets, indent=4))
+        return
+    tabulate = "{:<20}{:<18}{:<13}{:>7}{:>10}{:>10}{:>10}{:>10}{:>10}".format
+    print('\n' + BRIGHT + GREEN + tabulate('Target', 'Start', 'Metric', 'Count', 'Min', 'P50', 'P95', 'Max', 'Mean') + RESET_ALL)
+    for bucket in buckets:
+        for metric, summary in bucket['metrics'].items():
+            print(tabulate(
+                bucket['target'] or '-',
+                dt.fromtimestamp(bucket['start'], tz=timezone.utc).strftime('%Y-%m-%d %H:%M'),
+                metric,
+                bucket['count'],
+                *("{:.2F}".format(summary[name]) if summary[name] is not None else '-' for name in ('min', 'p50', 'p95', 'max', 'mean'))
+            ))
+    print()
+
+def warn_on_rollups(history: History, since: Optional[float], until: Optional[float], verbose: bool=True) -> None:
+    """
+    Warn if results between `since` and `until` were already compacted into
+    rollups, which `--stats` does not read.
+    """
+    rollup = history.rollup('daily')
+    try:
+        first, last = rollup.oldest(), rollup.tail(1)
+    finally:
+        rollup.close()
+    if first is None or not last:
+        return
+    end = utils.parse_timestamp(last[0]['DateTime']) + LEVELS['daily']
+    if (since is None or since < end) and (until is None or until > first):
+        start = dt.fromtimestamp(end, tz=timezone.utc).strftime('%Y-%m-%d')
+        message = f"Results before {start} were compacted into rollups, the statistics only cover the raw results from {start} on. See --list --rollup daily for earlier days."
+        utils.logger.warning(message)
+        utils.print_on_warning(message, verbose)
+
+def print_summary(summaries: List[Dict], as_json: bool) -> None:
+    """
+    Print the summaries computed by `History.summary` as table or as JSON.
+    """
+    if as_json:
+        print(json.dumps(summaries, indent=4))
+        return
+    tabulate = "{:<20}{:<18}{:<8}{:<13}{:>7}{:>10}{:>10}{:>10}{:>10}".format
+    print('\n' + BRIGHT + GREEN + tabulate('Target', 'Last', 'Window', 'Metric', 'Count', 'Last', 'Min', 'Max', 'Mean') + RESET_ALL)
+    for summary in summaries:
+        last = summary['last']
+        for window, aggregates in summary['windows'].items():
+            for metric, values in aggregates['metrics'].items():
+                print(tabulate(
+                    summary['target'] or '-',
+                    dt.fromtimestamp(float(last['DateTime']), tz=timezone.utc).strftime('%Y-%m-%d %H:%M'),
+                    window.title(),
+                    metric,
+                    aggregates['count'],
+                    "{:.2F}".format(float(last[metric])) if last.get(metric) not in (None, '') else '-',
+                    *("{:.2F}".format(values[name]) if values and values[name] is not None else '-' for name in ('min', 'max', 'mean'))
+                ))
+    print()
+
+def format_cell(kind: str, column: str, value) -> str:
+    """
+    Format a cell of a history row for display, dates in UTC.
+    """
+    if value is None or value == '':
+        # Rows saved before a column was added leave it empty
+        return ''
+    try:
+        if column == 'DateTime':
+            return dt.fromtimestamp(utils.parse_timestamp(value), tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        if kind == 'INTEGER':
+            return str(int(float(value)))
+        if kind == 'REAL':
+            return "{:.2F}".format(float(value))
+    except ValueError:
+        pass
+    return str(value)
+
+def print_rows(name: str, rows: Iterable[Dict]) -> None:
+    """
+    Print the rows of the `name` history as table.
+    """
+    kinds = COLUMNS[name]
+    widths = [21 if column == 'DateTime' else max(12 if kind == 'TEXT' else 8, len(column) + 2) for column, kind in kinds.items()]
+    tabulate = ' '.join(f"{{:<{width}}}" for width in widths).format
+    print('\n' + BRIGHT + GREEN + tabulate(*kinds) + RESET_ALL)
+    for row in rows:
+        print(tabulate(*(format_cell(kind, column, row.get(column)) for column, kind in kinds.items())))
+    print()
 
 def cli():
     parser = argparse.ArgumentParser()
@@ -26,33 +133,111 @@ def cli():
 
     config_parser = subparser.add_parser('config', help="configure default application settings")
     config_parser.add_argument('--target', type=str, nargs='?', help="set the target IP address or hostname to ping")
+    config_parser.add_argument('--targets', type=str, nargs='*', metavar='HOST', help="set several targets to ping at once instead, no HOST clears them")
     config_parser.add_argument('--count', type=int, nargs='?', help="set the number of attempts")
     config_parser.add_argument('--size', type=int, nargs='?', help="set package size to send")
+    config_parser.add_argument('--method', type=str, choices=core.METHODS, help="set how to ping targets, see ping --help")
     config_parser.add_argument('--threads', type=int, nargs='?', help="set number of speedtest threads")
+    config_parser.add_argument('--ping-interval', type=float, nargs='?', help="set the seconds between scheduled ping tests")
+    config_parser.add_argument('--bandwidth-interval', type=float, nargs='?', help="set the seconds between scheduled bandwidth tests")
+    config_parser.add_argument('--history', type=str, choices=BACKENDS, help="set where results are saved, switching to sqlite imports the CSV history")
+    config_parser.add_argument('--retention', type=float, nargs='?', metavar='DAYS', help="set the days to keep raw results for before rolling them up, 0 to keep them forever")
+    config_parser.add_argument('--hourly-retention', type=float, nargs='?', metavar='DAYS', help="set the days to keep hourly rollups for, 0 to keep them forever")
+    config_parser.add_argument('--collector', type=str, nargs='?', metavar='URL', help="also push every saved result to the collector at URL, an empty URL stops pushing")
+    config_parser.add_argument('--collector-token', type=str, nargs='?', metavar='TOKEN', help="set the bearer token sent to the collector")
     config_parser.add_argument('--path', action='store_true', help="return the config file path")
     config_parser.add_argument('--reset', action='store_true', help='purge the config file')
     config_parser.add_argument('--list', action='store_true', help="list all user configuration")
 
     ping_parser = subparser.add_parser('ping', help="ping a remote host")
-    ping_parser.add_argument('--target', type=str, nargs='?', help="set the target IP address or hostname to ping (default: google.com)")
+    ping_parser.add_argument('--target', type=str, nargs='?', help="set the target IP address or hostname to ping (default: google.com), or the target to list")
     ping_parser.add_argument('--count', type=int, nargs='?', help="set the number of attempts (default: 4)")
     ping_parser.add_argument('--size', type=int, nargs='?', help="set package size to send (default: 1)")
+    ping_parser.add_argument('--targets', type=str, nargs='+', metavar='HOST', help="ping several targets at once over one socket")
+    ping_parser.add_argument('--interval', type=float, help="seconds between the requests to each target (default: 0 for a single target over icmp, else 0.2)")
+    ping_parser.add_argument('--method', type=str, choices=core.METHODS, help="send ICMP echo requests over a raw socket if permitted (icmp, default), always over an unprivileged datagram socket (icmp-dgram), or measure the TCP connect (tcp) or HTTP request (http) latency to HOST[:PORT] or URL targets without privileges")
+    ping_parser.add_argument('--max-age', type=float, metavar='SECONDS', help="reuse the last saved result for this target if it is at most SECONDS old")
     ping_parser.add_argument('--save', default=True, action='store_true', help="save ping results (default)")
     ping_parser.add_argument('--no-save', dest='save', action='store_false', help="don't save ping results")
     ping_parser.add_argument('--path', action='store_true', help="return the ping file path")
     ping_parser.add_argument('--reset', action='store_true', help='purge the ping file')
     ping_parser.add_argument('--list', action='store_true', help="list ping history")
+    ping_parser.add_argument('--since', type=utils.parse_time, metavar='TIME', help="only list results from TIME on, e.g. 2021-10-01 or 7d")
+    ping_parser.add_argument('--until', type=utils.parse_time, metavar='TIME', help="only list results before TIME")
+    ping_parser.add_argument('--limit', type=int, help="list at most this many results")
+    ping_parser.add_argument('--tail', type=int, metavar='N', help="list only the last N results")
+    ping_parser.add_argument('--rollup', type=str, choices=LEVELS, help="list the hourly or daily summaries of results past their retention instead")
+    ping_parser.add_argument('--stats', action='store_true', help="summarize the history, takes the same filters as --list")
+    ping_parser.add_argument('--resample', type=utils.parse_duration, metavar='INTERVAL', help="summarize per time bucket of this length, e.g. 1h or 1d")
+    ping_parser.add_argument('--summary', action='store_true', help="print the last result and the minimum, maximum and mean over the last day and week")
+    ping_parser.add_argument('--json', action='store_true', help="print the summary as JSON")
 
     bandwidth_parser = subparser.add_parser('bandwidth', help="perform a speedtest")
     bandwidth_parser.add_argument('--threads', type=int, nargs='?', help="set number of speedtest threads")
+    bandwidth_parser.add_argument('--rcvbuf', type=int, help="set the receive buffer size of every test socket in bytes")
+    bandwidth_parser.add_argument('--sndbuf', type=int, help="set the send buffer size of every test socket in bytes")
+    bandwidth_parser.add_argument('--tcp-nodelay', dest='nodelay', action='store_const', const=True, help="disable Nagle's algorithm on every test socket")
+    bandwidth_parser.add_argument('--tcp-congestion', dest='congestion', type=str, help="set the TCP congestion control algorithm, e.g. bbr (Linux only)")
+    bandwidth_parser.add_argument('--tcp-quickack', dest='quickack', action='store_const', const=True, help="enable TCP quick acknowledgements (Linux only)")
+    bandwidth_parser.add_argument('--interface', nargs='?', const=True, help="cross-check against the counters of the egress interface or of the given interface (Linux only)")
+    bandwidth_parser.add_argument('--trace', type=str, metavar='FILE', help="write a Chrome trace-event timeline of the test to FILE")
+    bandwidth_parser.add_argument('--max-age', type=float, metavar='SECONDS', help="reuse the last saved result if it is at most SECONDS old")
     bandwidth_parser.add_argument('--save', default=True, action='store_true', help="save bandwidth results (default)")
     bandwidth_parser.add_argument('--no-save', dest='save', action='store_false', help="don't save bandwidth results")
     bandwidth_parser.add_argument('--path', action='store_true', help="return the ping file path")
     bandwidth_parser.add_argument('--reset', action='store_true', help='purge the ping file')
     bandwidth_parser.add_argument('--list', action='store_true', help="list ping history")
+    bandwidth_parser.add_argument('--since', type=utils.parse_time, metavar='TIME', help="only list results from TIME on, e.g. 2021-10-01 or 7d")
+    bandwidth_parser.add_argument('--until', type=utils.parse_time, metavar='TIME', help="only list results before TIME")
+    bandwidth_parser.add_argument('--limit', type=int, help="list at most this many results")
+    bandwidth_parser.add_argument('--tail', type=int, metavar='N', help="list only the last N results")
+    bandwidth_parser.add_argument('--rollup', type=str, choices=LEVELS, help="list the hourly or daily summaries of results past their retention instead")
+    bandwidth_parser.add_argument('--stats', action='store_true', help="summarize the history, takes the same filters as --list")
+    bandwidth_parser.add_argument('--resample', type=utils.parse_duration, metavar='INTERVAL', help="summarize per time bucket of this length, e.g. 1h or 1d")
+    bandwidth_parser.add_argument('--summary', action='store_true', help="print the last result and the minimum, maximum and mean over the last day and week")
+    bandwidth_parser.add_argument('--json', action='store_true', help="print the summary as JSON")
+
+    daemon_parser = subparser.add_parser('daemon', help="run scheduled ping and bandwidth tests")
+    daemon_parser.add_argument('--ping-interval', type=float, help="seconds between ping tests, 0 to disable (default: 60)")
+    daemon_parser.add_argument('--bandwidth-interval', type=float, help="seconds between bandwidth tests, 0 to disable (default: 3600)")
+    daemon_parser.add_argument('--jitter', type=float, default=0.1, help="shift every test randomly by up to this fraction of its interval (default: 0.1)")
+    daemon_parser.add_argument('--target', type=str, nargs='?', help="set the target IP address or hostname to ping (default: google.com)")
+    daemon_parser.add_argument('--targets', type=str, nargs='+', metavar='HOST', help="ping several targets at once over one socket")
+    daemon_parser.add_argument('--count', type=int, nargs='?', help="set the number of attempts (default: 4)")
+    daemon_parser.add_argument('--size', type=int, nargs='?', help="set package size to send (default: 1)")
+    daemon_parser.add_argument('--method', type=str, choices=core.METHODS, help="set how to ping targets, see ping --help (default: icmp)")
+    daemon_parser.add_argument('--threads', type=int, nargs='?', help="set number of speedtest threads")
+    daemon_parser.add_argument('--batch-size', type=int, default=10, help="save results once this many are pending (default: 10)")
+    daemon_parser.add_argument('--flush-interval', type=float, default=300, help="save pending results at least this often in seconds (default: 300)")
+    daemon_parser.add_argument('--push-interval', type=float, default=60, help="push spooled results to the collector this often in seconds (default: 60)")
+    daemon_parser.add_argument('--metrics-port', type=int, metavar='PORT', help="expose Prometheus metrics at http://HOST:PORT/metrics")
+    daemon_parser.add_argument('--metrics-host', type=str, default='127.0.0.1', help="address to expose metrics on (default: 127.0.0.1)")
+    daemon_parser.add_argument('--metrics-textfile', type=str, metavar='FILE', help="write Prometheus metrics to FILE for the textfile collector of the node exporter")
+
+    serve_parser = subparser.add_parser('serve', help="answer ping and bandwidth requests over a local HTTP API")
+    serve_parser.add_argument('--host', type=str, default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    serve_parser.add_argument('--port', type=int, default=8000, help="port to listen on (default: 8000)")
+    serve_parser.add_argument('--unix', type=str, metavar='PATH', help="listen on a Unix domain socket at PATH instead")
+    serve_parser.add_argument('--max-pending', type=int, default=16, help="reject requests while this many wait for a test (default: 16)")
+    serve_parser.add_argument('--threads', type=int, nargs='?', help="set number of speedtest threads")
+    serve_parser.add_argument('--save', default=True, action='store_true', help="save test results (default)")
+    serve_parser.add_argument('--no-save', dest='save', action='store_false', help="don't save test results")
+    serve_parser.add_argument('--metrics-textfile', type=str, metavar='FILE', help="also write the metrics served at /metrics to FILE")
+
+    push_parser = subparser.add_parser('push', help="push spooled results to the configured collector")
+    push_parser.add_argument('--status', action='store_true', help="print the number of spooled results instead")
+
+    export_parser = subparser.add_parser('export', help="export the ping or bandwidth history with typed columns")
+    export_parser.add_argument('name', type=str, choices=('ping', 'bandwidth'), help="history to export")
+    export_parser.add_argument('--output', type=str, metavar='FILE', help="write to FILE instead of printing NDJSON")
+    export_parser.add_argument('--format', type=str, choices=FORMATS, help="set the file format, guessed from the file name by default (parquet and arrow require pyarrow)")
+    export_parser.add_argument('--batch-size', type=int, default=10_000, help="convert this many rows at a time (default: 10000)")
+    export_parser.add_argument('--full', action='store_true', help="export the whole history instead of the rows added since the last export")
 
     args = parser.parse_args()
     config_data = utils.read_json_file(CONFIGFILE)
+    retention = RetentionPolicy(config_data.get('Retention'), config_data.get('HourlyRetention'))
+    pusher = open_pusher(config_data['Collector'], config_data.get('CollectorToken')) if config_data.get('Collector') else None
 
     if args.command == 'log':
         logfile = utils.get_resource_path(LOGFILE)
@@ -87,15 +272,46 @@ def cli():
         if args.target:
             config_data['Target'] = args.target
             utils.write_json_file(config_file, config_data)
+        if args.targets is not None:
+            config_data['Targets'] = args.targets or None
+            utils.write_json_file(config_file, config_data)
         if args.count:
             config_data['Count'] = args.count
             utils.write_json_file(config_file, config_data)
         if args.size:
             config_data['Size'] = args.size
             utils.write_json_file(config_file, config_data)
+        if args.method:
+            config_data['Method'] = args.method
+            utils.write_json_file(config_file, config_data)
         if args.threads:
             config_data['Threads'] = args.threads
             utils.write_json_file(config_file, config_data)
+        if args.ping_interval is not None:
+            config_data['PingInterval'] = args.ping_interval
+            utils.write_json_file(config_file, config_data)
+        if args.bandwidth_interval is not None:
+            config_data['BandwidthInterval'] = args.bandwidth_interval
+            utils.write_json_file(config_file, config_data)
+        if args.retention is not None:
+            config_data['Retention'] = args.retention or None
+            utils.write_json_file(config_file, config_data)
+        if args.hourly_retention is not None:
+            config_data['HourlyRetention'] = args.hourly_retention or None
+            utils.write_json_file(config_file, config_data)
+        if args.collector is not None:
+            config_data['Collector'] = args.collector or None
+            utils.write_json_file(config_file, config_data)
+        if args.collector_token is not None:
+            config_data['CollectorToken'] = args.collector_token or None
+            utils.write_json_file(config_file, config_data)
+        if args.history:
+            config_data['History'] = args.history
+            utils.write_json_file(config_file, config_data)
+            if args.history == 'sqlite':
+                for name in COLUMNS:
+                    if count := migrate(name):
+                        utils.print_on_success(f"Imported {count} {name} results into {utils.get_resource_path(HISTORYDB)}")
         if args.path:
             return config_file
         if args.reset:
@@ -106,85 +322,299 @@ def cli():
             return
 
     if args.command == 'ping':
-        ping_file = utils.get_resource_path(PINGFILE)
+        ping_history = open_history('ping', config_data.get('History', 'csv'))
 
         if args.path:
-            return ping_file
+            return ping_history.path
         if args.reset:
-            utils.reset_file(ping_file)
+            ping_history.reset()
+            return
+        if args.stats:
+            print_stats(aggregate(Samples.load(ping_history, args.since, args.until, args.target), args.resample), args.json)
+            warn_on_rollups(ping_history, args.since, args.until, not args.json)
+            return
+        if args.summary:
+            print_summary(ping_history.summary(args.target), args.json)
+            return
+        if args.list and args.rollup:
+            rollup = ping_history.rollup(args.rollup)
+            print_rows(rollup.name, rollup.tail(args.tail, args.since, args.until, args.target) if args.tail else rollup.query(args.since, args.until, args.target, args.limit))
             return
         if args.list:
-            with open(ping_file, mode='r', encoding='utf-8') as file_handler:
-                reader = csv.DictReader(file_handler)
-                tabulate = "{:<20}{:<12}{:<9}{:<9}{:<13}{:<17}{:<11}".format
-                print('\n' + BRIGHT + GREEN + tabulate(*reader.fieldnames) + RESET_ALL)
-                for row in list(reader):
-                    print(tabulate(*row.values()))
-            print()
+            print_rows(ping_history.name, ping_history.tail(args.tail, args.since, args.until, args.target) if args.tail else ping_history.query(args.since, args.until, args.target, args.limit))
             return
 
         try:
             target = args.target or config_data.get('Target', 'google.com')
             count = args.count or config_data.get('Count', 4)
-
-            ping_data = core.test_ping(target, count, args.size or config_data.get('Size', 1))
+            targets = args.targets or (None if args.target else config_data.get('Targets'))
+            method = args.method or config_data.get('Method', 'icmp')
+
+            if targets:
+                ping_results = core.test_pings(list(dict.fromkeys(targets)), count, args.size or config_data.get('Size', 1), args.interval, method=method)
+                tabulate = "{:<30}{:>6}{:>10}{:>7}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}".format
+                print('\n' + BRIGHT + GREEN + tabulate('Target', 'Sent', 'Received', 'Lost', 'Min', 'Avg', 'Max', 'StdDev', 'P99', 'Jitter') + RESET_ALL)
+                for ping_result in ping_results:
+                    rtts = ("{:.2F}ms".format(rtt * 1000) if ping_result.received else '-' for rtt in (ping_result.rtt_min, ping_result.rtt_avg, ping_result.rtt_max, ping_result.rtt_stddev, ping_result.rtt_p99, ping_result.jitter))
+                    print(tabulate(ping_result.target, ping_result.sent, ping_result.received, "{:.0F}%".format(ping_result.loss * 100), *rtts))
+                print()
+                if args.save:
+                    rows = [ping_result.row() for ping_result in ping_results]
+                    ping_history.append(rows)
+                    compact(ping_history, retention)
+                    if pusher:
+                        pusher.spool.write('ping', rows)
+                return
+
+            if args.max_age is not None and (row := ping_history.latest(args.max_age, Target=target, PackageSent=count)):
+                if args.verbose:
+                    utils.print_dict('Name', 'Value', {**row, 'DateTime': dt.fromtimestamp(float(row['DateTime']), tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')})
+                if not args.verbose:
+                    print(f"Pinged {BRIGHT}{YELLOW}{target}{RESET_ALL} {count} times {BRIGHT}{MAGENTA}({RESET_ALL}Package Lost: {float(row['PackageLost']):3.0F}%{BRIGHT}{MAGENTA}){RESET_ALL} {DIM}[saved {time() - float(row['DateTime']):.0F}s ago]{RESET_ALL}")
+                return
+
+            ping_result = core.test_ping(target, count, args.size or config_data.get('Size', 1), args.interval, method=method)
 
             if args.verbose:
-                utils.print_dict('Name', 'Value', ping_data)
+                utils.print_dict('Name', 'Value', {
+                    'DateTime': dt.fromtimestamp(ping_result.timestamp, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+                    'Target': ping_result.target,
+                    **{name: "{:6.2F}ms".format(rtt * 1000) if ping_result.received else '-' for name, rtt in (
+                        ('PingMin', ping_result.rtt_min),
+                        ('PingAvg', ping_result.rtt_avg),
+                        ('PingMax', ping_result.rtt_max),
+                        ('PingStdDev', ping_result.rtt_stddev),
+                        ('PingP50', ping_result.rtt_p50),
+                        ('PingP90', ping_result.rtt_p90),
+                        ('PingP99', ping_result.rtt_p99),
+                        ('Jitter', ping_result.jitter),
+                    )},
+                    'PackageSent': "{:3}".format(ping_result.sent),
+                    'PackageReceived': "{:3}".format(ping_result.received),
+                    'PackageLost': "{:3.0F}%".format(ping_result.loss * 100)
+                })
 
             if not args.verbose:
-                print(f"Pinged {BRIGHT}{YELLOW}{target}{RESET_ALL} {count} times {BRIGHT}{MAGENTA}({RESET_ALL}Package Lost: {ping_data['PackageLost']}{BRIGHT}{MAGENTA}){RESET_ALL}")
+                print(f"Pinged {BRIGHT}{YELLOW}{target}{RESET_ALL} {count} times {BRIGHT}{MAGENTA}({RESET_ALL}Package Lost: {ping_result.loss * 100:3.0F}%{BRIGHT}{MAGENTA}){RESET_ALL}")
 
             if args.save:
-                ping_data['DateTime'] = time()
-                ping_data['Target'] = target
-                ping_data['PingMin'] = float(ping_data['PingMin'].strip('ms').strip(' '))
-                ping_data['PingMax'] = float(ping_data['PingMax'].strip('ms').strip(' '))
-                ping_data['PackageSent'] = int(ping_data['PackageSent'].strip(' '))
-                ping_data['PackageReceived'] = int(ping_data['PackageReceived'].strip(' '))
-                ping_data['PackageLost'] = float(ping_data['PackageLost'].strip('%').strip(' '))
-                utils.write_csv(ping_file, ping_data)
+                ping_history.append([ping_result.row()])
+                compact(ping_history, retention)
+                if pusher:
+                    pusher.spool.write('ping', [ping_result.row()])
 
         except PermissionError as perm_error:
-            utils.print_on_error("You need root privileges in order to run this command.")
+            utils.print_on_error("You need root privileges in order to run this command, or try --method icmp-dgram, tcp or http.")
             utils.logger.error(str(perm_error))
         except Exception as error:
             utils.print_on_error("Something unexpected happend. The responsible authorities have already been notified.")
             utils.logger.error(str(error))
 
     if args.command == 'bandwidth':
-        bandwidth_file = utils.get_resource_path(BANDWIDTHFILE)
+        bandwidth_history = open_history('bandwidth', config_data.get('History', 'csv'))
 
         if args.path:
-            return bandwidth_file
+            return bandwidth_history.path
         if args.reset:
-            utils.reset_file(bandwidth_file)
+            bandwidth_history.reset()
+            return
+        if args.stats:
+            print_stats(aggregate(Samples.load(bandwidth_history, args.since, args.until), args.resample), args.json)
+            warn_on_rollups(bandwidth_history, args.since, args.until, not args.json)
+            return
+        if args.summary:
+            print_summary(bandwidth_history.summary(), args.json)
+            return
+        if args.list and args.rollup:
+            rollup = bandwidth_history.rollup(args.rollup)
+            print_rows(rollup.name, rollup.tail(args.tail, args.since, args.until) if args.tail else rollup.query(args.since, args.until, None, args.limit))
             return
         if args.list:
-            with open(bandwidth_file, mode='r', encoding='utf-8') as file_handler:
-                reader = csv.DictReader(file_handler)
-                tabulate = "{:<20}{:<9}{:<15}{:<10}{:<8}{:<17}".format
-                print('\n' + BRIGHT + GREEN + tabulate(*reader.fieldnames) + RESET_ALL)
-                for row in list(reader):
-                    print(tabulate(*row.values()))
-            print()
+            print_rows(bandwidth_history.name, bandwidth_history.tail(args.tail, args.since, args.until) if args.tail else bandwidth_history.query(args.since, args.until, None, args.limit))
             return
 
+        if args.max_age is not None and (row := bandwidth_history.latest(args.max_age)):
+            if args.verbose:
+                utils.print_dict('Name', 'Value', {**row, 'DateTime': dt.fromtimestamp(float(row['DateTime']), tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')})
+            if not args.verbose:
+                print(f"Download: {BRIGHT}{YELLOW}{float(row['Download']):6.2F}MB/s{RESET_ALL} | Upload: {BRIGHT}{YELLOW}{float(row['Upload']):6.2F}MB/s{RESET_ALL} {DIM}[saved {time() - float(row['DateTime']):.0F}s ago]{RESET_ALL}")
+            return
+
+        tracer = Tracer() if args.trace else None
+
         try:
-            bandwidth_data = core.test_bandwidth(args.threads or config_data.get('Threads', None))
+            socket_options = SocketOptions(args.rcvbuf, args.sndbuf, args.nodelay, args.congestion, args.quickack)
+            bandwidth_result = core.test_bandwidth(args.threads or config_data.get('Threads', None), socket_options if socket_options.requested() else None, args.interface, tracer, utils.print_progress)
 
             if args.verbose:
-                utils.print_dict('Name', 'Value', bandwidth_data)
+                utils.print_dict('Name', 'Value', {
+                    'DateTime': dt.fromtimestamp(bandwidth_result.timestamp, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+                    'Country': bandwidth_result.client['country'],
+                    'IP': bandwidth_result.client['ip'],
+                    'ISP': bandwidth_result.client['isp'],
+                    'Server': f"{bandwidth_result.server['sponsor']} ({bandwidth_result.server['name']}, {bandwidth_result.server['d']:.0F}km)",
+                    'Ping': "{:6.2F}ms".format(bandwidth_result.ping * 1000),
+                    'Download': "{:6.2F}MB/s".format(bandwidth_result.download / 1_000_000),
+                    'Upload': "{:6.2F}MB/s".format(bandwidth_result.upload / 1_000_000),
+                    'Received': "{:.2F}MB".format(bandwidth_result.bytes_received / 1_000_000),
+                    'Sent': "{:.2F}MB".format(bandwidth_result.bytes_sent / 1_000_000)
+                })
+                if socket_options.requested():
+                    utils.print_dict('Socket Option', 'Effective Value', bandwidth_result.socket_options)
+                if bandwidth_result.tcp_info:
+                    tabulate = "{:<10}{:<8}{:<10}{:<9}{:<7}{:<14}{:<14}{:<14}".format
+                    print(BRIGHT + GREEN + tabulate('Phase', 'Stream', 'RTT', 'Retrans', 'Cwnd', 'Delivery', 'Rwnd Limited', 'Sndbuf Limited') + RESET_ALL)
+                    for phase, streams in bandwidth_result.tcp_info.items():
+                        for stream in streams:
+                            print(tabulate(
+                                phase.title(),
+                                stream['stream'],
+                                "{:.2F}ms".format(stream.get('rtt', 0)),
+                                stream.get('retransmits', '-'),
+                                stream.get('cwnd', '-'),
+                                "{:.2F}MB/s".format(stream.get('delivery_rate', 0) / 1_000_000),
+                                "{:.0F}ms".format(stream.get('rwnd_limited', 0)),
+                                "{:.0F}ms".format(stream.get('sndbuf_limited', 0))
+                            ))
+                    print()
+                if bandwidth_result.interface:
+                    tabulate = "{:<10}{:<12}{:<14}{:<14}{:<14}{:<14}".format
+                    print(BRIGHT + GREEN + tabulate('Phase', 'Interface', 'Application', 'Interface', 'Peak', 'Foreign') + RESET_ALL)
+                    for phase, counters in bandwidth_result.interface.items():
+                        direction = 'rx' if phase == 'download' else 'tx'
+                        print(tabulate(
+                            phase.title(),
+                            counters['interface'],
+                            "{:.2F}MB/s".format(counters['application_bytes'] * 8 / counters['duration'] / 1_000_000 if counters['duration'] else 0),
+                            "{:.2F}MB/s".format(counters[direction] / 1_000_000),
+                            "{:.2F}MB/s".format(counters[f"peak_{direction}"] / 1_000_000),
+                            "{:.2F}MB".format(counters['foreign_bytes'] / 1_000_000)
+                        ))
+                    print()
+                tabulate = "{:<10}{:<10}{:<10}{:<10}{:<13}{:<15}{:<13}".format
+                print(BRIGHT + GREEN + tabulate('Phase', 'Wall', 'Process', 'Threads', 'Utilization', 'Per CPU-Second', 'Client-Bound') + RESET_ALL)
+                for phase, cpu in bandwidth_result.cpu.items():
+                    print(tabulate(
+                        phase.title(),
+                        "{:.2F}s".format(cpu['wall']),
+                        "{:.2F}s".format(cpu['process']),
+                        "{:.2F}s".format(cpu['threads']),
+                        "{:.0F}%".format(cpu['utilization'] * 100),
+                        "{:.2F}MB".format(cpu['bytes_per_cpu_second'] / 1_000_000),
+                        'yes' if cpu['client_bound'] else 'no'
+                    ))
+                print()
+
+            for phase, counters in bandwidth_result.interface.items():
+                if counters['error']:
+                    utils.print_on_warning(f"Sampling interface {counters['interface']} during the {phase} stopped early: {counters['error']}")
+                    utils.logger.warning(f"Sampling interface {counters['interface']} failed: {counters['error']}")
+
+            for phase, cpu in bandwidth_result.cpu.items():
+                if cpu['client_bound']:
+                    utils.print_on_warning(f"The {phase} result is client-bound, this machine's CPU was the bottleneck")
 
             if not args.verbose:
-                print(f"Download: {BRIGHT}{YELLOW}{bandwidth_data['Download']}{RESET_ALL} | Upload: {BRIGHT}{YELLOW}{bandwidth_data['Upload']}{RESET_ALL}")
+                print(f"Download: {BRIGHT}{YELLOW}{bandwidth_result.download / 1_000_000:6.2F}MB/s{RESET_ALL} | Upload: {BRIGHT}{YELLOW}{bandwidth_result.upload / 1_000_000:6.2F}MB/s{RESET_ALL}")
 
             if args.save:
-                bandwidth_data['DateTime'] = time()
-                bandwidth_data['Download'] = bandwidth_data['Download'].strip('MB/s').strip(' ')
-                bandwidth_data['Upload'] = bandwidth_data['Upload'].strip('MB/s').strip(' ')
-                utils.write_csv(bandwidth_file, bandwidth_data)
+                bandwidth_history.append([bandwidth_result.row()])
+                compact(bandwidth_history, retention)
+                if pusher:
+                    pusher.spool.write('bandwidth', [bandwidth_result.row()])
 
+        except InterfaceCountersError as error:
+            utils.print_on_error(f"Cannot cross-check against interface counters: {error}")
+            utils.logger.error(str(error))
         except Exception as error:
             utils.print_on_error("Something unexpected happend. The responsible authorities have already been notified.")
             utils.logger.error(str(error))
+        finally:
+            if tracer:
+                tracer.write(args.trace)
+
+    if args.command == 'push':
+        if not pusher:
+            utils.print_on_warning("Nothing to push because no collector is configured, see 'speedtest config --collector'")
+            return
+        if args.status:
+            print(f"{len(pusher.spool)} results waiting to be pushed to {pusher.collector.url}")
+            return
+        count = pusher.push(force=True)
+        pending = len(pusher.spool)
+        if pending:
+            utils.print_on_warning(f"Pushed {count} results, {pending} are still waiting to be pushed to {pusher.collector.url}")
+        else:
+            utils.print_on_success(f"Pushed {count} results to {pusher.collector.url}")
+        pusher.close()
+
+    if args.command == 'export':
+        history = open_history(args.name, config_data.get('History', 'csv'))
+        try:
+            count, mark = export(history, args.output, args.format, None if args.full else read_mark(args.name), args.batch_size)
+        except (ImportError, ValueError, OSError) as error:
+            utils.print_on_error(str(error))
+            utils.logger.error(str(error))
+            return
+        finally:
+            history.close()
+        if mark is not None:
+            write_mark(args.name, mark)
+        if args.output:
+            utils.print_on_success(f"Exported {count} {args.name} results to {args.output}")
+
+    if args.command == 'daemon':
+        ping_interval = args.ping_interval if args.ping_interval is not None else config_data.get('PingInterval', 60)
+        bandwidth_interval = args.bandwidth_interval if args.bandwidth_interval is not None else config_data.get('BandwidthInterval', 3600)
+
+        metrics = MetricsRegistry(args.metrics_textfile) if args.metrics_port or args.metrics_textfile else None
+        daemon = Daemon(BatchWriter(args.batch_size, args.flush_interval, pusher.spool if pusher else None), metrics)
+        ping_history = open_history('ping', config_data.get('History', 'csv'))
+        bandwidth_history = open_history('bandwidth', config_data.get('History', 'csv'))
+        targets = args.targets or (None if args.target else config_data.get('Targets'))
+        method = args.method or config_data.get('Method', 'icmp')
+        if ping_interval and targets:
+            daemon.schedule_pings(ping_history, list(dict.fromkeys(targets)), args.count or config_data.get('Count', 4), args.size or config_data.get('Size', 1), ping_interval, args.jitter, method)
+        elif ping_interval:
+            target = args.target or config_data.get('Target', 'google.com')
+            daemon.schedule_ping(ping_history, target, args.count or config_data.get('Count', 4), args.size or config_data.get('Size', 1), ping_interval, args.jitter, method)
+        if bandwidth_interval:
+            daemon.schedule_bandwidth(bandwidth_history, SpeedtestSession(), args.threads or config_data.get('Threads', None), bandwidth_interval, args.jitter)
+        if not daemon.jobs:
+            utils.print_on_warning("Nothing to do because all tests are disabled")
+            return
+        if retention.raw_days is not None:
+            daemon.schedule_compaction([ping_history, bandwidth_history], retention)
+        if pusher:
+            daemon.schedule_push(pusher, args.push_interval)
+        if args.metrics_port:
+            MetricsServer(metrics, args.metrics_host, args.metrics_port).start()
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+        utils.print_on_success(f"Running ping tests every {ping_interval or '-'}s and bandwidth tests every {bandwidth_interval or '-'}s, press Ctrl+C to stop", args.verbose)
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            pass
+
+    if args.command == 'serve':
+        service = SpeedtestService(
+            SpeedtestSession(),
+            args.threads or config_data.get('Threads', None),
+            args.max_pending,
+            open_history('ping', config_data.get('History', 'csv')) if args.save else None,
+            open_history('bandwidth', config_data.get('History', 'csv')) if args.save else None,
+            pusher if args.save else None,
+            MetricsRegistry(args.metrics_textfile)
+        )
+        server = UnixAPIServer(args.unix) if args.unix else APIServer(args.host, args.port)
+        server.configure(service, {'target': config_data.get('Target', 'google.com'), 'count': config_data.get('Count', 4), 'size': config_data.get('Size', 1), 'method': config_data.get('Method', 'icmp')})
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+        utils.print_on_success(f"Serving on {args.unix or f'http://{args.host}:{args.port}'}, press Ctrl+C to stop", args.verbose)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -4,6 +4,9 @@
 CONFIGFILE = 'config.json'
 PINGFILE = 'ping.csv'
 BANDWIDTHFILE = 'bandwidth.csv'
+HISTORYDB = 'history.db'
+EXPORTFILE = 'export.json'
+SPOOLDIR = 'spool'
 
 #region colors and styles
 
@@ -1,45 +1,213 @@
 #!/usr/bin/env python3
 
-from datetime import datetime as dt
-from datetime import timezone
+from time import time
+from typing import Callable, Dict, List, Optional, Sequence, Union
 
 from pythonping import ping
 
-from .speedtest import Speedtest
-
-
-def test_ping(target: str, count: int, size: int) -> dict:
-    """
-    Ping a remote host and return the responses data.
-    """
-    now = dt.now(tz=timezone.utc)
-    ping_result = ping(target=target, count=count, size=size)
-    return {
-        'DateTime': now.strftime('%Y-%m-%d %H:%M:%S'),
-        'Target': target,
-        'PingMin': "{:6.2F}ms".format(ping_result.rtt_min_ms),
-        'PingMax': "{:6.2F}ms".format(ping_result.rtt_max_ms),
-        'PackageSent': "{:3}".format(count),
-        'PackageReceived': "{:3.0F}".format(count - ping_result.packet_loss),
-        'PackageLost': "{:3.0F}%".format(ping_result.packet_loss / count * 100)
-    }
-
-def test_bandwidth(threads: int) -> dict:
-    """
-    Perform a bandwidth test and return the response data.
-    """
-    now = dt.now(tz=timezone.utc)
-    test = Speedtest()
-    test.get_servers()
-    test.get_best_server()
-    test.download(threads=threads)
-    test.upload(threads=threads)
-    result = test.results.dict()
-    return {
-        'DateTime': now.strftime('%Y-%m-%d %H:%M:%S'),
-        'Country': result['client']['country'],
-        'IP': result['client']['ip'],
-        'Download': "{:6.2F}MB/s".format(int(result['download']) / 1_000_000),
-        'Upload': "{:6.2F}MB/s".format(int(result['upload']) / 1_000_000),
-        'ISP': result['client']['isp'],
-    }
+from . import icmp, probe
+from .speedtest import ProgressEvent, SocketOptions, SpeedtestSession, Tracer
+from .streaming import RTTStatistics
+
+METHODS = ('icmp', 'icmp-dgram', *probe.METHODS)
+
+#region result records
+
+class PingResult:
+    """
+    Outcome of a ping test. `timestamp` is a UNIX time, round-trip times and
+    `jitter` (RFC 3550) are in seconds and `size` is the payload size in bytes.
+    Percentiles are estimates, see `streaming.TDigest`. Targets that never
+    answered have no round-trip times and `jitter`, they are all `None`.
+    """
+    __slots__ = ('timestamp', 'target', 'size', 'sent', 'received', 'rtt_min', 'rtt_avg', 'rtt_max', 'rtt_stddev', 'rtt_p50', 'rtt_p90', 'rtt_p99', 'jitter')
+
+    def __init__(self, timestamp: float, target: str, size: int, sent: int, received: int, rtt_min: Optional[float], rtt_avg: Optional[float], rtt_max: Optional[float], rtt_stddev: Optional[float]=0.0, rtt_p50: Optional[float]=None, rtt_p90: Optional[float]=None, rtt_p99: Optional[float]=None, jitter: Optional[float]=0.0):
+        self.timestamp = timestamp
+        self.target = target
+        self.size = size
+        self.sent = sent
+        self.received = received
+        self.rtt_min = rtt_min
+        self.rtt_avg = rtt_avg
+        self.rtt_max = rtt_max
+        self.rtt_stddev = rtt_stddev
+        self.rtt_p50 = rtt_avg if rtt_p50 is None else rtt_p50
+        self.rtt_p90 = rtt_max if rtt_p90 is None else rtt_p90
+        self.rtt_p99 = rtt_max if rtt_p99 is None else rtt_p99
+        self.jitter = jitter
+
+    @property
+    def lost(self) -> int:
+        return self.sent - self.received
+
+    @property
+    def loss(self) -> float:
+        """
+        Fraction of packets that went unanswered.
+        """
+        return self.lost / self.sent if self.sent else 0.0
+
+    def row(self) -> Dict[str, Union[str, int, float]]:
+        """
+        Return this result in the column layout and units of the ping history.
+        """
+        def milliseconds(seconds: Optional[float]) -> Optional[float]:
+            return None if seconds is None else seconds * 1000
+
+        return {
+            'DateTime': self.timestamp,
+            'Target': self.target,
+            'PingMin': milliseconds(self.rtt_min),
+            'PingMax': milliseconds(self.rtt_max),
+            'PackageSent': self.sent,
+            'PackageReceived': self.received,
+            'PackageLost': self.loss * 100,
+            'PingAvg': milliseconds(self.rtt_avg),
+            'PingStdDev': milliseconds(self.rtt_stddev),
+            'PingP50': milliseconds(self.rtt_p50),
+            'PingP90': milliseconds(self.rtt_p90),
+            'PingP99': milliseconds(self.rtt_p99),
+            'Jitter': milliseconds(self.jitter),
+        }
+
+    def dict(self) -> Dict[str, Union[str, int, float]]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class BandwidthResult:
+    """
+    Outcome of a bandwidth test. `timestamp` is a UNIX time, `download` and
+    `upload` are in bits per second, `ping` is the latency to `server` in
+    seconds and the byte counts are application payload. `server` and `client`
+    hold the metadata reported by speedtest.net, the remaining fields hold the
+    optional diagnostics of `SpeedtestResults` and are empty if not collected.
+    """
+    __slots__ = ('timestamp', 'download', 'upload', 'ping', 'bytes_sent', 'bytes_received', 'server', 'client', 'socket_options', 'tcp_info', 'interface', 'cpu', 'timings')
+
+    def __init__(self, timestamp: float, download: float, upload: float, ping: float, bytes_sent: int, bytes_received: int, server: Dict, client: Dict, socket_options: Optional[Dict]=None, tcp_info: Optional[Dict]=None, interface: Optional[Dict]=None, cpu: Optional[Dict]=None, timings: Optional[Dict]=None):
+        self.timestamp = timestamp
+        self.download = download
+        self.upload = upload
+        self.ping = ping
+        self.bytes_sent = bytes_sent
+        self.bytes_received = bytes_received
+        self.server = server
+        self.client = client
+        self.socket_options = socket_options or {}
+        self.tcp_info = tcp_info or {}
+        self.interface = interface or {}
+        self.cpu = cpu or {}
+        self.timings = timings or {}
+
+    @classmethod
+    def from_results(cls, timestamp: float, results: Dict) -> 'BandwidthResult':
+        """
+        Build a record from the dictionary returned by `SpeedtestResults.dict`.
+        """
+        return cls(
+            timestamp,
+            results['download'],
+            results['upload'],
+            results['ping'] / 1000,
+            results['bytes_sent'],
+            results['bytes_received'],
+            results['server'],
+            results['client'],
+            results['socket_options'],
+            results['tcp_info'],
+            results['interface'],
+            results['cpu'],
+            results['timings']
+        )
+
+    def row(self) -> Dict[str, Union[str, float]]:
+        """
+        Return this result in the column layout and units of the bandwidth history.
+        """
+        return {
+            'DateTime': self.timestamp,
+            'Country': self.client.get('country'),
+            'IP': self.client.get('ip'),
+            'Download': self.download / 1_000_000,
+            'Upload': self.upload / 1_000_000,
+            'ISP': self.client.get('isp'),
+        }
+
+    def dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+#endregion result records
+
+def _ping_result(timestamp: float, target: str, size: int, statistics: RTTStatistics) -> PingResult:
+    running = statistics.running
+    answered = statistics.received > 0
+    return PingResult(
+        timestamp,
+        target,
+        size,
+        statistics.sent,
+        statistics.received,
+        running.min if answered else None,
+        running.mean if answered else None,
+        running.max if answered else None,
+        running.stddev if answered else None,
+        statistics.percentile(50) if answered else None,
+        statistics.percentile(90) if answered else None,
+        statistics.percentile(99) if answered else None,
+        statistics.jitter.value if answered else None
+    )
+
+def test_ping(target: str, count: int, size: int, interval: Optional[float]=None, timeout: float=2.0, method: str='icmp') -> PingResult:
+    """
+    Ping a remote host and return the responses data. ICMP echo requests are
+    sent by `pythonping`, back to back unless an `interval` is given, the other
+    methods work as in `test_pings`.
+    """
+    if method != 'icmp':
+        return test_pings([target], count, size, interval, timeout, method)[0]
+    timestamp = time()
+    statistics = RTTStatistics()
+    statistics.sent = count
+    for response in ping(target=target, count=count, size=size, interval=interval or 0, timeout=timeout):
+        if response.success:
+            statistics.add(response.time_elapsed)
+    return _ping_result(timestamp, target, size, statistics)
+
+def test_pings(targets: Sequence[str], count: int, size: int, interval: Optional[float]=None, timeout: float=2.0, method: str='icmp') -> List[PingResult]:
+    """
+    Ping all `targets` concurrently and return one result per target. The
+    `method` is one of `METHODS`: ICMP echo requests over one socket, see
+    `icmp.ping_many`, optionally forcing the unprivileged datagram socket
+    (`icmp-dgram`), or TCP connect and HTTP request latencies, see
+    `probe.probe_many`, which `size` does not apply to. Requests to each
+    target are `interval` seconds apart, 0.2 by default. Targets that never
+    answered are reported without round-trip times.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown ping method {method}, expected one of: {', '.join(METHODS)}")
+    interval = 0.2 if interval is None else interval
+    timestamp = time()
+    if method in probe.METHODS:
+        measured = probe.probe_many(targets, method, count, interval, timeout)
+    else:
+        measured = icmp.ping_many(targets, count, size, interval, timeout, datagram=method == 'icmp-dgram')
+    return [_ping_result(timestamp, target, size, statistics) for target, statistics in measured.items()]
+
+def test_bandwidth(threads: int, socket_options: SocketOptions=None, interface: Union[bool, str]=None, tracer: Tracer=None, progress: Callable[[ProgressEvent], None]=None, session: SpeedtestSession=None) -> BandwidthResult:
+    """
+    Perform a bandwidth test and return the response data. The socket values
+    granted by the kernel are recorded if `socket_options` were requested,
+    per-stream TCP statistics where supported and the counters of the egress
+    `interface` (`True` to auto-detect it) if requested. Timeline events are
+    collected into `tracer` if provided, `progress` receives rate-limited
+    progress events during the download and upload.
+
+    Long-running callers should pass the same `session` to every call to reuse
+    its configuration and server selection, `socket_options`, `interface` and
+    `tracer` are then taken from the session instead.
+    """
+    timestamp = time()
+    session = session or SpeedtestSession(socket_options=socket_options, interface_counters=interface, tracer=tracer)
+    results = session.measure(threads=threads, progress=progress)
+    return BandwidthResult.from_results(timestamp, results.dict())
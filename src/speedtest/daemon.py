@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+import heapq
+import random
+import sqlite3
+import threading
+from time import monotonic
+from typing import Callable, Dict, List, Optional
+
+from . import core, utils
+from .history import History
+from .metrics import MetricsRegistry
+from .push import Pusher, Spool
+from .retention import RetentionPolicy, compact
+from .speedtest import SpeedtestSession
+
+#region batch writer
+
+class BatchWriter:
+    """
+    Buffer result rows in memory and append them to their `History` once
+    `batch_size` rows are pending or `flush_interval` seconds have passed
+    since the last flush, whichever comes first. Rows are also added to the
+    `spool` of a collector if given. Rows that could not be written are kept
+    for the next flush, at most `max_retained` per history and destination.
+    """
+    def __init__(self, batch_size: int=10, flush_interval: float=300, spool: Optional[Spool]=None, max_retained: int=1000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool = spool
+        self.max_retained = max_retained
+        self.buffers: Dict[History, List[Dict]] = {}
+        self.spooled: Dict[History, List[Dict]] = {}
+        self.pending = 0
+        self.flushed = monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def deadline(self) -> float:
+        """
+        Monotonic time at which pending rows are due to be written.
+        """
+        return self.flushed + self.flush_interval
+
+    def write(self, history: History, row: Dict) -> None:
+        with self.lock:
+            self.buffers.setdefault(history, []).append(row)
+            if self.spool is not None:
+                self.spooled.setdefault(history, []).append(row)
+            self.pending += 1
+            due = self.pending >= self.batch_size
+        if due:
+            self.flush()
+
+    def _retain(self, history: History, rows: List[Dict], destination: str) -> List[Dict]:
+        if len(rows) > self.max_retained:
+            utils.logger.warning(f"Dropped {len(rows) - self.max_retained} {history.name} results that could not be {destination} for too long")
+            rows = rows[-self.max_retained:]
+        return rows
+
+    def flush(self) -> None:
+        """
+        Write all pending rows, one append per history, which CSV histories
+        turn into a single locked write. The history and the spool are retried
+        separately, so neither receives a row twice.
+        """
+        with self.lock:
+            buffers, spooled = {}, {}
+            for history, rows in self.buffers.items():
+                try:
+                    history.append(rows)
+                except (OSError, sqlite3.Error) as error:
+                    utils.logger.error(f"Could not save {len(rows)} {history.name} results to {history.path}: {error}")
+                    buffers[history] = self._retain(history, rows, 'saved')
+            for history, rows in self.spooled.items():
+                try:
+                    self.spool.write(history.name, rows)
+                except OSError as error:
+                    utils.logger.error(f"Could not spool {len(rows)} {history.name} results: {error}")
+                    spooled[history] = self._retain(history, rows, 'spooled')
+            self.buffers, self.spooled = buffers, spooled
+            self.pending = 0
+            self.flushed = monotonic()
+
+#endregion batch writer
+
+#region scheduling
+
+class Job:
+    """
+    A `task` that is run every `interval` seconds. Every run is shifted by a
+    random amount of up to `jitter` times the interval so that several hosts
+    started at the same time don't test in lockstep. Runs of jobs that share
+    the same `lock` never overlap, a run that is due while the lock is held is
+    skipped.
+    """
+    def __init__(self, name: str, interval: float, task: Callable[[], None], jitter: float=0.1, lock: Optional[threading.Lock]=None):
+        self.name = name
+        self.interval = interval
+        self.task = task
+        self.jitter = jitter
+        self.lock = lock or threading.Lock()
+
+    def delay(self) -> float:
+        """
+        Return the time until the next run.
+        """
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def run(self) -> None:
+        try:
+            self.task()
+        except Exception as error:
+            utils.logger.error(f"The scheduled {self.name} test failed: {error}")
+        finally:
+            self.lock.release()
+
+
+class Daemon:
+    """
+    Run scheduled ping and bandwidth tests in one long-lived process and save
+    their results through a `BatchWriter`. Bandwidth tests share one lock so
+    that at most one of them saturates the link at any time. Results are also
+    recorded in `metrics` if given.
+
+    ```python
+    daemon = Daemon(BatchWriter())
+    daemon.schedule_ping(open_history('ping'), 'google.com', 4, 1, interval=60)
+    daemon.schedule_bandwidth(open_history('bandwidth'), SpeedtestSession(), None, interval=3600)
+    daemon.run()
+    ```
+    """
+    def __init__(self, writer: BatchWriter, metrics: Optional[MetricsRegistry]=None):
+        self.writer = writer
+        self.metrics = metrics
+        self.jobs: List[Job] = []
+        self.bandwidth_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.threads: List[threading.Thread] = []
+
+    def schedule_ping(self, history: History, target: str, count: int, size: int, interval: float, jitter: float=0.1, method: str='icmp') -> Job:
+        def task():
+            result = core.test_ping(target, count, size, method=method)
+            utils.logger.info(f"Pinged {target}: {result.loss * 100:.0F}% lost" + (f", {result.rtt_avg * 1000:.2F}ms average" if result.received else ''))
+            self.writer.write(history, result.row())
+            if self.metrics:
+                self.metrics.observe_ping(result)
+
+        job = Job('ping', interval, task, jitter)
+        self.jobs.append(job)
+        return job
+
+    def schedule_pings(self, history: History, targets: List[str], count: int, size: int, interval: float, jitter: float=0.1, method: str='icmp') -> Job:
+        """
+        Ping all `targets` at once per run, see `core.test_pings`.
+        """
+        def task():
+            results = core.test_pings(targets, count, size, method=method)
+            utils.logger.info(f"Pinged {len(results)} targets: {sum(result.lost for result in results)} of {sum(result.sent for result in results)} packets lost")
+            for result in results:
+                self.writer.write(history, result.row())
+                if self.metrics:
+                    self.metrics.observe_ping(result)
+
+        job = Job('ping', interval, task, jitter)
+        self.jobs.append(job)
+        return job
+
+    def schedule_bandwidth(self, history: History, session: SpeedtestSession, threads: Optional[int], interval: float, jitter: float=0.1) -> Job:
+        def task():
+            result = core.test_bandwidth(threads, session=session)
+            utils.logger.info(f"Bandwidth: {result.download / 1_000_000:.2F}MB/s down, {result.upload / 1_000_000:.2F}MB/s up")
+            self.writer.write(history, result.row())
+            if self.metrics:
+                self.metrics.observe_bandwidth(result)
+
+        job = Job('bandwidth', interval, task, jitter, self.bandwidth_lock)
+        self.jobs.append(job)
+        return job
+
+    def schedule_compaction(self, histories: List[History], policy: RetentionPolicy, interval: float=3600) -> Job:
+        """
+        Roll up expired results in between tests, see `retention.compact`.
+        """
+        def task():
+            with self.writer.lock:
+                for history in histories:
+                    if count := compact(history, policy):
+                        utils.logger.info(f"Rolled up {count} {history.name} results")
+
+        job = Job('compaction', interval, task, 0.1)
+        self.jobs.append(job)
+        return job
+
+    def schedule_push(self, pusher: Pusher, interval: float=60) -> Job:
+        """
+        Push spooled results to the collector, backing off while it is unreachable.
+        """
+        def task():
+            if count := pusher.push():
+                utils.logger.info(f"Pushed {count} results to {pusher.collector.url}")
+
+        job = Job('push', interval, task, 0.1)
+        self.jobs.append(job)
+        return job
+
+    def _start(self, job: Job) -> None:
+        if not job.lock.acquire(blocking=False):
+            utils.logger.warning(f"Skipped a scheduled {job.name} test because another one is still running")
+            return
+        thread = threading.Thread(target=job.run, name=job.name, daemon=True)
+        thread.start()
+        self.threads = [thread for thread in self.threads if thread.is_alive()] + [thread]
+
+    def run(self) -> None:
+        """
+        Run jobs until `stop` is called, then wait for running tests to finish
+        and write all pending results.
+        """
+        # Spread the first runs as well in case many hosts boot at once
+        now = monotonic()
+        queue = [(now + random.uniform(0, job.interval * job.jitter), index, job) for index, job in enumerate(self.jobs)]
+        heapq.heapify(queue)
+
+        try:
+            while queue and not self.stop_event.is_set():
+                due, index, job = queue[0]
+                if self.stop_event.wait(max(0, min(due, self.writer.deadline) - monotonic())):
+                    break
+                now = monotonic()
+                if now >= self.writer.deadline:
+                    self.writer.flush()
+                if now >= due:
+                    # Keep to the schedule, but drop runs that were missed entirely
+                    following = due + job.delay()
+                    heapq.heapreplace(queue, (following if following > now else now + job.delay(), index, job))
+                    self._start(job)
+        finally:
+            for thread in self.threads:
+                thread.join()
+            self.writer.flush()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+#endregion scheduling
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sys
+from datetime import datetime as dt
+from datetime import timezone
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from . import utils
+from .config import EXPORTFILE
+from .history import COLUMNS, History
+
+FORMATS = ('ndjson', 'parquet', 'arrow')
+SUFFIXES = {'.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow'}
+
+CONVERTERS = {'REAL': float, 'INTEGER': int, 'TEXT': str}
+
+#region batches
+
+def guess_format(path: Optional[Union[str, Path]]) -> str:
+    """
+    Return the export format that matches the suffix of `path`, NDJSON by default.
+    """
+    return SUFFIXES.get(Path(path).suffix.lower(), 'ndjson') if path else 'ndjson'
+
+def batches(history: History, mark: Optional[Dict]=None, batch_size: int=10_000) -> Iterator[Tuple[Dict[str, List], Dict]]:
+    """
+    Yield the rows of `history` appended after the high-water `mark` as typed
+    columns of at most `batch_size` rows together with the mark of the last
+    one, so that memory use stays bounded no matter how long the history is.
+    Rows come in the order they were appended, `DateTime` stays a UNIX time.
+    """
+    types = COLUMNS[history.name]
+    changes = history.changes(mark)
+    while batch := list(islice(changes, batch_size)):
+        # Rows without a readable timestamp are skipped, but still move the mark
+        rows = [row for row, _ in batch if utils.read_timestamp(row.get('DateTime')) is not None]
+        columns = {}
+        for column, kind in types.items():
+            convert = utils.parse_timestamp if column == 'DateTime' else CONVERTERS[kind]
+            columns[column] = [None if row.get(column) in (None, '') else convert(row[column]) for row in rows]
+        yield columns, batch[-1][1]
+
+#endregion batches
+
+#region writers
+
+def _isoformat(timestamp: float) -> str:
+    return dt.fromtimestamp(timestamp, tz=timezone.utc).isoformat(timespec='microseconds').replace('+00:00', 'Z')
+
+def _write_ndjson(file_handler, columns: Dict[str, List]) -> None:
+    names = list(columns)
+    lines = []
+    for values in zip(*columns.values()):
+        record = dict(zip(names, values))
+        record['DateTime'] = _isoformat(record['DateTime'])
+        lines.append(json.dumps(record) + '\n')
+    file_handler.writelines(lines)
+
+def _schema(name: str) -> 'pa.Schema':
+    types = {'REAL': pa.float64(), 'INTEGER': pa.int64(), 'TEXT': pa.string()}
+    return pa.schema([(column, pa.timestamp('us', tz='UTC') if column == 'DateTime' else types[kind]) for column, kind in COLUMNS[name].items()])
+
+def _record_batch(schema: 'pa.Schema', columns: Dict[str, List]) -> 'pa.RecordBatch':
+    # Arrow timestamps are integers, microseconds keep the full resolution of time()
+    columns = {**columns, 'DateTime': [round(timestamp * 1_000_000) for timestamp in columns['DateTime']]}
+    return pa.RecordBatch.from_pydict(columns, schema=schema)
+
+#endregion writers
+
+def export(history: History, output: Optional[Union[str, Path]]=None, format: Optional[str]=None, mark: Optional[Dict]=None, batch_size: int=10_000) -> Tuple[int, Optional[Dict]]:
+    """
+    Export the rows of `history` appended after the high-water `mark` to `output`,
+    or as NDJSON to the standard output without one, and return the number of
+    exported rows and the new high-water mark. Files are written next to their
+    destination first and only replace it once the export is complete.
+
+    Parquet and Arrow IPC files require `pyarrow`, timestamps are stored as UTC
+    timestamps with microsecond precision, in NDJSON as ISO 8601 strings.
+    """
+    format = format or guess_format(output)
+    if format not in FORMATS:
+        raise ValueError(f"Unknown export format {format}, expected one of: {', '.join(FORMATS)}")
+    if format != 'ndjson' and pa is None:
+        raise ImportError(f"Exporting to {format} requires pyarrow, install it with 'pip install pyarrow'")
+    if output is None and format != 'ndjson':
+        raise ValueError(f"Exporting to {format} requires an output file")
+
+    count, last = 0, mark
+    if output is None:
+        for columns, last in batches(history, mark, batch_size):
+            _write_ndjson(sys.stdout, columns)
+            count += len(columns['DateTime'])
+        sys.stdout.flush()
+        return count, last
+
+    output = Path(output)
+    temporary = output.with_name(f".{output.name}.tmp")
+    try:
+        if format == 'ndjson':
+            with open(temporary, mode='w', encoding='utf-8') as file_handler:
+                for columns, last in batches(history, mark, batch_size):
+                    _write_ndjson(file_handler, columns)
+                    count += len(columns['DateTime'])
+        else:
+            schema = _schema(history.name)
+            writer = pq.ParquetWriter(temporary, schema) if format == 'parquet' else pa.ipc.new_file(str(temporary), schema)
+            with writer:
+                for columns, last in batches(history, mark, batch_size):
+                    writer.write_batch(_record_batch(schema, columns))
+                    count += len(columns['DateTime'])
+        os.replace(temporary, output)
+    finally:
+        if temporary.exists():
+            temporary.unlink()
+    return count, last
+
+#region high-water marks
+
+def read_mark(name: str) -> Optional[Dict]:
+    """
+    Return the position of the last exported row of the `name` history, if any.
+    Timestamps written by earlier versions export the whole history once.
+    """
+    mark = utils.read_json_file(EXPORTFILE).get(name)
+    return mark if isinstance(mark, dict) else None
+
+def write_mark(name: str, mark: Dict) -> None:
+    utils.write_json_file(EXPORTFILE, {name: mark})
+
+#endregion high-water marks
@@ -0,0 +1,656 @@
+#!/usr/bin/env python3
+
+import csv
+import heapq
+import json
+import math
+import mmap
+import os
+import shutil
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from json import JSONDecodeError
+from pathlib import Path
+from time import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from . import utils
+from .config import BANDWIDTHFILE, HISTORYDB, PINGFILE
+from .summary import BUCKET, WINDOWS, SummaryIndex, window_start
+
+COLUMNS = {
+    'ping': {'DateTime': 'REAL', 'Target': 'TEXT', 'PingMin': 'REAL', 'PingMax': 'REAL', 'PackageSent': 'INTEGER', 'PackageReceived': 'INTEGER', 'PackageLost': 'REAL', 'PingAvg': 'REAL', 'PingStdDev': 'REAL', 'PingP50': 'REAL', 'PingP90': 'REAL', 'PingP99': 'REAL', 'Jitter': 'REAL'},
+    'bandwidth': {'DateTime': 'REAL', 'Country': 'TEXT', 'IP': 'TEXT', 'Download': 'REAL', 'Upload': 'REAL', 'ISP': 'TEXT'},
+}
+
+METRICS = {
+    'ping': ('PingMin', 'PingMax', 'PackageLost', 'PingAvg', 'PingStdDev', 'PingP50', 'PingP90', 'PingP99', 'Jitter'),
+    'bandwidth': ('Download', 'Upload'),
+}
+
+# Rollups summarize the metrics of all results per target and time bucket
+LEVELS = {'hourly': 3600, 'daily': 86400}
+STATISTICS = ('Min', 'P50', 'P95', 'Max', 'Mean')
+
+COLUMNS.update({
+    f"{name}_{level}": {
+        'DateTime': 'REAL',
+        **({'Target': 'TEXT'} if 'Target' in COLUMNS[name] else {}),
+        'Count': 'INTEGER',
+        **{f"{metric}{statistic}": 'REAL' for metric in METRICS[name] for statistic in STATISTICS},
+    }
+    for name in METRICS for level in LEVELS
+})
+
+FILES = {
+    'ping': PINGFILE,
+    'bandwidth': BANDWIDTHFILE,
+    **{f"{name}_{level}": f"{Path(filename).stem}.{level}.csv" for name, filename in (('ping', PINGFILE), ('bandwidth', BANDWIDTHFILE)) for level in LEVELS},
+}
+
+BACKENDS = ('csv', 'sqlite')
+
+# Versions up to 2.0.0 saved formatted values such as ` 10.23ms`, `  0%` and `  12.34MB/s`
+UNITS = ('ms', '%', 'MB/s')
+
+# Rows may be appended up to this many seconds out of chronological order:
+# results are stamped when a test starts, the daemon saves them in batches and
+# several processes may share one history
+DISORDER = 86400
+
+def normalize_row(name: str, row: Dict) -> Dict:
+    """
+    Return `row` of the `name` history with the cells saved by versions up to
+    2.0.0 converted to the current layout: `DateTime` becomes a UNIX time and
+    numbers lose their padding and units. Current rows are returned unchanged.
+    """
+    normalized = {}
+    for column, value in row.items():
+        kind = COLUMNS[name].get(column)
+        if isinstance(value, str) and kind in ('REAL', 'INTEGER'):
+            value = value.strip()
+            if column == 'DateTime' and value:
+                value = str(utils.parse_timestamp(value))
+            else:
+                for unit in UNITS:
+                    if value.endswith(unit):
+                        value = value[:-len(unit)].strip()
+                        break
+        normalized[column] = value
+    return normalized
+
+#region backends
+
+class History(ABC):
+    """
+    Append-only store of `ping` or `bandwidth` results. Rows are dictionaries
+    keyed by the column names in `COLUMNS`, `DateTime` is a UNIX time.
+    """
+    def __init__(self, name: str, path: Path):
+        self.name = name
+        self.path = path
+        self.columns = list(COLUMNS[name])
+
+    @abstractmethod
+    def append(self, rows: List[Dict]) -> None:
+        """
+        Append `rows` in one go.
+        """
+
+    @abstractmethod
+    def query(self, since: Optional[float]=None, until: Optional[float]=None, target: Optional[str]=None, limit: Optional[int]=None) -> Iterator[Dict]:
+        """
+        Yield rows in chronological order, starting at `since` and stopping
+        before `until`, optionally only those of `target` and at most `limit`.
+        """
+
+    @abstractmethod
+    def tail(self, count: int, since: Optional[float]=None, until: Optional[float]=None, target: Optional[str]=None) -> List[Dict]:
+        """
+        Return the last `count` rows of the selection made by `query` in
+        chronological order.
+        """
+
+    @abstractmethod
+    def changes(self, after: Optional[Dict]=None) -> Iterator[Tuple[Dict, Dict]]:
+        """
+        Yield the rows appended after the position `after` in the order they
+        were appended, each together with its own position. Positions are small
+        JSON objects that stay valid when old rows are removed, pass the last
+        one to continue where a previous call stopped.
+        """
+
+    @abstractmethod
+    def latest(self, max_age: float, **columns) -> Optional[Dict]:
+        """
+        Return the newest row that is at most `max_age` seconds old and
+        matches all `columns`, if any.
+        """
+
+    @abstractmethod
+    def oldest(self) -> Optional[float]:
+        """
+        Return the timestamp of the first row, if any.
+        """
+
+    @abstractmethod
+    def remove_before(self, cutoff: float) -> None:
+        """
+        Delete all rows older than `cutoff`.
+        """
+
+    @abstractmethod
+    def rollup(self, level: str) -> 'History':
+        """
+        Open the `hourly` or `daily` rollup of this history in the same backend.
+        """
+
+    @abstractmethod
+    def summary(self, target: Optional[str]=None, now: Optional[float]=None) -> List[Dict]:
+        """
+        Return the last row and the count, minimum, maximum and mean of every
+        metric over the last day and week per target, or only for `target`.
+        Both windows start at a full hour.
+        """
+
+    @abstractmethod
+    def reset(self) -> None:
+        """
+        Delete all rows.
+        """
+
+    def close(self) -> None:
+        pass
+
+
+class CSVHistory(History):
+    """
+    History kept in a CSV file, one row per line. Rows are appended in nearly
+    chronological order, which lets time ranges be found by binary search
+    widened by `DISORDER`.
+    Ping and bandwidth histories keep a `SummaryIndex` next to them that is
+    updated on every append. Files written before columns were added to the
+    layout are upgraded when the history is opened, older rows leave them
+    empty, and so are histories saved by versions up to 2.0.0, whose rows are
+    converted with `normalize_row`. Rewrites are recorded in a `{stem}.positions.json` file next to the
+    history, which keeps positions handed out by `changes` valid.
+    """
+    def __init__(self, name: str, path: Path):
+        super().__init__(name, path)
+        self.positions = path.with_name(f"{path.stem}.positions.json")
+        self.index = SummaryIndex(path.with_name(f"{path.stem}.summary.json"), METRICS[name], 'Target' in self.columns) if name in METRICS else None
+        self._upgrade()
+
+    def _index(self) -> Dict:
+        """
+        Return the summary index, rebuilding it from the history if it is stale.
+        """
+        size = os.stat(self.path).st_size
+        index = self.index.load(size)
+        if index is None:
+            index = self.index.update(None, self._rows(), size)
+            self.index.save(index)
+        return index
+
+    def _positions(self) -> Dict:
+        """
+        Return how many rows were removed from the history so far and how often
+        it was rewritten, which invalidates byte offsets.
+        """
+        try:
+            with open(self.positions, mode='r', encoding='utf-8') as file_handler:
+                return json.load(file_handler)
+        except (FileNotFoundError, JSONDecodeError):
+            return {'removed': 0, 'generation': 0}
+
+    def _rewrite(self, removed: int) -> None:
+        """
+        Record that the history is about to be rewritten without `removed` of
+        its rows. Called with the lock held before the new file is swapped in,
+        so that an interruption can only move positions forward.
+        """
+        positions = self._positions()
+        temporary = self.positions.with_name(f".{self.positions.name}.tmp")
+        with open(temporary, mode='w', encoding='utf-8') as file_handler:
+            json.dump({'removed': positions['removed'] + removed, 'generation': positions['generation'] + 1}, file_handler)
+        os.replace(temporary, self.positions)
+
+    def _outdated(self) -> bool:
+        """
+        Tell whether the header lacks some columns or the first row is in the
+        layout of versions up to 2.0.0, which wrote all rows that way.
+        """
+        if not self.path.exists():
+            return False
+        with open(self.path, mode='r', encoding='utf-8', newline='') as file_handler:
+            header = next(csv.reader([file_handler.readline()]), None)
+            if header is None:
+                return False
+            if header != self.columns:
+                return True
+            values = next(csv.reader([file_handler.readline()]), None)
+        try:
+            float(dict(zip(header, values or [])).get('DateTime', 0))
+        except ValueError:
+            return True
+        return False
+
+    def _upgrade(self) -> None:
+        """
+        Rewrite the history with the current header if it lacks some columns
+        and in the current layout if it was saved by version 2.0.0 or earlier.
+        """
+        if not self._outdated():
+            return
+        with utils.locked_file(self.path):
+            if not self._outdated():
+                return
+            with open(self.path, mode='r', encoding='utf-8', newline='') as source:
+                reader = csv.DictReader(source)
+                temporary = self.path.with_name(f".{self.path.name}.tmp")
+                with open(temporary, mode='w', encoding='utf-8', newline='') as destination:
+                    writer = csv.DictWriter(destination, delimiter=',', lineterminator='\n', fieldnames=self.columns, extrasaction='ignore')
+                    writer.writeheader()
+                    writer.writerows(normalize_row(self.name, row) for row in reader)
+            self._rewrite(0)
+            os.replace(temporary, self.path)
+        utils.logger.info(f"Upgraded {self.path} to the current layout")
+
+    def append(self, rows: List[Dict]) -> None:
+        if not rows:
+            return
+        self._upgrade()
+        # Hold the lock until the index is saved so that writers never mix up their updates
+        with utils.locked_file(self.path) as fd:
+            if self.index is None:
+                utils.append_csv_rows(fd, rows)
+                return
+            index = self.index.load(os.fstat(fd).st_size)
+            size = utils.append_csv_rows(fd, rows)
+            self.index.save(self.index.update(index, rows, size) if index is not None else self.index.update(None, self._rows(), size))
+
+    def _rows(self, offset: Optional[int]=None) -> Iterator[Dict]:
+        """
+        Yield the rows that start at byte `offset` or later one at a time.
+        """
+        with open(self.path, mode='rb') as file_handler:
+            header = file_handler.readline()
+            if not header:
+                return
+            fieldnames = next(csv.reader([header.decode('utf-8')]))
+            if offset is not None:
+                file_handler.seek(offset)
+            for values in csv.reader(line.decode('utf-8') for line in file_handler):
+                if values:
+                    yield dict(zip(fieldnames, values))
+
+    def _find(self, timestamp: float) -> int:
+        """
+        Return the byte offset of the first row at or after `timestamp` by
+        binary search over the memory-mapped file. Rows are only sorted up to
+        `DISORDER`, so rows before the offset are older than `timestamp +
+        DISORDER` and rows after it newer than `timestamp - DISORDER`.
+        """
+        with open(self.path, mode='rb') as file_handler:
+            header = file_handler.readline()
+            size = os.fstat(file_handler.fileno()).st_size
+            if size <= len(header):
+                return size
+            column = next(csv.reader([header.decode('utf-8')])).index('DateTime')
+            with mmap.mmap(file_handler.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                def line_end(start: int) -> int:
+                    end = mapped.find(b'\n', start)
+                    return size if end < 0 else end
+
+                def read(start: int) -> Optional[float]:
+                    values = next(csv.reader([mapped[start:line_end(start)].decode('utf-8')]), [])
+                    return utils.read_timestamp(values[column]) if column < len(values) else None
+
+                low, high, found = len(header), size, size
+                while low < high:
+                    middle = (low + high) // 2
+                    # Rows start right after a line break, unreadable ones are skipped
+                    start = line_end(middle - 1) + 1
+                    while start < high and (value := read(start)) is None:
+                        start = line_end(start) + 1
+                    if start >= high:
+                        high = middle
+                        continue
+                    if value < timestamp:
+                        low = line_end(start) + 1
+                    else:
+                        found, high = start, middle
+                return found
+
+    def query(self, since: Optional[float]=None, until: Optional[float]=None, target: Optional[str]=None, limit: Optional[int]=None) -> Iterator[Dict]:
+        if limit is not None and limit <= 0:
+            return
+        count, newest = 0, -math.inf
+        # Rows are held back until no row appended later can be older
+        pending = []
+        for sequence, row in enumerate(self._rows(self._find(since - DISORDER) if since is not None else None)):
+            if (timestamp := utils.read_timestamp(row.get('DateTime'))) is None:
+                continue
+            newest = max(newest, timestamp)
+            while pending and pending[0][0] < newest - DISORDER:
+                yield heapq.heappop(pending)[2]
+                count += 1
+                if count == limit:
+                    return
+            if until is not None and timestamp >= until:
+                if timestamp >= until + DISORDER:
+                    break
+                continue
+            if (since is not None and timestamp < since) or (target is not None and row.get('Target') != target):
+                continue
+            heapq.heappush(pending, (timestamp, sequence, row))
+        while pending:
+            yield heapq.heappop(pending)[2]
+            count += 1
+            if count == limit:
+                return
+
+    def tail(self, count: int, since: Optional[float]=None, until: Optional[float]=None, target: Optional[str]=None) -> List[Dict]:
+        if count <= 0:
+            return []
+        # The newest `count` rows, oldest first
+        newest = []
+        for sequence, row in enumerate(utils.read_csv_reversed(self.path)):
+            if (timestamp := utils.read_timestamp(row.get('DateTime'))) is None:
+                continue
+            if since is not None and timestamp < since - DISORDER:
+                break
+            if len(newest) == count and timestamp < newest[0][0] - DISORDER:
+                break
+            if (since is not None and timestamp < since) or (until is not None and timestamp >= until):
+                continue
+            if target is not None and row.get('Target') != target:
+                continue
+            # Of rows with the same timestamp the one appended last is the newest, like in `query`
+            item = (timestamp, -sequence, row)
+            if len(newest) < count:
+                heapq.heappush(newest, item)
+            elif item > newest[0]:
+                heapq.heapreplace(newest, item)
+        return [row for *_, row in sorted(newest)]
+
+    def changes(self, after: Optional[Dict]=None) -> Iterator[Tuple[Dict, Dict]]:
+        # Positions count the rows ever appended, byte offsets only skip ahead
+        # until the next rewrite. Rewrites swap in a new file and leave the one
+        # opened here intact, so both are taken under the lock.
+        with utils.locked_file(self.path):
+            positions = self._positions()
+            file_handler = open(self.path, mode='rb')
+        with file_handler:
+            header = file_handler.readline()
+            if not header.endswith(b'\n'):
+                return
+            fieldnames = next(csv.reader([header.decode('utf-8')]))
+            position, skip = positions['removed'], (after or {}).get('position', 0)
+            if after and after.get('generation') == positions['generation'] and 'offset' in after:
+                file_handler.seek(after['offset'])
+                position = skip
+            offset = file_handler.tell()
+            for line in iter(file_handler.readline, b''):
+                # A row that is still being appended is picked up next time
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                if not line.strip():
+                    continue
+                position += 1
+                if position > skip:
+                    yield dict(zip(fieldnames, next(csv.reader([line.decode('utf-8')])))), {'position': position, 'offset': offset, 'generation': positions['generation']}
+
+    def latest(self, max_age: float, **columns) -> Optional[Dict]:
+        columns = {column: str(value) for column, value in columns.items()}
+        # The index knows the last row per target, which settles most lookups
+        if self.index is not None and self.index.keyed == ('Target' in columns):
+            entry = self._index()['targets'].get(columns.get('Target', ''))
+            if entry is None or float(entry['last']['DateTime']) < time() - max_age:
+                return None
+            if all(entry['last'].get(column) == value for column, value in columns.items()):
+                return entry['last']
+        return utils.read_recent_row(self.path, max_age, DISORDER, **columns)
+
+    def oldest(self) -> Optional[float]:
+        return next((timestamp for row in self._rows() if (timestamp := utils.read_timestamp(row.get('DateTime'))) is not None), None)
+
+    def remove_before(self, cutoff: float) -> None:
+        # Writers waiting for the lock notice the swapped file and reopen it
+        with utils.locked_file(self.path):
+            # Rows before the offset are all older than the cutoff, those up to DISORDER later are checked one by one
+            offset = self._find(cutoff - DISORDER)
+            with open(self.path, mode='rb') as source:
+                header = source.readline()
+                if not header:
+                    return
+                column = next(csv.reader([header.decode('utf-8')])).index('DateTime')
+                # Rows before the offset are all removed
+                removed, position = 0, len(header)
+                for line in iter(source.readline, b''):
+                    position += len(line)
+                    if position > offset:
+                        break
+                    removed += bool(line.strip())
+                source.seek(offset)
+                kept, position = [], offset
+                for line in iter(source.readline, b''):
+                    if line.strip():
+                        values = next(csv.reader([line.decode('utf-8')]))
+                        timestamp = utils.read_timestamp(values[column]) if column < len(values) else None
+                        if timestamp is not None and timestamp >= cutoff + DISORDER:
+                            break
+                        if timestamp is not None and timestamp < cutoff:
+                            removed += 1
+                        else:
+                            kept.append(line)
+                    position += len(line)
+                if not removed:
+                    return
+                # Rewrite the remainder next to the history and swap it in atomically
+                temporary = self.path.with_name(f".{self.path.name}.tmp")
+                with open(temporary, mode='wb') as destination:
+                    destination.write(header)
+                    destination.writelines(kept)
+                    source.seek(position)
+                    shutil.copyfileobj(source, destination)
+                index = self.index.load(os.fstat(source.fileno()).st_size) if self.index is not None else None
+            # Counting the removed rows in front of kept ones may move some positions
+            # forward, which exports a few rows twice at worst but never skips one
+            self._rewrite(removed)
+            os.replace(temporary, self.path)
+            # Whole buckets can be dropped from the index, anything else is rebuilt on demand
+            if index is not None and cutoff % BUCKET == 0:
+                index['targets'] = {key: entry for key, entry in index['targets'].items() if float(entry['last']['DateTime']) >= cutoff}
+                SummaryIndex.prune(index, cutoff)
+                index['size'] = os.stat(self.path).st_size
+                self.index.save(index)
+
+    def rollup(self, level: str) -> 'CSVHistory':
+        name = f"{self.name}_{level}"
+        return CSVHistory(name, utils.get_resource_path(FILES[name]))
+
+    def summary(self, target: Optional[str]=None, now: Optional[float]=None) -> List[Dict]:
+        return self.index.summarize(self._index(), target, now)
+
+    def reset(self) -> None:
+        with utils.locked_file(self.path):
+            self._rewrite(sum(1 for _ in self._rows()))
+            utils.reset_file(self.path)
+        if self.index is not None:
+            self.index.save(self.index.update(None, [], 0))
+
+
+class SQLiteHistory(History):
+    """
+    History kept in a table of a SQLite database in WAL mode, indexed on the
+    timestamp and, for ping results, on the target. Positions handed out by
+    `changes` are row IDs, which start over once the last row is removed. The
+    `generations` table counts how often that happened per history.
+    """
+    def __init__(self, name: str, path: Path):
+        super().__init__(name, path)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            columns = ', '.join(f'"{column}" {kind}' for column, kind in COLUMNS[name].items())
+            self.connection.execute(f'CREATE TABLE IF NOT EXISTS {name} ({columns})')
+            self.connection.execute(f'CREATE INDEX IF NOT EXISTS {name}_datetime ON {name} ("DateTime")')
+            if 'Target' in self.columns:
+                self.connection.execute(f'CREATE INDEX IF NOT EXISTS {name}_target_datetime ON {name} ("Target", "DateTime")')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS generations ("Name" TEXT PRIMARY KEY, "Generation" INTEGER NOT NULL)')
+            # Tables created before columns were added to the layout leave them empty in older rows
+            existing = {row['name'] for row in self.connection.execute(f'PRAGMA table_info({name})')}
+            for column, kind in COLUMNS[name].items():
+                if column not in existing:
+                    self.connection.execute(f'ALTER TABLE {name} ADD COLUMN "{column}" {kind}')
+
+    def append(self, rows: List[Dict]) -> None:
+        names = ', '.join(f'"{column}"' for column in self.columns)
+        placeholders = ', '.join('?' * len(self.columns))
+        with self.lock, self.connection:
+            self.connection.executemany(f'INSERT INTO {self.name} ({names}) VALUES ({placeholders})', ([row.get(column) for column in self.columns] for row in rows))
+
+    def _select(self, conditions: Dict[str, object], order: str, limit: Optional[int], since: Optional[float]=None, until: Optional[float]=None, connection: Optional[sqlite3.Connection]=None) -> sqlite3.Cursor:
+        clauses, parameters = [], []
+        for column, value in conditions.items():
+            clauses.append(f'"{column}" = ?')
+            parameters.append(value)
+        if since is not None:
+            clauses.append('"DateTime" >= ?')
+            parameters.append(since)
+        if until is not None:
+            clauses.append('"DateTime" < ?')
+            parameters.append(until)
+        names = ', '.join(f'"{column}"' for column in self.columns)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        return (connection or self.connection).execute(f'SELECT {names} FROM {self.name} {where} ORDER BY "DateTime" {order} LIMIT ?', (*parameters, -1 if limit is None else limit))
+
+    def query(self, since: Optional[float]=None, until: Optional[float]=None, target: Optional[str]=None, limit: Optional[int]=None) -> Iterator[Dict]:
+        conditions = {'Target': target} if target is not None else {}
+        # Rows are read lazily over a connection of their own, WAL mode lets
+        # other threads keep appending meanwhile without sharing a cursor
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            for row in self._select(conditions, 'ASC', limit, since, until, connection):
+                yield dict(row)
+        finally:
+            connection.close()
+
+    def _generation(self, connection: sqlite3.Connection) -> int:
+        row = connection.execute('SELECT "Generation" FROM generations WHERE "Name" = ?', (self.name,)).fetchone()
+        return row[0] if row else 0
+
+    def _renumber(self) -> None:
+        """
+        Start a new generation of row IDs, called in the transaction that
+        removed the row numbered last.
+        """
+        self.connection.execute('INSERT OR IGNORE INTO generations VALUES (?, 0)', (self.name,))
+        self.connection.execute('UPDATE generations SET "Generation" = "Generation" + 1 WHERE "Name" = ?', (self.name,))
+
+    def changes(self, after: Optional[Dict]=None) -> Iterator[Tuple[Dict, Dict]]:
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            # Read the generation and the rows from the same snapshot
+            connection.execute('BEGIN')
+            generation = self._generation(connection)
+            rowid = after.get('rowid', 0) if after and after.get('generation') == generation else 0
+            names = ', '.join(f'"{column}"' for column in self.columns)
+            for rowid, *values in connection.execute(f'SELECT rowid, {names} FROM {self.name} WHERE rowid > ? ORDER BY rowid', (rowid,)):
+                yield dict(zip(self.columns, values)), {'rowid': rowid, 'generation': generation}
+        finally:
+            connection.close()
+
+    def tail(self, count: int, since: Optional[float]=None, until: Optional[float]=None, target: Optional[str]=None) -> List[Dict]:
+        conditions = {'Target': target} if target is not None else {}
+        with self.lock:
+            rows = [dict(row) for row in self._select(conditions, 'DESC', count, since, until)]
+        return rows[::-1]
+
+    def latest(self, max_age: float, **columns) -> Optional[Dict]:
+        with self.lock:
+            row = self._select(columns, 'DESC', 1, time() - max_age).fetchone()
+        return dict(row) if row else None
+
+    def oldest(self) -> Optional[float]:
+        with self.lock:
+            return self.connection.execute(f'SELECT MIN("DateTime") FROM {self.name}').fetchone()[0]
+
+    def remove_before(self, cutoff: float) -> None:
+        with self.lock, self.connection:
+            last = self.connection.execute(f'SELECT MAX(rowid) FROM {self.name}').fetchone()[0]
+            self.connection.execute(f'DELETE FROM {self.name} WHERE "DateTime" < ?', (cutoff,))
+            # New rows are numbered after the last one left, which may reuse row IDs
+            if self.connection.execute(f'SELECT MAX(rowid) FROM {self.name}').fetchone()[0] != last:
+                self._renumber()
+
+    def rollup(self, level: str) -> 'SQLiteHistory':
+        return SQLiteHistory(f"{self.name}_{level}", self.path)
+
+    def summary(self, target: Optional[str]=None, now: Optional[float]=None) -> List[Dict]:
+        now = time() if now is None else now
+        keyed = 'Target' in self.columns
+        group = '"Target"' if keyed else 'NULL'
+        where, parameters = ('WHERE "Target" = ?', (target,)) if keyed and target is not None else ('', ())
+        aggregates = ', '.join(f'MIN("{metric}"), MAX("{metric}"), AVG("{metric}")' for metric in METRICS[self.name])
+        summaries = {}
+        with self.lock:
+            for (key,) in self.connection.execute(f'SELECT DISTINCT {group} FROM {self.name} {where}', parameters).fetchall():
+                last = self._select({'Target': key} if keyed else {}, 'DESC', 1).fetchone()
+                summaries[key] = {'target': key, 'last': dict(last), 'windows': {window: {'count': 0, 'metrics': dict.fromkeys(METRICS[self.name])} for window in WINDOWS}}
+            for window, length in WINDOWS.items():
+                clause = f'{where} AND "DateTime" >= ?' if where else 'WHERE "DateTime" >= ?'
+                for key, count, *values in self.connection.execute(f'SELECT {group}, COUNT(*), {aggregates} FROM {self.name} {clause} GROUP BY {group}', (*parameters, window_start(length, now))):
+                    summaries[key]['windows'][window] = {
+                        'count': count,
+                        # Aggregates skip NULL, metrics without any value have none
+                        'metrics': {metric: dict(zip(('min', 'max', 'mean'), values[index * 3:index * 3 + 3])) if values[index * 3] is not None else None for index, metric in enumerate(METRICS[self.name])},
+                    }
+        return [summaries[key] for key in sorted(summaries, key=lambda key: key or '')]
+
+    def reset(self) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(f'DELETE FROM {self.name}')
+            self._renumber()
+
+    def close(self) -> None:
+        self.connection.close()
+
+#endregion backends
+
+def open_history(name: str, backend: str='csv') -> History:
+    """
+    Open the `ping` or `bandwidth` history of the given `backend`.
+    """
+    if backend == 'sqlite':
+        return SQLiteHistory(name, utils.get_resource_path(HISTORYDB))
+    if backend == 'csv':
+        return CSVHistory(name, utils.get_resource_path(FILES[name]))
+    raise ValueError(f"Unknown history backend {backend}, expected one of: {', '.join(BACKENDS)}")
+
+def migrate(name: str, batch_size: int=10_000) -> int:
+    """
+    Copy the CSV history of `name` into an empty SQLite history and return the
+    number of copied rows. The CSV file is left in place.
+    """
+    source, destination = open_history(name, 'csv'), open_history(name, 'sqlite')
+    try:
+        if next(destination.query(limit=1), None) is not None:
+            return 0
+        count, batch = 0, []
+        for row in source.query():
+            batch.append(normalize_row(name, row))
+            if len(batch) == batch_size:
+                destination.append(batch)
+                count, batch = count + len(batch), []
+        destination.append(batch)
+        return count + len(batch)
+    finally:
+        destination.close()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import errno
+import os
+import select
+import socket
+import struct
+from itertools import count as counter
+from time import perf_counter_ns
+from typing import Dict, Optional, Sequence, Tuple
+
+from .streaming import RTTStatistics
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+#region packets
+
+def checksum(data: bytes) -> int:
+    """
+    Internet checksum (RFC 1071) of `data`.
+    """
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+def echo_request(identifier: int, sequence: int, payload: bytes) -> bytes:
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    return struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum(header + payload), identifier, sequence) + payload
+
+def parse_reply(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Return the identifier and sequence number of an echo reply, or `None` for
+    any other ICMP message. Raw sockets, and on macOS datagram sockets too,
+    deliver the IP header as well, which starts with the IPv4 version nibble
+    where an ICMP message starts with its type.
+    """
+    if data and data[0] >> 4 == 4:
+        data = data[(data[0] & 0x0f) * 4:]
+    if len(data) < 8:
+        return None
+    kind, _, _, identifier, sequence = struct.unpack('!BBHHH', data[:8])
+    return (identifier, sequence) if kind == ICMP_ECHO_REPLY else None
+
+#endregion packets
+
+def open_socket(datagram: bool=False) -> Tuple[socket.socket, bool]:
+    """
+    Open an ICMP socket and tell whether it is raw. Raw sockets require root
+    privileges, otherwise or if `datagram` is set use the unprivileged datagram
+    sockets that Linux (within `net.ipv4.ping_group_range`) and macOS offer.
+    """
+    if not datagram:
+        try:
+            return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+        except PermissionError:
+            pass
+    try:
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+    except OSError as error:
+        if error.errno in (errno.EACCES, errno.EPERM, errno.EPROTONOSUPPORT):
+            raise PermissionError(error.errno, "Neither raw nor datagram ICMP sockets are permitted for this user") from error
+        raise
+
+def ping_many(targets: Sequence[str], count: int=4, size: int=1, interval: float=1.0, timeout: float=2.0, datagram: bool=False) -> Dict[str, RTTStatistics]:
+    """
+    Ping all `targets` at once over a single ICMP socket and return streaming
+    round-trip time statistics per target, see `streaming.RTTStatistics`. One
+    request is sent to every target per round and rounds start `interval`
+    seconds apart, so the whole run takes about `(count - 1) * interval +
+    timeout` seconds no matter how many targets are pinged. Replies are matched
+    to requests by their sequence number, replies later than `timeout` and
+    requests to targets that cannot be resolved count as unanswered. Requests
+    are forgotten once they timed out, so memory use does not depend on `count`.
+    Set `datagram` to never try a raw socket, see `open_socket`.
+    """
+    addresses = {}
+    for target in targets:
+        try:
+            addresses[target] = socket.getaddrinfo(target, None, socket.AF_INET)[0][4][0]
+        except socket.gaierror:
+            addresses[target] = None
+    statistics = {target: RTTStatistics() for target in targets}
+    payload = bytes(size)
+    limit = int(timeout * 1e9)
+
+    sock, raw = open_socket(datagram)
+    # Datagram sockets get their identifier assigned by the kernel, which also filters replies
+    identifier = os.getpid() & 0xffff
+    sequences = counter(1)
+    # Sequence number -> (target, send time), in order of sending
+    pending: Dict[int, Tuple[str, int]] = {}
+
+    def expire(now: int) -> None:
+        while pending:
+            sequence, (_, sent) = next(iter(pending.items()))
+            if now - sent <= limit:
+                return
+            del pending[sequence]
+
+    def receive(deadline: int, last: bool) -> None:
+        while pending or not last:
+            # Replies that are already in are read even when sending fell behind schedule
+            readable, _, _ = select.select([sock], [], [], max(deadline - perf_counter_ns(), 0) / 1e9)
+            if not readable:
+                break
+            data, (address, *_) = sock.recvfrom(65535)
+            received = perf_counter_ns()
+            reply = parse_reply(data)
+            if reply is None or (raw and reply[0] != identifier) or reply[1] not in pending:
+                continue
+            target, sent = pending[reply[1]]
+            if address != addresses[target]:
+                continue
+            del pending[reply[1]]
+            if received - sent <= limit:
+                statistics[target].add((received - sent) / 1e9)
+        expire(perf_counter_ns())
+
+    try:
+        start = perf_counter_ns()
+        for index in range(count):
+            for target, address in addresses.items():
+                statistics[target].sent += 1
+                if address is None:
+                    continue
+                sequence = next(sequences) & 0xffff
+                # Sequence numbers wrap around after 65536 requests, a late reply must not match the new request
+                pending.pop(sequence, None)
+                pending[sequence] = (target, perf_counter_ns())
+                try:
+                    sock.sendto(echo_request(identifier, sequence, payload), (address, 0))
+                except OSError:
+                    # An unreachable network counts as a lost request
+                    del pending[sequence]
+            # Collect replies until the next round is due, after the last one until all are in or the timeout
+            last = index == count - 1
+            receive(max(start + int((index * interval + (timeout if last else interval)) * 1e9), perf_counter_ns() + limit if last else 0), last)
+    finally:
+        sock.close()
+    return statistics
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+from . import core, utils
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+BANDWIDTH_BUCKETS = (1e6, 2.5e6, 5e6, 1e7, 2.5e7, 5e7, 1e8, 2.5e8, 5e8, 1e9, 2.5e9, 5e9, 1e10)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# Name: (type, help, histogram buckets)
+FAMILIES = {
+    'speedtest_last_download_bits_per_second': ('gauge', "Download speed of the last bandwidth test.", None),
+    'speedtest_last_upload_bits_per_second': ('gauge', "Upload speed of the last bandwidth test.", None),
+    'speedtest_last_latency_seconds': ('gauge', "Latency to the server of the last bandwidth test.", None),
+    'speedtest_last_phase_duration_seconds': ('gauge', "Duration of every phase of the last bandwidth test.", None),
+    'speedtest_last_ping_rtt_seconds': ('gauge', "Minimum, average, maximum and estimated percentiles of the round trip times of the last ping test.", None),
+    'speedtest_last_ping_rtt_stddev_seconds': ('gauge', "Standard deviation of the round trip times of the last ping test.", None),
+    'speedtest_last_ping_jitter_seconds': ('gauge', "Jitter (RFC 3550) of the round trip times of the last ping test.", None),
+    'speedtest_last_ping_packet_loss_ratio': ('gauge', "Share of packets lost by the last ping test.", None),
+    'speedtest_last_test_timestamp_seconds': ('gauge', "UNIX time at which the last test finished.", None),
+    'speedtest_tests_total': ('counter', "Tests run since the start of this process.", None),
+    'speedtest_bytes_received_total': ('counter', "Payload bytes received by bandwidth tests.", None),
+    'speedtest_bytes_sent_total': ('counter', "Payload bytes sent by bandwidth tests.", None),
+    'speedtest_ping_packets_sent_total': ('counter', "Packets sent by ping tests.", None),
+    'speedtest_ping_packets_received_total': ('counter', "Packets received by ping tests.", None),
+    'speedtest_download_bits_per_second': ('histogram', "Download speeds of all bandwidth tests.", BANDWIDTH_BUCKETS),
+    'speedtest_upload_bits_per_second': ('histogram', "Upload speeds of all bandwidth tests.", BANDWIDTH_BUCKETS),
+    'speedtest_latency_seconds': ('histogram', "Latencies to the server of all bandwidth tests.", LATENCY_BUCKETS),
+    'speedtest_ping_rtt_seconds': ('histogram', "Average round trip times of all ping tests.", LATENCY_BUCKETS),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+#region rendering
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels: Labels) -> str:
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels) + '}' if labels else ''
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    Cumulative bucket counts, sum and count of observed values.
+    """
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        # Counts are kept per bucket and accumulated when rendering
+        index = bisect.bisect_left(self.bounds, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, labels: Labels) -> str:
+        lines, cumulative = [], 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(labels + (('le', _number(float(bound))),))} {cumulative}\n")
+        lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {self.count}\n")
+        lines.append(f"{name}_sum{_labels(labels)} {_number(self.sum)}\n")
+        lines.append(f"{name}_count{_labels(labels)} {self.count}\n")
+        return ''.join(lines)
+
+#endregion rendering
+
+class MetricsRegistry:
+    """
+    Metrics of the ping and bandwidth results observed by this process in the
+    Prometheus text exposition format. The exposition is rendered once per
+    result, so scrapes only copy bytes. If `textfile` is given, every new
+    exposition is also written there atomically for the textfile collector of
+    the node exporter.
+
+    ```python
+    metrics = MetricsRegistry()
+    metrics.observe_bandwidth(core.test_bandwidth(None))
+    metrics.render()
+    ```
+    """
+    def __init__(self, textfile: Optional[Union[str, Path]]=None):
+        self.textfile = Path(textfile) if textfile else None
+        self.lock = threading.Lock()
+        self.values: Dict[str, Dict[Labels, Union[float, Histogram]]] = {name: {} for name in FAMILIES}
+        self.exposition = self._render()
+
+    def _set(self, name: str, labels: Labels, value: Optional[float]) -> None:
+        # Without a value the sample is dropped rather than left at an old one
+        if value is None:
+            self.values[name].pop(labels, None)
+        else:
+            self.values[name][labels] = value
+
+    def _add(self, name: str, labels: Labels, value: float) -> None:
+        self.values[name][labels] = self.values[name].get(labels, 0) + value
+
+    def _observe(self, name: str, labels: Labels, value: float) -> None:
+        histogram = self.values[name].get(labels)
+        if histogram is None:
+            histogram = self.values[name][labels] = Histogram(FAMILIES[name][2])
+        histogram.observe(value)
+
+    def _render(self) -> bytes:
+        lines = []
+        for name, (kind, description, _) in FAMILIES.items():
+            samples = self.values[name]
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {description}\n# TYPE {name} {kind}\n")
+            for labels, value in samples.items():
+                lines.append(value.lines(name, labels) if kind == 'histogram' else f"{name}{_labels(labels)} {_number(value)}\n")
+        return ''.join(lines).encode('utf-8')
+
+    def _publish(self) -> None:
+        self.exposition = self._render()
+        if self.textfile:
+            # A full disk or a missing directory must not fail the test that was just saved
+            temporary = self.textfile.with_name(f".{self.textfile.name}.{os.getpid()}.tmp")
+            try:
+                temporary.write_bytes(self.exposition)
+                os.replace(temporary, self.textfile)
+            except OSError as error:
+                utils.logger.error(f"Could not write metrics to {self.textfile}: {error}")
+
+    def observe_ping(self, result: core.PingResult) -> None:
+        labels = (('target', result.target),)
+        with self.lock:
+            for quantity, value in (('min', result.rtt_min), ('avg', result.rtt_avg), ('max', result.rtt_max), ('p50', result.rtt_p50), ('p90', result.rtt_p90), ('p99', result.rtt_p99)):
+                self._set('speedtest_last_ping_rtt_seconds', labels + (('quantity', quantity),), value)
+            self._set('speedtest_last_ping_rtt_stddev_seconds', labels, result.rtt_stddev)
+            self._set('speedtest_last_ping_jitter_seconds', labels, result.jitter)
+            self._set('speedtest_last_ping_packet_loss_ratio', labels, result.loss)
+            self._set('speedtest_last_test_timestamp_seconds', (('test', 'ping'),), result.timestamp)
+            self._add('speedtest_tests_total', (('test', 'ping'),), 1)
+            self._add('speedtest_ping_packets_sent_total', labels, result.sent)
+            self._add('speedtest_ping_packets_received_total', labels, result.received)
+            if result.received:
+                self._observe('speedtest_ping_rtt_seconds', labels, result.rtt_avg)
+            self._publish()
+
+    def observe_bandwidth(self, result: core.BandwidthResult) -> None:
+        labels = (('server_id', str(result.server.get('id', ''))),)
+        with self.lock:
+            # Results of an earlier test against another server are no longer current
+            for name in ('speedtest_last_download_bits_per_second', 'speedtest_last_upload_bits_per_second', 'speedtest_last_latency_seconds', 'speedtest_last_phase_duration_seconds'):
+                self.values[name] = {}
+            self._set('speedtest_last_download_bits_per_second', labels, result.download)
+            self._set('speedtest_last_upload_bits_per_second', labels, result.upload)
+            self._set('speedtest_last_latency_seconds', labels, result.ping)
+            for phase, timing in result.timings.items():
+                if timing.get('duration') is not None:
+                    self._set('speedtest_last_phase_duration_seconds', labels + (('phase', phase),), timing['duration'])
+            self._set('speedtest_last_test_timestamp_seconds', (('test', 'bandwidth'),), result.timestamp)
+            self._add('speedtest_tests_total', (('test', 'bandwidth'),), 1)
+            self._add('speedtest_bytes_received_total', labels, result.bytes_received)
+            self._add('speedtest_bytes_sent_total', labels, result.bytes_sent)
+            self._observe('speedtest_download_bits_per_second', labels, result.download)
+            self._observe('speedtest_upload_bits_per_second', labels, result.upload)
+            self._observe('speedtest_latency_seconds', labels, result.ping)
+            self._publish()
+
+    def render(self) -> bytes:
+        """
+        Return the current exposition.
+        """
+        return self.exposition
+
+#region http
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serve `GET /metrics` and nothing else.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """
+    Expose a `MetricsRegistry` to Prometheus, by default only to this host.
+    """
+    daemon_threads = True
+
+    def __init__(self, metrics: MetricsRegistry, host: str='127.0.0.1', port: int=9516):
+        super().__init__((host, port), MetricsRequestHandler)
+        self.metrics = metrics
+
+    def start(self) -> 'MetricsServer':
+        """
+        Serve requests on a background thread.
+        """
+        threading.Thread(target=self.serve_forever, name='metrics', daemon=True).start()
+        return self
+
+#endregion http
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+import argparse
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, Optional
+from urllib.parse import urlparse
+
+CHUNK_SIZE = 65536
+FAULTS = ('error', 'reset', 'stall')
+
+CONFIG_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<settings>
+<client ip="127.0.0.1" lat="0.0000" lon="0.0000" isp="Loopback" isprating="3.7" rating="0" ispdlavg="0" ispulavg="0" loggedin="0" country="LO"/>
+<server-config threadcount="{threads}" ignoreids="" notonmap="" forcepingid="" preferredserverid=""/>
+<download testlength="{test_length}" initialtest="250K" mintestsize="250K" threadsperurl="{threads_per_url}"/>
+<upload testlength="{test_length}" ratio="5" initialtest="0" mintestsize="32K" threads="{threads}" maxchunksize="512K" maxchunkcount="50" threadsperurl="4"/>
+</settings>
+"""
+
+SERVER_XML = """<server url="{url}/speedtest/upload.php" lat="0.0000" lon="0.0000" name="Localhost" country="Loopback" cc="LO" sponsor="Mock Server {id}" id="{id}" host="{host}"/>"""
+
+#region shaping
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that limits the combined throughput of all
+    connections to `rate` bytes per second.
+    """
+    def __init__(self, rate: float, burst: Optional[float]=None):
+        self.rate = rate
+        self.capacity = burst or max(rate / 10, CHUNK_SIZE)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount: int) -> None:
+        """
+        Block until `amount` bytes may be transferred.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            deficit = -self.tokens
+        if deficit > 0:
+            time.sleep(deficit / self.rate)
+
+#endregion shaping
+
+#region request handling
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serve the subset of the speedtest.net protocol used by `Speedtest`.
+    """
+    protocol_version = 'HTTP/1.1'
+    server: 'MockSpeedtestServer'
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _fault(self) -> Optional[str]:
+        settings = self.server.settings
+        if settings.fault_rate and random.random() < settings.fault_rate:
+            return random.choice(settings.faults)
+        return None
+
+    def _send(self, body: bytes, content_type: str='text/plain') -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, length: int, fault: Optional[str]) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        payload = self.server.payload
+        bucket = self.server.bucket
+        sent, cutoff = 0, random.randint(0, length) if fault else length
+        while sent < length:
+            if sent >= cutoff:
+                if fault == 'stall':
+                    time.sleep(self.server.settings.stall)
+                self.close_connection = True
+                return
+            chunk = payload[:min(CHUNK_SIZE, length - sent)]
+            if bucket:
+                bucket.consume(len(chunk))
+            self.wfile.write(chunk)
+            sent += len(chunk)
+
+    def do_GET(self) -> None:
+        settings = self.server.settings
+        path = urlparse(self.path).path
+        fault = self._fault()
+
+        if settings.latency:
+            time.sleep(settings.latency)
+        if fault == 'error':
+            self.send_error(500)
+            return
+
+        try:
+            if path.endswith('/speedtest-config.php'):
+                self._send(self.server.config_xml.encode(), 'text/xml')
+            elif path.endswith('/speedtest-servers-static.php') or path.endswith('/speedtest-servers.php'):
+                self._send(self.server.servers_xml.encode(), 'text/xml')
+            elif path.endswith('/latency.txt'):
+                self._send(b'test=test')
+            elif match := re.search(r'/random(\d+)x(\d+)\.jpg$', path):
+                # Same ballpark as the real images, about 2 bytes per pixel
+                self._stream(int(match.group(1)) * int(match.group(2)) * 2, fault)
+            else:
+                self.send_error(404)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _collect(self, fault: Optional[str]) -> None:
+        """
+        Accept a batch of results as pushed by `push.Collector`.
+        """
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if fault == 'reset':
+            self.close_connection = True
+            return
+        if fault == 'stall':
+            time.sleep(self.server.settings.stall)
+            self.close_connection = True
+            return
+        if fault == 'error':
+            self.send_error(503)
+            return
+        try:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            records = [json.loads(line) for line in body.splitlines() if line.strip()]
+        except (OSError, ValueError):
+            self.send_error(400)
+            return
+        with self.server.lock:
+            self.server.results.extend(records)
+            self.server.batches += 1
+        self._send(json.dumps({'accepted': len(records)}).encode(), 'application/json')
+
+    def do_POST(self) -> None:
+        settings = self.server.settings
+        fault = self._fault()
+
+        if settings.latency:
+            time.sleep(settings.latency)
+        if urlparse(self.path).path.endswith('/results'):
+            self._collect(fault)
+            return
+        if not urlparse(self.path).path.endswith('/upload.php'):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        cutoff = random.randint(0, length) if fault in ('reset', 'stall') else length
+        received = 0
+        bucket = self.server.bucket
+        try:
+            while received < length:
+                if received >= cutoff:
+                    if fault == 'stall':
+                        time.sleep(settings.stall)
+                    self.close_connection = True
+                    return
+                chunk = self.rfile.read(min(CHUNK_SIZE, length - received))
+                if not chunk:
+                    self.close_connection = True
+                    return
+                if bucket:
+                    bucket.consume(len(chunk))
+                received += len(chunk)
+
+            if fault == 'error':
+                self.send_error(500)
+                return
+            self._send(f"size={received}".encode())
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+#endregion request handling
+
+class MockSettings:
+    """
+    Tunables of a `MockSpeedtestServer`, may be changed while it is running.
+    Changes apply to the requests that start afterwards.
+    """
+    def __init__(self, latency: float=0, bandwidth: Optional[float]=None, fault_rate: float=0, faults: Iterable[str]=FAULTS, stall: float=30):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.fault_rate = fault_rate
+        self.faults = tuple(faults)
+        self.stall = stall
+
+        if unknown := set(self.faults) - set(FAULTS):
+            raise ValueError(f"Unknown faults: {', '.join(sorted(unknown))}")
+
+
+class MockSpeedtestServer(ThreadingHTTPServer):
+    """
+    Local stand-in for speedtest.net that serves the configuration, the server
+    list, latency probes, download images and the upload endpoint. It doubles
+    as result collector, batches pushed to `collector_url` are kept in `results`.
+
+    `latency` delays every response by that many seconds, `bandwidth` caps
+    the combined throughput of all connections in bytes per second and
+    `fault_rate` is the probability of a request running into one of `faults`:
+    a HTTP 500 (`error`), a connection closed mid-transfer (`reset`) or a
+    transfer that stops for `stall` seconds (`stall`).
+
+    ```python
+    with MockSpeedtestServer(bandwidth=100_000_000) as server:
+        test = Speedtest(config_url=server.config_url, server_list_url=server.server_list_url)
+    ```
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, host: str='127.0.0.1', port: int=0, servers: int=1, threads: int=4, test_length: int=10, **settings):
+        super().__init__((host, port), MockRequestHandler)
+        self.settings = MockSettings(**settings)
+        self._bucket = None
+        self.payload = bytes(random.getrandbits(8) for _ in range(256)) * (CHUNK_SIZE // 256)
+        self.config_xml = CONFIG_XML.format(threads=threads, threads_per_url=threads, test_length=test_length)
+        self.servers_xml = '<?xml version="1.0" encoding="UTF-8"?>\n<settings>\n<servers>\n%s\n</servers>\n</settings>\n' % '\n'.join(
+            SERVER_XML.format(url=self.url, host=f"{self.server_address[0]}:{self.server_port}", id=i + 1) for i in range(servers)
+        )
+        self.results = []
+        self.batches = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def bucket(self) -> Optional[TokenBucket]:
+        """
+        Token bucket for the current `settings.bandwidth`, read once per request.
+        """
+        with self.lock:
+            bandwidth = self.settings.bandwidth
+            if not bandwidth:
+                self._bucket = None
+            elif self._bucket is None or self._bucket.rate != bandwidth:
+                self._bucket = TokenBucket(bandwidth)
+            return self._bucket
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_port}"
+
+    @property
+    def collector_url(self) -> str:
+        return f"{self.url}/results"
+
+    @property
+    def config_url(self) -> str:
+        return f"{self.url}/speedtest-config.php"
+
+    @property
+    def server_list_url(self) -> str:
+        return f"{self.url}/speedtest-servers-static.php"
+
+    def start(self) -> 'MockSpeedtestServer':
+        """
+        Serve requests on a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self) -> 'MockSpeedtestServer':
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+def parse_size(value: str) -> float:
+    """
+    Parse a rate such as `100M` or `1.5G` into bytes.
+    """
+    units = {'K': 10**3, 'M': 10**6, 'G': 10**9}
+    value = value.strip().upper().rstrip('B')
+    return float(value[:-1]) * units[value[-1]] if value[-1:] in units else float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the speedtest.net servers.")
+    parser.add_argument('--host', type=str, default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8080, help="port to listen on (default: 8080)")
+    parser.add_argument('--servers', type=int, default=1, help="number of servers to advertise (default: 1)")
+    parser.add_argument('--threads', type=int, default=4, help="thread count advertised in the configuration (default: 4)")
+    parser.add_argument('--test-length', type=int, default=10, help="test length advertised in the configuration in seconds (default: 10)")
+    parser.add_argument('--latency', type=float, default=0, help="delay every response by this many seconds")
+    parser.add_argument('--bandwidth', type=parse_size, help="cap the combined throughput in bytes per second, e.g. 12.5M")
+    parser.add_argument('--fault-rate', type=float, default=0, help="probability of a request running into a fault")
+    parser.add_argument('--faults', type=str, nargs='+', default=list(FAULTS), choices=FAULTS, help="faults to inject")
+    args = parser.parse_args()
+
+    server = MockSpeedtestServer(
+        args.host, args.port, args.servers, args.threads, args.test_length,
+        latency=args.latency, bandwidth=args.bandwidth, fault_rate=args.fault_rate, faults=args.faults
+    )
+    print(f"Serving on {server.url}, configuration at {server.config_url}, collecting results at {server.collector_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
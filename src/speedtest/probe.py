@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import http.client
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter_ns, sleep
+from typing import Dict, List, Optional, Sequence
+from urllib.parse import urlparse
+
+from .speedtest import SpeedtestHTTPConnection, SpeedtestHTTPSConnection, create_connection
+from .streaming import RTTStatistics
+
+METHODS = ('tcp', 'http')
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+class Endpoint:
+    """
+    Where a probe connects to: a `host[:port]` or an `http(s)://` URL. The
+    address is resolved once up front so that name lookups never count into
+    the measured latency.
+    """
+    __slots__ = ('target', 'scheme', 'host', 'port', 'path', 'address')
+
+    def __init__(self, target: str):
+        parsed = urlparse(target if '://' in target else f"http://{target}")
+        if parsed.scheme not in DEFAULT_PORTS:
+            raise ValueError(f"Unsupported probe target {target}, expected host[:port] or an http:// or https:// URL")
+        self.target = target
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port or DEFAULT_PORTS[parsed.scheme]
+        self.path = parsed.path or '/'
+        try:
+            self.address: Optional[str] = socket.getaddrinfo(self.host, self.port, socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
+        except socket.gaierror:
+            self.address = None
+
+#region probes
+
+def probe_tcp(endpoint: Endpoint, timeout: float) -> float:
+    """
+    Return the time in seconds it takes to complete a TCP handshake with
+    `endpoint`, i.e. one round trip plus the time the peer needs to accept.
+    """
+    start = perf_counter_ns()
+    sock = create_connection((endpoint.address, endpoint.port), timeout)
+    elapsed = perf_counter_ns() - start
+    sock.close()
+    return elapsed / 1e9
+
+
+class HTTPProber:
+    """
+    Measure the time from sending a `HEAD` request until the status line of
+    the response arrives. Every worker thread keeps its own connection per
+    endpoint alive, connecting is not part of the measurement.
+    """
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections: List[http.client.HTTPConnection] = []
+
+    def _connection(self, endpoint: Endpoint) -> http.client.HTTPConnection:
+        connections = self.local.__dict__.setdefault('connections', {})
+        connection = connections.get(endpoint.target)
+        if connection is None:
+            connection = (SpeedtestHTTPSConnection if endpoint.scheme == 'https' else SpeedtestHTTPConnection)(endpoint.host, endpoint.port, timeout=self.timeout)
+            connection.connect()
+            connections[endpoint.target] = connection
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
+    def __call__(self, endpoint: Endpoint, timeout: float) -> float:
+        connection = self._connection(endpoint)
+        try:
+            start = perf_counter_ns()
+            connection.request('HEAD', endpoint.path, headers={'Connection': 'keep-alive'})
+            response = connection.getresponse()
+            elapsed = perf_counter_ns() - start
+            response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnect next time, the server may just have closed an idle connection
+            connection.close()
+            del self.local.connections[endpoint.target]
+            raise
+        if response.will_close:
+            connection.close()
+            del self.local.connections[endpoint.target]
+        return elapsed / 1e9
+
+    def close(self) -> None:
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+
+#endregion probes
+
+def probe_many(targets: Sequence[str], method: str='tcp', count: int=4, interval: float=0.2, timeout: float=2.0, workers: Optional[int]=None) -> Dict[str, RTTStatistics]:
+    """
+    Measure the TCP connect or HTTP request latency of all `targets` without
+    special privileges and return streaming statistics per target like
+    `icmp.ping_many`. One probe per target is started every `interval` seconds
+    on a pool of `workers` threads, so slow targets do not hold up the others.
+    Probes that fail, take longer than `timeout` or are refused count as lost.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown probe method {method}, expected one of: {', '.join(METHODS)}")
+    endpoints = [Endpoint(target) for target in targets]
+    statistics = {target: RTTStatistics() for target in targets}
+    workers = workers or min(64, 4 * len(endpoints))
+    probe = probe_tcp if method == 'tcp' else HTTPProber(timeout)
+    lock = threading.Lock()
+    # Bounds the probes in flight, a backlog would otherwise grow with `count`
+    slots = threading.BoundedSemaphore(2 * workers)
+
+    def run(endpoint: Endpoint) -> None:
+        try:
+            rtt = probe(endpoint, timeout)
+        except (OSError, http.client.HTTPException):
+            rtt = None
+        finally:
+            slots.release()
+        if rtt is not None and rtt <= timeout:
+            with lock:
+                statistics[endpoint.target].add(rtt)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='probe') as executor:
+            start = perf_counter_ns()
+            for index in range(count):
+                if (delay := start + int(index * interval * 1e9) - perf_counter_ns()) > 0:
+                    sleep(delay / 1e9)
+                for endpoint in endpoints:
+                    statistics[endpoint.target].sent += 1
+                    if endpoint.address is None:
+                        continue
+                    slots.acquire()
+                    executor.submit(run, endpoint)
+    finally:
+        if isinstance(probe, HTTPProber):
+            probe.close()
+    return statistics
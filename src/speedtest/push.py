@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+import gzip
+import http.client
+import json
+import os
+import random
+import socket
+import threading
+from pathlib import Path
+from time import monotonic, time_ns
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from . import utils
+from .__init__ import __version__, package_name
+from .config import SPOOLDIR
+
+#region spool
+
+class Spool:
+    """
+    Results waiting to be pushed to a collector, kept on disk as NDJSON so that
+    they survive restarts and network outages. New records are appended to
+    `pending.ndjson`, pushing moves that file aside as a segment first so that
+    writers never wait for the network. Batches the collector rejected are set
+    aside in `rejected-*.ndjson` files. Once all files grow beyond `max_bytes`
+    the oldest rejected batches and segments are dropped.
+    """
+    def __init__(self, directory: Path, max_bytes: int=64 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.pending = directory.joinpath('pending.ndjson')
+
+    def write(self, name: str, rows: List[Dict]) -> None:
+        """
+        Append the `name` results in `rows` with a single locked write.
+        """
+        if not rows:
+            return
+        host = socket.gethostname()
+        data = ''.join(json.dumps({'name': name, 'host': host, 'row': row}) + '\n' for row in rows).encode('utf-8')
+        with utils.locked_file(self.pending) as fd:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+
+    def segments(self) -> List[Path]:
+        """
+        Return the segments waiting to be pushed, oldest first.
+        """
+        return sorted(self.directory.glob('segment-*.ndjson'))
+
+    def rejected(self) -> List[Path]:
+        """
+        Return the files of rejected batches, oldest first.
+        """
+        return sorted(self.directory.glob('rejected-*.ndjson'))
+
+    def reject(self, segment: Path, lines: List[bytes]) -> None:
+        """
+        Set the records in `lines` of `segment` aside for a closer look.
+        """
+        with utils.locked_file(segment.with_name(segment.name.replace('segment-', 'rejected-', 1))) as fd:
+            data = memoryview(b''.join(lines))
+            while data:
+                data = data[os.write(fd, data):]
+
+    def rotate(self) -> None:
+        """
+        Move pending records into a new segment, writers reopen `pending.ndjson`.
+        """
+        with utils.locked_file(self.pending) as fd:
+            if os.fstat(fd).st_size:
+                os.replace(self.pending, self.directory.joinpath(f"segment-{time_ns():020d}.ndjson"))
+
+    def trim(self) -> int:
+        """
+        Drop the oldest rejected batches and segments while the spool exceeds
+        `max_bytes` and return the number of dropped records.
+        """
+        segments = [*self.rejected(), *self.segments()]
+        total = sum(segment.stat().st_size for segment in segments) + (self.pending.stat().st_size if self.pending.exists() else 0)
+        dropped = 0
+        while total > self.max_bytes and segments:
+            segment = segments.pop(0)
+            total -= segment.stat().st_size
+            with open(segment, mode='rb') as file_handler:
+                dropped += sum(1 for _ in file_handler)
+            segment.unlink()
+        if dropped:
+            utils.logger.warning(f"Dropped {dropped} spooled results because the spool exceeded {self.max_bytes} bytes")
+        return dropped
+
+    def __len__(self) -> int:
+        count = 0
+        for path in [*self.segments(), self.pending]:
+            if path.exists():
+                with open(path, mode='rb') as file_handler:
+                    count += sum(1 for _ in file_handler)
+        return count
+
+#endregion spool
+
+#region collector
+
+class PushError(Exception):
+    def __init__(self, status: int, reason: str):
+        super().__init__(f"The collector answered with HTTP {status} {reason}")
+        self.status = status
+
+    @property
+    def rejected(self) -> bool:
+        """
+        Whether the collector refused the batch itself, so that sending it again
+        cannot help. Authentication errors and rate limits are retried.
+        """
+        return 400 <= self.status < 500 and self.status not in (401, 403, 408, 429)
+
+
+class Collector:
+    """
+    Client of a collector that accepts batches of results as gzip-compressed
+    NDJSON in the body of a `POST` to `url`. The connection is kept alive in
+    between batches and reopened once if the collector closed it meanwhile.
+    """
+    def __init__(self, url: str, token: Optional[str]=None, timeout: float=10):
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https'):
+            raise ValueError(f"Unsupported collector URL {url}, expected http:// or https://")
+        self.url = url
+        self.parsed = parsed
+        self.token = token
+        self.timeout = timeout
+        self.connection: Optional[http.client.HTTPConnection] = None
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.connection is None:
+            connection = http.client.HTTPSConnection if self.parsed.scheme == 'https' else http.client.HTTPConnection
+            self.connection = connection(self.parsed.hostname, self.parsed.port, timeout=self.timeout)
+        return self.connection
+
+    def post(self, lines: List[bytes]) -> None:
+        """
+        Send one batch of NDJSON `lines`, raising `PushError` unless the
+        collector acknowledged it with a 2xx status.
+        """
+        body = gzip.compress(b''.join(lines))
+        headers = {
+            'Content-Type': 'application/x-ndjson',
+            'Content-Encoding': 'gzip',
+            'User-Agent': f"{package_name}/{__version__}",
+        }
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+
+        for attempt in range(2):
+            reused = self.connection is not None
+            try:
+                connection = self._connect()
+                connection.request('POST', self.parsed._replace(scheme='', netloc='').geturl() or '/', body, headers)
+                response = connection.getresponse()
+                # Reading the whole response keeps the connection usable
+                response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except (OSError, http.client.HTTPException):
+                self.close()
+                raise
+            if response.will_close:
+                self.close()
+            if not 200 <= response.status < 300:
+                raise PushError(response.status, response.reason)
+            return
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+#endregion collector
+
+#region pushing
+
+class Backoff:
+    """
+    Exponential backoff with full jitter: after `n` consecutive failures the
+    next attempt waits a random time of up to `base * 2 ** n` seconds, but at
+    most `cap` seconds.
+    """
+    def __init__(self, base: float=1, cap: float=600):
+        self.base = base
+        self.cap = cap
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def ready(self) -> bool:
+        return monotonic() >= self.retry_at
+
+    def failed(self) -> float:
+        self.failures += 1
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** self.failures))
+        self.retry_at = monotonic() + delay
+        return delay
+
+    def succeeded(self) -> None:
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+class Pusher:
+    """
+    Push spooled results to a collector in batches of `batch_size` records.
+    Delivery is at least once: a segment is only shortened or removed after
+    the collector acknowledged its records, so a batch may be sent twice if
+    the acknowledgement got lost. Batches the collector rejects are set aside
+    in the spool instead of holding up the ones after them. Only one pusher
+    works on a spool at a time, concurrent calls return right away.
+    """
+    def __init__(self, spool: Spool, collector: Collector, batch_size: int=500, backoff: Optional[Backoff]=None):
+        self.spool = spool
+        self.collector = collector
+        self.batch_size = batch_size
+        self.backoff = backoff or Backoff()
+        self.lock = threading.Lock()
+
+    def _push_segment(self, segment: Path) -> int:
+        with open(segment, mode='rb') as file_handler:
+            lines = [line for line in file_handler if line.strip()]
+        count = 0
+        for start in range(0, len(lines), self.batch_size):
+            batch = lines[start:start + self.batch_size]
+            try:
+                self.collector.post(batch)
+                count += len(batch)
+            except PushError as error:
+                if not error.rejected:
+                    raise
+                self.spool.reject(segment, batch)
+                utils.logger.warning(f"Set {len(batch)} results aside in the spool because the collector rejected them: {error}")
+            remainder = lines[start + self.batch_size:]
+            if remainder:
+                # Remember the progress in case the next batch fails
+                temporary = segment.with_name(f".{segment.name}.tmp")
+                with open(temporary, mode='wb') as file_handler:
+                    file_handler.writelines(remainder)
+                os.replace(temporary, segment)
+        segment.unlink()
+        return count
+
+    def push(self, force: bool=False) -> int:
+        """
+        Push all spooled results unless the last attempt failed too recently,
+        and return the number of results the collector acknowledged.
+        """
+        if not (force or self.backoff.ready()) or not self.lock.acquire(blocking=False):
+            return 0
+        count = 0
+        try:
+            with utils.locked_file(self.spool.directory.joinpath('push.lock'), blocking=False):
+                self.spool.rotate()
+                self.spool.trim()
+                for segment in self.spool.segments():
+                    count += self._push_segment(segment)
+        except BlockingIOError:
+            # Another process is pushing this spool
+            pass
+        except (OSError, http.client.HTTPException, PushError) as error:
+            delay = self.backoff.failed()
+            utils.logger.warning(f"Could not push results to {self.collector.url}, retrying in {delay:.0F}s: {error}")
+        else:
+            self.backoff.succeeded()
+        finally:
+            self.lock.release()
+        return count
+
+    def close(self) -> None:
+        self.collector.close()
+
+#endregion pushing
+
+def open_pusher(url: str, token: Optional[str]=None, max_bytes: int=64 << 20, timeout: float=10) -> Pusher:
+    """
+    Create a `Pusher` for `url` that works on the spool in the config directory.
+    """
+    return Pusher(Spool(utils.get_config_dir().joinpath(SPOOLDIR), max_bytes), Collector(url, token, timeout))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import math
+from time import time
+from typing import Dict, List, Optional
+
+from . import utils
+from .history import LEVELS, History
+from .stats import Samples, aggregate
+
+DAY = 86400
+
+
+class RetentionPolicy:
+    """
+    Keep raw results for `raw_days` and hourly rollups for `hourly_days`,
+    daily rollups are kept for good. `None` keeps the respective rows forever.
+    """
+    __slots__ = ('raw_days', 'hourly_days')
+
+    def __init__(self, raw_days: Optional[float]=None, hourly_days: Optional[float]=None):
+        self.raw_days = raw_days
+        self.hourly_days = hourly_days
+
+    @staticmethod
+    def cutoff(days: float, now: float) -> float:
+        """
+        Return the start of the day `days` before `now`, so that every day is
+        compacted at once and hourly and daily rollups see the same results.
+        """
+        return math.floor((now - days * DAY) / DAY) * DAY
+
+
+def rollup_rows(samples: Samples, width: float) -> List[Dict]:
+    """
+    Summarize `samples` per target and time bucket as rollup rows in
+    chronological order.
+    """
+    rows = []
+    for bucket in aggregate(samples, width):
+        row = {'DateTime': bucket['start']}
+        if bucket['target'] is not None:
+            row['Target'] = bucket['target']
+        row['Count'] = bucket['count']
+        for metric, summary in bucket['metrics'].items():
+            row.update({f"{metric}{name.title()}": value for name, value in summary.items()})
+        rows.append(row)
+    # Histories are kept in chronological order
+    return sorted(rows, key=lambda row: row['DateTime'])
+
+
+def compact(history: History, policy: RetentionPolicy, now: Optional[float]=None) -> int:
+    """
+    Move whole days of raw results that have outlived `policy` into the hourly
+    and daily rollups of `history`, drop expired hourly rollups and return the
+    number of raw results that were rolled up. Cheap enough to call after
+    every write since nothing happens until the oldest day expires.
+    """
+    if policy.raw_days is None:
+        return 0
+    now = time() if now is None else now
+    cutoff = policy.cutoff(policy.raw_days, now)
+    oldest = history.oldest()
+    if oldest is None or oldest >= cutoff:
+        return 0
+
+    # Concurrent compactions of the same history would both roll up the expired days
+    with utils.locked_file(history.path.with_name(f".{history.name}.compact.lock")):
+        oldest = history.oldest()
+        if oldest is None or oldest >= cutoff:
+            return 0
+        samples = Samples.load(history, until=cutoff)
+        for level, width in LEVELS.items():
+            rollup = history.rollup(level)
+            try:
+                # Buckets up to the last one were rolled up by a run that died before removing its raw results
+                last = rollup.tail(1)
+                since = utils.parse_timestamp(last[0]['DateTime']) if last else None
+                rollup.append([row for row in rollup_rows(samples, width) if since is None or row['DateTime'] > since])
+                if level == 'hourly' and policy.hourly_days is not None:
+                    rollup.remove_before(policy.cutoff(policy.hourly_days, now))
+            finally:
+                rollup.close()
+        # Drop raw results last so that an interruption never loses data
+        history.remove_before(cutoff)
+    return len(samples)
@@ -22,7 +22,9 @@
 import math
 import errno
 import signal
+import functools
 import socket
+import struct
 import timeit
 import datetime
 import platform
@@ -36,6 +38,11 @@
     gzip = None
     GZIP_BASE = object
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
 __version__ = '2.1.3'
 
 
@@ -276,6 +283,10 @@ def write(data):
 else:
     thread_is_alive = threading.Thread.isAlive
 
+# The last socket connected by the current thread, test threads open exactly
+# one connection each so this is how they get hold of their socket
+_connection_state = threading.local()
+
 
 # Exception "constants" to support Python 2 through Python 3
 try:
@@ -364,8 +375,114 @@ class SpeedtestMissingBestServer(SpeedtestException):
     """get_best_server not called or not able to determine best server"""
 
 
+class InterfaceCountersError(SpeedtestException):
+    """Interface does not exist or its counters cannot be read"""
+
+
+class SocketOptions(object):
+    """Socket tuning applied to every test socket of a run
+
+    ``rcvbuf`` and ``sndbuf`` set ``SO_RCVBUF``/``SO_SNDBUF`` in bytes,
+    ``nodelay`` toggles ``TCP_NODELAY``, ``congestion`` selects a
+    ``TCP_CONGESTION`` algorithm (e.g. ``bbr``) and ``quickack`` toggles
+    ``TCP_QUICKACK``. Options not supported by the platform are skipped.
+
+    The values actually granted by the kernel are read back after connecting
+    and kept in ``effective``
+    """
+
+    def __init__(self, rcvbuf=None, sndbuf=None, nodelay=None,
+                 congestion=None, quickack=None):
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+        self.nodelay = nodelay
+        self.congestion = congestion
+        self.quickack = quickack
+        self.effective = {}
+
+    def requested(self):
+        """Return the options that were explicitly requested"""
+
+        return dict((k, v) for k, v in (
+            ('rcvbuf', self.rcvbuf),
+            ('sndbuf', self.sndbuf),
+            ('nodelay', self.nodelay),
+            ('congestion', self.congestion),
+            ('quickack', self.quickack),
+        ) if v is not None)
+
+    @staticmethod
+    def _setsockopt(sock, level, name, value):
+        option = getattr(socket, name, None)
+        if option is None:
+            printer('%s is not supported on this platform' % name, debug=True)
+            return
+        try:
+            sock.setsockopt(level, option, value)
+        except socket.error:
+            e = get_exception()
+            printer('Could not set %s: %r' % (name, e), debug=True)
+
+    def pre_connect(self, sock):
+        """Apply the options that must be in place before the handshake,
+        buffer sizes determine the advertised window scale
+        """
+
+        if self.rcvbuf is not None:
+            self._setsockopt(sock, socket.SOL_SOCKET, 'SO_RCVBUF',
+                             int(self.rcvbuf))
+        if self.sndbuf is not None:
+            self._setsockopt(sock, socket.SOL_SOCKET, 'SO_SNDBUF',
+                             int(self.sndbuf))
+        if self.nodelay is not None:
+            self._setsockopt(sock, socket.IPPROTO_TCP, 'TCP_NODELAY',
+                             int(bool(self.nodelay)))
+        if self.congestion:
+            self._setsockopt(sock, socket.IPPROTO_TCP, 'TCP_CONGESTION',
+                             self.congestion.encode())
+
+    def post_connect(self, sock):
+        """Apply the options that do not survive the handshake and record
+        the effective values granted by the kernel
+        """
+
+        if self.quickack is not None:
+            self._setsockopt(sock, socket.IPPROTO_TCP, 'TCP_QUICKACK',
+                             int(bool(self.quickack)))
+        self.effective.update(self.read(sock))
+
+    @staticmethod
+    def read(sock):
+        """Read the current tuning values of ``sock``"""
+
+        values = {}
+        for key, level, name in (
+                ('rcvbuf', socket.SOL_SOCKET, 'SO_RCVBUF'),
+                ('sndbuf', socket.SOL_SOCKET, 'SO_SNDBUF'),
+                ('nodelay', socket.IPPROTO_TCP, 'TCP_NODELAY'),
+                ('quickack', socket.IPPROTO_TCP, 'TCP_QUICKACK')):
+            option = getattr(socket, name, None)
+            if option is None:
+                continue
+            try:
+                value = sock.getsockopt(level, option)
+            except socket.error:
+                continue
+            values[key] = value if key in ('rcvbuf', 'sndbuf') else bool(value)
+
+        option = getattr(socket, 'TCP_CONGESTION', None)
+        if option is not None:
+            try:
+                raw = sock.getsockopt(socket.IPPROTO_TCP, option, 16)
+                values['congestion'] = raw.split(b'\x00', 1)[0].decode()
+            except socket.error:
+                pass
+
+        return values
+
+
 def create_connection(address, timeout=_GLOBAL_DEFAULT_TIMEOUT,
-                      source_address=None):
+                      source_address=None, socket_options=None):
     """Connect to *address* and return the socket object.
 
     Convenience function.  Connect to *address* (a 2-tuple ``(host,
@@ -376,6 +493,8 @@ def create_connection(address, timeout=_GLOBAL_DEFAULT_TIMEOUT,
     is used.  If *source_address* is set it must be a tuple of (host, port)
     for the socket to bind as a source address before making the connection.
     An host of '' or port 0 tells the OS to use the default.
+    If *socket_options* is set it must be a ``SocketOptions`` instance
+    that is applied to the socket around the connect.
 
     Largely vendored from Python 2.7, modified to work with Python 2.4
     """
@@ -389,9 +508,13 @@ def create_connection(address, timeout=_GLOBAL_DEFAULT_TIMEOUT,
             sock = socket.socket(af, socktype, proto)
             if timeout is not _GLOBAL_DEFAULT_TIMEOUT:
                 sock.settimeout(float(timeout))
+            if socket_options:
+                socket_options.pre_connect(sock)
             if source_address:
                 sock.bind(source_address)
             sock.connect(sa)
+            if socket_options:
+                socket_options.post_connect(sock)
             return sock
 
         except socket.error:
@@ -412,6 +535,7 @@ class SpeedtestHTTPConnection(HTTPConnection):
     def __init__(self, *args, **kwargs):
         source_address = kwargs.pop('source_address', None)
         timeout = kwargs.pop('timeout', 10)
+        socket_options = kwargs.pop('socket_options', None)
 
         self._tunnel_host = None
 
@@ -419,21 +543,34 @@ def __init__(self, *args, **kwargs):
 
         self.source_address = source_address
         self.timeout = timeout
+        self.socket_options = socket_options
 
     def connect(self):
         """Connect to the host and port specified in __init__."""
-        try:
-            self.sock = socket.create_connection(
-                (self.host, self.port),
-                self.timeout,
-                self.source_address
-            )
-        except (AttributeError, TypeError):
+        connect_start = timeit.default_timer()
+        if self.socket_options:
             self.sock = create_connection(
                 (self.host, self.port),
                 self.timeout,
-                self.source_address
+                self.source_address,
+                socket_options=self.socket_options
             )
+        else:
+            try:
+                self.sock = socket.create_connection(
+                    (self.host, self.port),
+                    self.timeout,
+                    self.source_address
+                )
+            except (AttributeError, TypeError):
+                self.sock = create_connection(
+                    (self.host, self.port),
+                    self.timeout,
+                    self.source_address
+                )
+
+        _connection_state.sock = self.sock
+        _connection_state.connect = (connect_start, timeit.default_timer())
 
         if self._tunnel_host:
             self._tunnel()
@@ -449,6 +586,7 @@ class SpeedtestHTTPSConnection(HTTPSConnection):
         def __init__(self, *args, **kwargs):
             source_address = kwargs.pop('source_address', None)
             timeout = kwargs.pop('timeout', 10)
+            socket_options = kwargs.pop('socket_options', None)
 
             self._tunnel_host = None
 
@@ -456,21 +594,34 @@ def __init__(self, *args, **kwargs):
 
             self.timeout = timeout
             self.source_address = source_address
+            self.socket_options = socket_options
 
         def connect(self):
             "Connect to a host on a given (SSL) port."
-            try:
-                self.sock = socket.create_connection(
-                    (self.host, self.port),
-                    self.timeout,
-                    self.source_address
-                )
-            except (AttributeError, TypeError):
+            connect_start = timeit.default_timer()
+            if self.socket_options:
                 self.sock = create_connection(
                     (self.host, self.port),
                     self.timeout,
-                    self.source_address
+                    self.source_address,
+                    socket_options=self.socket_options
                 )
+            else:
+                try:
+                    self.sock = socket.create_connection(
+                        (self.host, self.port),
+                        self.timeout,
+                        self.source_address
+                    )
+                except (AttributeError, TypeError):
+                    self.sock = create_connection(
+                        (self.host, self.port),
+                        self.timeout,
+                        self.source_address
+                    )
+
+            _connection_state.sock = self.sock
+            _connection_state.connect = (connect_start, timeit.default_timer())
 
             if self._tunnel_host:
                 self._tunnel()
@@ -506,7 +657,8 @@ def connect(self):
                 )
 
 
-def _build_connection(connection, source_address, timeout, context=None):
+def _build_connection(connection, source_address, timeout, context=None,
+                      socket_options=None):
     """Cross Python 2.4 - Python 3 callable to build an ``HTTPConnection`` or
     ``HTTPSConnection`` with the args we need
 
@@ -520,25 +672,30 @@ def inner(host, **kwargs):
         })
         if context:
             kwargs['context'] = context
+        if socket_options:
+            kwargs['socket_options'] = socket_options
         return connection(host, **kwargs)
     return inner
 
 
 class SpeedtestHTTPHandler(AbstractHTTPHandler):
     """Custom ``HTTPHandler`` that can build a ``HTTPConnection`` with the
-    args we need for ``source_address`` and ``timeout``
+    args we need for ``source_address``, ``timeout`` and ``socket_options``
     """
-    def __init__(self, debuglevel=0, source_address=None, timeout=10):
+    def __init__(self, debuglevel=0, source_address=None, timeout=10,
+                 socket_options=None):
         AbstractHTTPHandler.__init__(self, debuglevel)
         self.source_address = source_address
         self.timeout = timeout
+        self.socket_options = socket_options
 
     def http_open(self, req):
         return self.do_open(
             _build_connection(
                 SpeedtestHTTPConnection,
                 self.source_address,
-                self.timeout
+                self.timeout,
+                socket_options=self.socket_options
             ),
             req
         )
@@ -548,14 +705,15 @@ def http_open(self, req):
 
 class SpeedtestHTTPSHandler(AbstractHTTPHandler):
     """Custom ``HTTPSHandler`` that can build a ``HTTPSConnection`` with the
-    args we need for ``source_address`` and ``timeout``
+    args we need for ``source_address``, ``timeout`` and ``socket_options``
     """
     def __init__(self, debuglevel=0, context=None, source_address=None,
-                 timeout=10):
+                 timeout=10, socket_options=None):
         AbstractHTTPHandler.__init__(self, debuglevel)
         self._context = context
         self.source_address = source_address
         self.timeout = timeout
+        self.socket_options = socket_options
 
     def https_open(self, req):
         return self.do_open(
@@ -564,6 +722,7 @@ def https_open(self, req):
                 self.source_address,
                 self.timeout,
                 context=self._context,
+                socket_options=self.socket_options
             ),
             req
         )
@@ -571,11 +730,11 @@ def https_open(self, req):
     https_request = AbstractHTTPHandler.do_request_
 
 
-def build_opener(source_address=None, timeout=10):
+def build_opener(source_address=None, timeout=10, socket_options=None):
     """Function similar to ``urllib2.build_opener`` that will build
     an ``OpenerDirector`` with the explicit handlers we want,
-    ``source_address`` for binding, ``timeout`` and our custom
-    `User-Agent`
+    ``source_address`` for binding, ``timeout``, ``socket_options`` for
+    tuning every test socket and our custom `User-Agent`
     """
 
     printer('Timeout set to %d' % timeout, debug=True)
@@ -587,12 +746,18 @@ def build_opener(source_address=None, timeout=10):
     else:
         source_address_tuple = None
 
+    if socket_options:
+        printer('Socket options: %r' % (socket_options.requested(),),
+                debug=True)
+
     handlers = [
         ProxyHandler(),
         SpeedtestHTTPHandler(source_address=source_address_tuple,
-                             timeout=timeout),
+                             timeout=timeout,
+                             socket_options=socket_options),
         SpeedtestHTTPSHandler(source_address=source_address_tuple,
-                              timeout=timeout),
+                              timeout=timeout,
+                              socket_options=socket_options),
         HTTPDefaultErrorHandler(),
         HTTPRedirectHandler(),
         HTTPErrorProcessor()
@@ -779,21 +944,502 @@ def inner(current, total, start=False, end=False):
     return inner
 
 
+def print_progress(shutdown_event, units=('bit', 1)):
+    """Built in ``progress`` callback rewriting a single status line with the
+    current throughput while stdout is a terminal, or printing a dot per
+    event otherwise
+    """
+    tty = sys.stdout.isatty()
+
+    def inner(event):
+        if shutdown_event.isSet():
+            return
+
+        if tty:
+            sys.stdout.write('\rTesting %s speed: %0.2f M%s/s (%d streams)'
+                             '\033[K' %
+                             (event.phase,
+                              (event.throughput / 1000.0 / 1000.0) / units[1],
+                              units[0], event.active))
+            if event.done:
+                sys.stdout.write('\r\033[K')
+        else:
+            sys.stdout.write('.')
+            if event.done:
+                sys.stdout.write('\n')
+        sys.stdout.flush()
+    return inner
+
+
 def do_nothing(*args, **kwargs):
     pass
 
 
+class ProgressEvent(object):
+    """Snapshot of a running test phase as handed to ``progress`` callbacks
+
+    ``bytes`` moved so far, ``throughput`` in bit/s since the previous event,
+    ``average`` in bit/s since the phase started, the number of ``active``
+    streams and the ``elapsed`` seconds. The last event of a phase has
+    ``done`` set
+    """
+
+    __slots__ = ('phase', 'elapsed', 'bytes', 'throughput', 'average',
+                 'active', 'done')
+
+    def __init__(self, phase, elapsed, bytes, throughput, average, active,
+                 done=False):
+        self.phase = phase
+        self.elapsed = elapsed
+        self.bytes = bytes
+        self.throughput = throughput
+        self.average = average
+        self.active = active
+        self.done = done
+
+    def dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return 'ProgressEvent(%r)' % self.dict()
+
+
+class ProgressMonitor(threading.Thread):
+    """Thread emitting ``ProgressEvent`` at no more than ``rate`` per second
+    while a test phase runs
+
+    It reads the running byte counters of the test threads through
+    ``counter`` on its own schedule, so neither the transfer loops nor the
+    producer and consumer do any extra work for it
+    """
+
+    def __init__(self, phase, callback, counter, rate=10):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.phase = phase
+        self.callback = callback
+        self.counter = counter
+        self.interval = 1.0 / rate
+        self.workers = set()
+        self.finished = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._last = (0, 0)
+
+    def add(self, worker):
+        with self._lock:
+            self.workers.add(worker)
+
+    def remove(self, worker, nbytes):
+        with self._lock:
+            self.workers.discard(worker)
+            self.finished += nbytes
+
+    def emit(self, done=False):
+        with self._lock:
+            workers = list(self.workers)
+            total = self.finished + sum(self.counter(w) for w in workers)
+        now = timeit.default_timer()
+        elapsed = now - self.starttime
+        last_time, last_bytes = self._last
+        delta = now - last_time
+        self._last = (now, total)
+        self.callback(ProgressEvent(
+            self.phase,
+            elapsed,
+            total,
+            (total - last_bytes) / delta * 8.0 if delta > 0 else 0,
+            total / elapsed * 8.0 if elapsed > 0 else 0,
+            sum(1 for w in workers if thread_is_alive(w)),
+            done
+        ))
+
+    def start(self, starttime=None):
+        self.starttime = starttime or timeit.default_timer()
+        self._last = (self.starttime, 0)
+        threading.Thread.start(self)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.emit()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.emit(done=True)
+
+
+# Offsets into the Linux ``struct tcp_info``, fields beyond what the running
+# kernel returns are left out of a sample
+TCP_INFO_FIELDS = (
+    ('rtt', 'I', 68),
+    ('rttvar', 'I', 72),
+    ('snd_cwnd', 'I', 80),
+    ('total_retrans', 'I', 100),
+    ('min_rtt', 'I', 148),
+    ('delivery_rate', 'Q', 160),
+    ('busy_time', 'Q', 168),
+    ('rwnd_limited', 'Q', 176),
+    ('sndbuf_limited', 'Q', 184),
+)
+TCP_INFO_LENGTH = 232
+TCP_INFO = getattr(socket, 'TCP_INFO', None)
+if not sys.platform.startswith('linux'):
+    TCP_INFO = None
+
+
+def parse_tcp_info(raw):
+    """Unpack the fields we are interested in from a ``TCP_INFO`` buffer"""
+
+    info = {}
+    for name, fmt, offset in TCP_INFO_FIELDS:
+        if offset + struct.calcsize(fmt) > len(raw):
+            break
+        info[name] = struct.unpack_from('=' + fmt, raw, offset)[0]
+    return info
+
+
+class TCPInfoSampler(object):
+    """Periodically sample ``getsockopt(TCP_INFO)`` of a test socket
+
+    ``sample`` is meant to be called from the transfer loop with a timer
+    value the loop already has at hand, it only does a syscall once every
+    ``interval`` seconds. Only the latest sample and a few peak values are
+    kept so that memory does not grow with the length of a test
+    """
+
+    def __init__(self, sock, interval):
+        self.sock = sock
+        self.interval = interval
+        self.next_sample = 0
+        self.samples = 0
+        self.last = {}
+        self.max_cwnd = 0
+        self.max_delivery_rate = 0
+
+    @classmethod
+    def for_current_thread(cls, interval):
+        """Build a sampler for the socket connected by the current thread
+        or return ``None`` if sampling is disabled or unsupported
+        """
+
+        if not interval or TCP_INFO is None:
+            return None
+        sock = getattr(_connection_state, 'sock', None)
+        if sock is None:
+            return None
+        return cls(sock, interval)
+
+    def sample(self, now):
+        if now < self.next_sample:
+            return
+        self.next_sample = now + self.interval
+        try:
+            raw = self.sock.getsockopt(socket.IPPROTO_TCP, TCP_INFO,
+                                       TCP_INFO_LENGTH)
+        except (socket.error, ValueError):
+            # The socket is gone, keep what we have
+            self.next_sample = float('inf')
+            return
+        info = parse_tcp_info(raw)
+        self.samples += 1
+        self.last = info
+        self.max_cwnd = max(self.max_cwnd, info.get('snd_cwnd', 0))
+        self.max_delivery_rate = max(self.max_delivery_rate,
+                                     info.get('delivery_rate', 0))
+
+    def close(self):
+        """Take a final sample regardless of the interval"""
+
+        self.next_sample = 0
+        self.sample(timeit.default_timer())
+
+    def summary(self):
+        """Return the per-stream statistics in friendly units, RTTs and
+        limited times in ms and delivery rates in bit/s
+        """
+
+        last = self.last
+        summary = {'samples': self.samples}
+        if 'rtt' in last:
+            summary.update({
+                'rtt': last['rtt'] / 1000.0,
+                'rttvar': last['rttvar'] / 1000.0,
+                'cwnd': last['snd_cwnd'],
+                'max_cwnd': self.max_cwnd,
+                'retransmits': last['total_retrans'],
+            })
+        if 'min_rtt' in last:
+            summary['min_rtt'] = last['min_rtt'] / 1000.0
+        if 'delivery_rate' in last:
+            summary['delivery_rate'] = last['delivery_rate'] * 8.0
+            summary['max_delivery_rate'] = self.max_delivery_rate * 8.0
+        if 'sndbuf_limited' in last:
+            summary.update({
+                'busy_time': last['busy_time'] / 1000.0,
+                'rwnd_limited': last['rwnd_limited'] / 1000.0,
+                'sndbuf_limited': last['sndbuf_limited'] / 1000.0,
+            })
+        return summary
+
+
+# Per-segment framing we do not see from Python: Ethernet, IPv4 and TCP with
+# timestamps, over a typical 1448 byte MSS
+SEGMENT_OVERHEAD = 14 + 20 + 32
+SEGMENT_PAYLOAD = 1448
+
+
+def read_interface_counters(interface):
+    """Return the ``(rx_bytes, tx_bytes)`` counters of ``interface`` from
+    ``/proc/net/dev``
+    """
+
+    try:
+        with open('/proc/net/dev') as f:
+            for line in f:
+                name, sep, counters = line.partition(':')
+                if sep and name.strip() == interface:
+                    fields = counters.split()
+                    return int(fields[0]), int(fields[8])
+    except IOError:
+        raise InterfaceCountersError('Cannot read interface counters, '
+                                     'they are only available on Linux')
+    raise InterfaceCountersError('Unknown interface: %s' % interface)
+
+
+def find_interface(source_address=None):
+    """Find the egress interface for ``source_address``, or the interface of
+    the default route if no source address was given. Returns ``None`` where
+    this cannot be determined (anything but Linux)
+    """
+
+    if not os.path.exists('/proc/net/dev'):
+        return None
+
+    if source_address:
+        if ':' in source_address:
+            packed = socket.inet_pton(socket.AF_INET6, source_address)
+            try:
+                with open('/proc/net/if_inet6') as f:
+                    for line in f:
+                        fields = line.split()
+                        if bytes(bytearray.fromhex(fields[0])) == packed:
+                            return fields[-1]
+            except IOError:
+                pass
+            return None
+
+        import fcntl
+        packed = socket.inet_aton(source_address)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for _, name in socket.if_nameindex():
+                try:
+                    ifreq = fcntl.ioctl(sock.fileno(), 0x8915,  # SIOCGIFADDR
+                                        struct.pack('256s', name[:15].encode()))
+                except IOError:
+                    continue
+                if ifreq[20:24] == packed:
+                    return name
+        finally:
+            sock.close()
+        return None
+
+    best = None
+    try:
+        with open('/proc/net/route') as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if fields[1] == '00000000' and fields[7] == '00000000':
+                    metric = int(fields[6])
+                    if best is None or metric < best[0]:
+                        best = (metric, fields[0])
+    except (IOError, StopIteration):
+        pass
+    return best and best[1]
+
+
+class InterfaceCounterSampler(threading.Thread):
+    """Thread sampling the byte counters of a network interface at a fixed
+    rate for the duration of a test phase
+
+    The counters include everything that crossed the interface, so comparing
+    them with the bytes our readers saw tells us about protocol overhead and
+    traffic from other processes on the box
+    """
+
+    def __init__(self, interface, interval=0.1):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interface = interface
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self.first = None
+        self.last = None
+        self.peak = [0, 0]
+        self.error = None
+
+    def sample(self):
+        now = timeit.default_timer()
+        counters = read_interface_counters(self.interface)
+        if self.last is not None:
+            elapsed = now - self.last[0]
+            if elapsed > 0:
+                for i in (0, 1):
+                    rate = (counters[i] - self.last[1][i]) / elapsed * 8.0
+                    self.peak[i] = max(self.peak[i], rate)
+        self.last = (now, counters)
+        if self.first is None:
+            self.first = self.last
+
+    def run(self):
+        # An error ends sampling, the counters up to then are still reported
+        # together with the error by ``summary``
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.sample()
+            except Exception:
+                self.error = get_exception()
+                printer('Sampling interface %s failed: %s' %
+                        (self.interface, self.error), debug=True)
+                return
+
+    def start(self):
+        self.sample()
+        threading.Thread.start(self)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        if self.error is None:
+            try:
+                self.sample()
+            except Exception:
+                self.error = get_exception()
+                printer('Sampling interface %s failed: %s' %
+                        (self.interface, self.error), debug=True)
+
+    def summary(self, application_bytes, direction):
+        """Compare the interface counters of the sampled period against
+        ``application_bytes`` moved in ``direction`` (``rx`` or ``tx``)
+        """
+
+        elapsed = self.last[0] - self.first[0]
+        rx = self.last[1][0] - self.first[1][0]
+        tx = self.last[1][1] - self.first[1][1]
+        index = ('rx', 'tx').index(direction)
+        interface_bytes = (rx, tx)[index]
+        overhead = int(math.ceil(application_bytes / float(SEGMENT_PAYLOAD)) *
+                       SEGMENT_OVERHEAD)
+        return {
+            'interface': self.interface,
+            'duration': elapsed,
+            'rx_bytes': rx,
+            'tx_bytes': tx,
+            'rx': rx / elapsed * 8.0 if elapsed else 0,
+            'tx': tx / elapsed * 8.0 if elapsed else 0,
+            'peak_rx': self.peak[0],
+            'peak_tx': self.peak[1],
+            'application_bytes': application_bytes,
+            'estimated_overhead_bytes': overhead,
+            'foreign_bytes': max(0, interface_bytes - application_bytes -
+                                 overhead),
+            'error': str(self.error) if self.error else None,
+        }
+
+
+# A phase is considered client-bound once it keeps this share of one core
+# busy
+CLIENT_BOUND_THRESHOLD = 0.9
+
+
+def process_cpu_time():
+    """Return the ``(user, system)`` CPU seconds consumed by this process"""
+
+    if resource:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime, usage.ru_stime
+    times = os.times()
+    return times[0], times[1]
+
+
+def thread_cpu_time():
+    """Return the CPU seconds consumed by the calling thread, or ``None``
+    where per-thread accounting is not available
+    """
+
+    try:
+        return timeit.time.thread_time()
+    except AttributeError:
+        return None
+
+
+class CPUMeter(object):
+    """Account the CPU time spent by the client during a test phase
+
+    Process CPU time is taken from ``getrusage``, test threads report their
+    own ``thread_time`` so that the share burnt in the Python transfer loops
+    can be told apart from the rest of the process
+    """
+
+    def __init__(self, threads):
+        self.threads = threads
+        self.start()
+
+    def start(self):
+        self.wall = timeit.default_timer()
+        self.cpu = process_cpu_time()
+
+    def summary(self, nbytes, thread_times):
+        wall = timeit.default_timer() - self.wall
+        user, system = process_cpu_time()
+        user -= self.cpu[0]
+        system -= self.cpu[1]
+        process = user + system
+        thread_times = [t for t in thread_times if t is not None]
+        threads = sum(thread_times)
+
+        max_thread = max(thread_times) if thread_times else 0
+        utilization = process / wall if wall else 0
+        # The transfer loops hold the GIL, so however many threads and cores
+        # there are, the Python side of the client runs on about one core at
+        # a time. A phase is client-bound once the process or its threads
+        # together keep a single core busy
+        client_bound = bool(wall) and (
+            utilization >= CLIENT_BOUND_THRESHOLD or
+            threads / wall >= CLIENT_BOUND_THRESHOLD
+        )
+
+        return {
+            'wall': wall,
+            'user': user,
+            'system': system,
+            'process': process,
+            'threads': threads,
+            'max_thread': max_thread,
+            'utilization': utilization,
+            'bytes_per_cpu_second': nbytes / process if process else 0,
+            'client_bound': client_bound,
+        }
+
+
 class HTTPDownloader(threading.Thread):
     """Thread class for retrieving a URL"""
 
     def __init__(self, i, request, start, timeout, opener=None,
-                 shutdown_event=None):
+                 shutdown_event=None, tcp_info_interval=None, tracer=None):
         threading.Thread.__init__(self)
         self.request = request
         self.result = [0]
+        self.received = 0
         self.starttime = start
         self.timeout = timeout
         self.i = i
+        self.tracer = tracer
+        self.tcp_info_interval = tcp_info_interval
+        self.tcp_info = None
+        self.cpu_time = None
         if opener:
             self._opener = opener.open
         else:
@@ -805,20 +1451,58 @@ def __init__(self, i, request, start, timeout, opener=None,
             self._shutdown_event = FakeShutdownEvent()
 
     def run(self):
+        cpu_start = thread_cpu_time()
+        try:
+            self._run()
+        finally:
+            if cpu_start is not None:
+                self.cpu_time = thread_cpu_time() - cpu_start
+
+    def _run(self):
+        tracer = self.tracer
+        track = 'download %d' % self.i
+        request_start = timeit.default_timer()
         try:
-            if (timeit.default_timer() - self.starttime) <= self.timeout:
+            if (request_start - self.starttime) <= self.timeout:
                 f = self._opener(self.request)
-                while (not self._shutdown_event.isSet() and
-                        (timeit.default_timer() - self.starttime) <=
-                        self.timeout):
-                    self.result.append(len(f.read(10240)))
-                    if self.result[-1] == 0:
+                sampler = self.tcp_info = TCPInfoSampler.for_current_thread(
+                    self.tcp_info_interval
+                )
+                if tracer:
+                    tracer.connection(track)
+                    tracer.instant(track, 'response')
+                    next_progress = 0
+                while not self._shutdown_event.isSet():
+                    now = timeit.default_timer()
+                    if (now - self.starttime) > self.timeout:
+                        break
+                    if sampler:
+                        sampler.sample(now)
+                    # A running total rather than a list of chunk sizes, so
+                    # progress can be read off any time at no extra cost
+                    n = len(f.read(10240))
+                    if n == 0:
                         break
+                    if tracer:
+                        if not self.received:
+                            tracer.instant(track, 'first byte')
+                        if now >= next_progress:
+                            next_progress = now + tracer.progress_interval
+                            tracer.counter(track, track, now,
+                                           {'bytes': self.received + n})
+                    self.received += n
+                if sampler:
+                    sampler.close()
                 f.close()
         except IOError:
             pass
         except HTTP_ERRORS:
             pass
+        self.result = [self.received]
+        if tracer:
+            tracer.complete(track, self.request.get_full_url().split('?')[0],
+                            request_start, timeit.default_timer(),
+                            {'bytes': self.received})
 
 
 class HTTPUploaderData(object):
@@ -826,10 +1510,16 @@ class HTTPUploaderData(object):
     has been reached
     """
 
-    def __init__(self, length, start, timeout, shutdown_event=None):
+    def __init__(self, length, start, timeout, shutdown_event=None,
+                 tcp_info_interval=None):
         self.length = length
         self.start = start
         self.timeout = timeout
+        self.tcp_info_interval = tcp_info_interval
+        self.tcp_info = None
+        self.tracer = None
+        self.track = None
+        self._next_progress = 0
 
         if shutdown_event:
             self._shutdown_event = shutdown_event
@@ -838,7 +1528,7 @@ def __init__(self, length, start, timeout, shutdown_event=None):
 
         self._data = None
 
-        self.total = [0]
+        self.sent = 0
 
     def pre_allocate(self):
         chars = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
@@ -863,10 +1553,25 @@ def data(self):
         return self._data
 
     def read(self, n=10240):
-        if ((timeit.default_timer() - self.start) <= self.timeout and
+        now = timeit.default_timer()
+        if ((now - self.start) <= self.timeout and
                 not self._shutdown_event.isSet()):
+            # Reads happen on the uploader thread once it is connected
+            if self.tcp_info is None and self.tcp_info_interval:
+                self.tcp_info = TCPInfoSampler.for_current_thread(
+                    self.tcp_info_interval
+                ) or False
+            if self.tcp_info:
+                self.tcp_info.sample(now)
             chunk = self.data.read(n)
-            self.total.append(len(chunk))
+            self.sent += len(chunk)
+            if self.tracer and now >= self._next_progress:
+                if not self._next_progress:
+                    self.tracer.connection(self.track)
+                    self.tracer.instant(self.track, 'first byte', now)
+                self._next_progress = now + self.tracer.progress_interval
+                self.tracer.counter(self.track, self.track, now,
+                                    {'bytes': self.sent})
             return chunk
         else:
             raise SpeedtestUploadTimeout()
@@ -879,7 +1584,7 @@ class HTTPUploader(threading.Thread):
     """Thread class for putting a URL"""
 
     def __init__(self, i, request, start, size, timeout, opener=None,
-                 shutdown_event=None):
+                 shutdown_event=None, tracer=None):
         threading.Thread.__init__(self)
         self.request = request
         self.request.data.start = self.starttime = start
@@ -887,6 +1592,10 @@ def __init__(self, i, request, start, size, timeout, opener=None,
         self.result = 0
         self.timeout = timeout
         self.i = i
+        self.tracer = self.request.data.tracer = tracer
+        self.track = self.request.data.track = 'upload %d' % i
+        self.tcp_info = None
+        self.cpu_time = None
 
         if opener:
             self._opener = opener.open
@@ -899,6 +1608,21 @@ def __init__(self, i, request, start, size, timeout, opener=None,
             self._shutdown_event = FakeShutdownEvent()
 
     def run(self):
+        cpu_start = thread_cpu_time()
+        request_start = timeit.default_timer()
+        try:
+            self._run()
+        finally:
+            if cpu_start is not None:
+                self.cpu_time = thread_cpu_time() - cpu_start
+            if self.tracer:
+                self.tracer.complete(
+                    self.track, self.request.get_full_url().split('?')[0],
+                    request_start, timeit.default_timer(),
+                    {'bytes': self.result}
+                )
+
+    def _run(self):
         request = self.request
         try:
             if ((timeit.default_timer() - self.starttime) <= self.timeout and
@@ -912,16 +1636,303 @@ def run(self):
                     request = build_request(self.request.get_full_url(),
                                             data=request.data.read(self.size))
                     f = self._opener(request)
+                if self.tracer:
+                    self.tracer.instant(self.track, 'response')
                 f.read(11)
+                self._close_tcp_info()
                 f.close()
-                self.result = sum(self.request.data.total)
+                self.result = self.request.data.sent
             else:
                 self.result = 0
         except (IOError, SpeedtestUploadTimeout):
-            self.result = sum(self.request.data.total)
+            self._close_tcp_info()
+            self.result = self.request.data.sent
         except HTTP_ERRORS:
             self.result = 0
 
+    def _close_tcp_info(self):
+        sampler = getattr(self.request.data, 'tcp_info', None)
+        if sampler:
+            sampler.close()
+            self.tcp_info = sampler
+
+
+class PhaseTiming(object):
+    """Monotonic start and end times and the byte count of a test phase or
+    one of its sub-steps
+
+    Instances are handed to the ``hook`` of ``Timings``, which may attach
+    its own attributes to them, e.g. a tracing span
+    """
+
+    def __init__(self, timings, name, parent=None):
+        self.timings = timings
+        self.name = name
+        self.parent = parent
+        self.start = None
+        self.end = None
+        self.bytes = 0
+        self.steps = []
+
+    @property
+    def path(self):
+        """Names of this phase and all its parents, outermost first"""
+
+        if self.parent is None:
+            return (self.name,)
+        return self.parent.path + (self.name,)
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+    def __enter__(self):
+        self.timings._push(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings._pop(self)
+        return False
+
+    def stop(self):
+        self.timings._pop(self)
+
+    def dict(self, origin):
+        data = {
+            'start': self.start - origin,
+            'end': None if self.end is None else self.end - origin,
+            'duration': self.duration,
+            'bytes': self.bytes,
+        }
+        if self.steps:
+            data['steps'] = Timings.dict_of(self.steps, origin)
+        return data
+
+
+class Timings(object):
+    """Record the timing of every phase and sub-step of a test
+
+    Phases started while another one is running become its steps. ``hook``
+    is called as ``hook(event, phase)`` with an event of ``'start'`` or
+    ``'end'`` and the ``PhaseTiming``
+    """
+
+    def __init__(self, hook=None):
+        self.origin = timeit.default_timer()
+        self.phases = []
+        self._stack = []
+        self._hook = hook
+
+    @property
+    def current(self):
+        """The innermost running phase"""
+
+        if self._stack:
+            return self._stack[-1]
+        return NULL_PHASE
+
+    def phase(self, name):
+        """Return a phase to be used as context manager"""
+
+        return PhaseTiming(self, name,
+                           self._stack[-1] if self._stack else None)
+
+    def start(self, name):
+        """Start a phase that is ended by calling its ``stop`` method"""
+
+        phase = self.phase(name)
+        self._push(phase)
+        return phase
+
+    def _push(self, phase):
+        phase.start = timeit.default_timer()
+        if phase.parent is None:
+            self.phases.append(phase)
+        else:
+            phase.parent.steps.append(phase)
+        self._stack.append(phase)
+        if self._hook:
+            self._hook('start', phase)
+
+    def _pop(self, phase):
+        # Also end steps left running by an exception
+        while phase in self._stack:
+            current = self._stack.pop()
+            current.end = timeit.default_timer()
+            if self._hook:
+                self._hook('end', current)
+
+    @staticmethod
+    def dict_of(phases, origin):
+        data = {}
+        for phase in phases:
+            key = phase.name
+            n = 1
+            while key in data:
+                n += 1
+                key = '%s#%d' % (phase.name, n)
+            data[key] = phase.dict(origin)
+        return data
+
+    def dict(self):
+        """Return the recorded phases keyed by name, times in seconds since
+        the ``Timings`` were created
+        """
+
+        return self.dict_of(self.phases, self.origin)
+
+
+class _NullPhase(object):
+    """No-op phase handed out while timings are disabled"""
+
+    bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def stop(self):
+        pass
+
+
+NULL_PHASE = _NullPhase()
+
+
+class NullTimings(object):
+    """Stand-in for ``Timings`` that records nothing"""
+
+    current = NULL_PHASE
+
+    def phase(self, name):
+        return NULL_PHASE
+
+    start = phase
+
+    def dict(self):
+        return {}
+
+
+def timed(name):
+    """Decorator running a method of an object with a ``timings`` attribute
+    as phase ``name``
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def inner(self, *args, **kwargs):
+            with self.timings.phase(name):
+                return func(self, *args, **kwargs)
+        return inner
+    return decorator
+
+
+class Tracer(object):
+    """Collect Chrome trace-event/Perfetto timeline events of a test run
+
+    Events are buffered in memory and only written out by ``write`` so that
+    tracing does not add I/O to the test. Every ``track`` is shown as its own
+    thread in the timeline
+    """
+
+    # Minimum spacing of progress samples per track
+    progress_interval = 0.01
+
+    def __init__(self):
+        self.origin = timeit.default_timer()
+        self.events = []
+        self._tracks = {}
+        self._lock = threading.Lock()
+
+    def _ts(self, t):
+        return round((t - self.origin) * 1e6, 1)
+
+    def _tid(self, track):
+        try:
+            return self._tracks[track]
+        except KeyError:
+            with self._lock:
+                if track not in self._tracks:
+                    tid = len(self._tracks) + 1
+                    self.events.append({
+                        'ph': 'M', 'name': 'thread_name', 'pid': 1,
+                        'tid': tid, 'args': {'name': track}
+                    })
+                    self.events.append({
+                        'ph': 'M', 'name': 'thread_sort_index', 'pid': 1,
+                        'tid': tid, 'args': {'sort_index': tid}
+                    })
+                    self._tracks[track] = tid
+                return self._tracks[track]
+
+    def complete(self, track, name, start, end, args=None):
+        """Record a slice from ``start`` to ``end``"""
+
+        event = {'ph': 'X', 'name': name, 'pid': 1, 'tid': self._tid(track),
+                 'ts': self._ts(start), 'dur': round((end - start) * 1e6, 1)}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def instant(self, track, name, t=None, args=None):
+        """Record a point in time, defaults to now"""
+
+        if t is None:
+            t = timeit.default_timer()
+        event = {'ph': 'i', 's': 't', 'name': name, 'pid': 1,
+                 'tid': self._tid(track), 'ts': self._ts(t)}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def counter(self, track, name, t, values):
+        """Record counter ``values`` at ``t``, shown as a graph"""
+
+        self.events.append({'ph': 'C', 'name': name, 'pid': 1,
+                            'tid': self._tid(track), 'ts': self._ts(t),
+                            'args': values})
+
+    def connection(self, track):
+        """Record the connect of the socket last opened by this thread"""
+
+        connect = getattr(_connection_state, 'connect', None)
+        if connect:
+            self.complete(track, 'connect', connect[0], connect[1])
+            _connection_state.connect = None
+
+    def timing_hook(self, event, phase):
+        """``Timings`` hook putting setup phases on their own track"""
+
+        if event == 'end':
+            self.complete(phase.path[0], phase.name, phase.start, phase.end,
+                          {'bytes': phase.bytes} if phase.bytes else None)
+
+    def dict(self):
+        return {'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}
+
+    def write(self, filename):
+        """Write the timeline as JSON, to be opened with ``chrome://tracing``
+        or https://ui.perfetto.dev
+        """
+
+        with open(filename, 'w') as f:
+            json.dump(self.dict(), f)
+
+
+def chain_hooks(*hooks):
+    """Combine ``Timings`` hooks, skipping those that are ``None``"""
+
+    hooks = [hook for hook in hooks if hook]
+    if len(hooks) < 2:
+        return hooks[0] if hooks else None
+
+    def inner(event, phase):
+        for hook in hooks:
+            hook(event, phase)
+    return inner
+
 
 class SpeedtestResults(object):
     """Class for holding the results of a speedtest, including:
@@ -937,7 +1948,7 @@ class SpeedtestResults(object):
     """
 
     def __init__(self, download=0, upload=0, ping=0, server=None, client=None,
-                 opener=None, secure=False):
+                 opener=None, secure=False, timings=None):
         self.download = download
         self.upload = upload
         self.ping = ping
@@ -951,6 +1962,11 @@ def __init__(self, download=0, upload=0, ping=0, server=None, client=None,
         self.timestamp = '%sZ' % datetime.datetime.utcnow().isoformat()
         self.bytes_received = 0
         self.bytes_sent = 0
+        self.socket_options = {}
+        self.tcp_info = {}
+        self.interface = {}
+        self.cpu = {}
+        self.timings = timings or NullTimings()
 
         if opener:
             self._opener = opener
@@ -962,6 +1978,7 @@ def __init__(self, download=0, upload=0, ping=0, server=None, client=None,
     def __repr__(self):
         return repr(self.dict())
 
+    @timed('share')
     def share(self):
         """POST data to the speedtest.net API to obtain a share results
         link
@@ -1036,6 +2053,11 @@ def dict(self):
             'bytes_received': self.bytes_received,
             'share': self._share,
             'client': self.client,
+            'socket_options': self.socket_options,
+            'tcp_info': self.tcp_info,
+            'interface': self.interface,
+            'cpu': self.cpu,
+            'timings': self.timings.dict(),
         }
 
     @staticmethod
@@ -1075,15 +2097,41 @@ def json(self, pretty=False):
 
 
 class Speedtest(object):
-    """Class for performing standard speedtest.net testing operations"""
+    """Class for performing standard speedtest.net testing operations
+
+    ``config_url`` and ``server_list_url`` replace the speedtest.net
+    endpoints, e.g. to run against a local stand-in server
+    """
 
     def __init__(self, config=None, source_address=None, timeout=10,
-                 secure=False, shutdown_event=None):
+                 secure=False, shutdown_event=None, socket_options=None,
+                 tcp_info_interval=0.25, interface_counters=None,
+                 config_url=None, server_list_url=None, timings=True,
+                 timing_hook=None, tracer=None):
         self.config = {}
+        self._tracer = tracer
+        if tracer:
+            timings = True
+            timing_hook = chain_hooks(timing_hook, tracer.timing_hook)
+        self._timings_enabled = timings
+        self._timing_hook = timing_hook
+        if timings:
+            self.timings = Timings(timing_hook)
+        else:
+            self.timings = NullTimings()
+        self._config_url = config_url
+        self._server_list_url = server_list_url
 
         self._source_address = source_address
         self._timeout = timeout
-        self._opener = build_opener(source_address, timeout)
+        self._socket_options = socket_options
+        self._tcp_info_interval = tcp_info_interval
+        self._interface_counters = interface_counters
+        if interface_counters and interface_counters is not True:
+            # Fail before downloading anything if the interface is unusable
+            read_interface_counters(interface_counters)
+        self._opener = build_opener(source_address, timeout,
+                                    socket_options=socket_options)
 
         self._secure = secure
 
@@ -1092,9 +2140,8 @@ def __init__(self, config=None, source_address=None, timeout=10,
         else:
             self._shutdown_event = FakeShutdownEvent()
 
+        self._config_overrides = config
         self.get_config()
-        if config is not None:
-            self.config.update(config)
 
         self.servers = {}
         self.closest = []
@@ -1104,7 +2151,43 @@ def __init__(self, config=None, source_address=None, timeout=10,
             client=self.config['client'],
             opener=self._opener,
             secure=secure,
+            timings=self.timings,
+        )
+
+    def new_results(self):
+        """Start an independent measurement with empty ``SpeedtestResults``
+        and timings, keeping the configuration and the selected server
+        """
+
+        if self._timings_enabled:
+            self.timings = Timings(self._timing_hook)
+        else:
+            self.timings = NullTimings()
+        self.results = SpeedtestResults(
+            client=self.config['client'],
+            opener=self._opener,
+            secure=self._secure,
+            timings=self.timings,
         )
+        return self.results
+
+    def _interface_sampler(self):
+        """Build an ``InterfaceCounterSampler`` if requested, where
+        ``interface_counters`` is either ``True`` to detect the egress
+        interface of ``source_address`` or the name of an interface
+        """
+
+        if not self._interface_counters:
+            return None
+        if self._interface_counters is True:
+            interface = find_interface(self._source_address)
+        else:
+            interface = self._interface_counters
+        if not interface:
+            printer('Could not determine the egress interface', debug=True)
+            return None
+        printer('Sampling counters of interface %s' % interface, debug=True)
+        return InterfaceCounterSampler(interface)
 
     @property
     def best(self):
@@ -1112,6 +2195,7 @@ def best(self):
             self.get_best_server()
         return self._best
 
+    @timed('get_config')
     def get_config(self):
         """Download the speedtest.net configuration and return only the data
         we are interested in
@@ -1120,8 +2204,11 @@ def get_config(self):
         headers = {}
         if gzip:
             headers['Accept-Encoding'] = 'gzip'
-        request = build_request('://www.speedtest.net/speedtest-config.php',
-                                headers=headers, secure=self._secure)
+        request = build_request(
+            self._config_url or '://www.speedtest.net/speedtest-config.php',
+            headers=headers, secure=self._secure
+        )
+        step = self.timings.start('request')
         uh, e = catch_request(request, opener=self._opener)
         if e:
             raise ConfigRetrievalError(e)
@@ -1143,9 +2230,14 @@ def get_config(self):
             return None
 
         configxml = ''.encode().join(configxml_list)
+        step.bytes = len(configxml)
+        step.stop()
+        self.timings.current.bytes = len(configxml)
 
         printer('Config XML:\n%s' % configxml, debug=True)
 
+        step = self.timings.start('parse')
+
         try:
             try:
                 root = ET.fromstring(configxml)
@@ -1215,6 +2307,8 @@ def get_config(self):
             'length': length,
             'upload_max': upload_count * size_count
         })
+        if self._config_overrides is not None:
+            self.config.update(self._config_overrides)
 
         try:
             self.lat_lon = (float(client['lat']), float(client['lon']))
@@ -1224,10 +2318,12 @@ def get_config(self):
                 (client.get('lat'), client.get('lon'))
             )
 
+        step.stop()
         printer('Config:\n%r' % self.config, debug=True)
 
         return self.config
 
+    @timed('get_servers')
     def get_servers(self, servers=None, exclude=None):
         """Retrieve a the list of speedtest.net servers, optionally filtered
         to servers matching those specified in the ``servers`` argument
@@ -1249,12 +2345,15 @@ def get_servers(self, servers=None, exclude=None):
                         '%s is an invalid server type, must be int' % s
                     )
 
-        urls = [
-            '://www.speedtest.net/speedtest-servers-static.php',
-            'http://c.speedtest.net/speedtest-servers-static.php',
-            '://www.speedtest.net/speedtest-servers.php',
-            'http://c.speedtest.net/speedtest-servers.php',
-        ]
+        if self._server_list_url:
+            urls = [self._server_list_url]
+        else:
+            urls = [
+                '://www.speedtest.net/speedtest-servers-static.php',
+                'http://c.speedtest.net/speedtest-servers-static.php',
+                '://www.speedtest.net/speedtest-servers.php',
+                'http://c.speedtest.net/speedtest-servers.php',
+            ]
 
         headers = {}
         if gzip:
@@ -1262,6 +2361,7 @@ def get_servers(self, servers=None, exclude=None):
 
         errors = []
         for url in urls:
+            step = self.timings.start('request')
             try:
                 request = build_request(
                     '%s?threads=%s' % (url,
@@ -1292,9 +2392,14 @@ def get_servers(self, servers=None, exclude=None):
                     raise ServersRetrievalError()
 
                 serversxml = ''.encode().join(serversxml_list)
+                step.bytes = len(serversxml)
+                step.stop()
+                self.timings.current.bytes += len(serversxml)
 
                 printer('Servers XML:\n%s' % serversxml, debug=True)
 
+                step = self.timings.start('parse')
+
                 try:
                     try:
                         try:
@@ -1344,9 +2449,11 @@ def get_servers(self, servers=None, exclude=None):
                     except KeyError:
                         self.servers[d] = [attrib]
 
+                step.stop()
                 break
 
             except ServersRetrievalError:
+                step.stop()
                 continue
 
         if (servers or exclude) and not self.servers:
@@ -1354,6 +2461,7 @@ def get_servers(self, servers=None, exclude=None):
 
         return self.servers
 
+    @timed('set_mini_server')
     def set_mini_server(self, server):
         """Instead of querying for a list of servers, set a link to a
         speedtest mini server
@@ -1408,6 +2516,7 @@ def set_mini_server(self, server):
 
         return self.servers
 
+    @timed('get_closest_servers')
     def get_closest_servers(self, limit=5):
         """Limit servers to the closest speedtest.net servers based on
         geographic distance
@@ -1428,6 +2537,7 @@ def get_closest_servers(self, limit=5):
         printer('Closest Servers:\n%r' % self.closest, debug=True)
         return self.closest
 
+    @timed('get_best_server')
     def get_best_server(self, servers=None):
         """Perform a speedtest.net "ping" to determine which speedtest.net
         server has the lowest latency
@@ -1447,6 +2557,7 @@ def get_best_server(self, servers=None):
 
         results = {}
         for server in servers:
+            step = self.timings.start('latency %s' % server['id'])
             cum = []
             url = os.path.dirname(server['url'])
             stamp = int(timeit.time.time() * 1000)
@@ -1460,12 +2571,14 @@ def get_best_server(self, servers=None):
                     if urlparts[0] == 'https':
                         h = SpeedtestHTTPSConnection(
                             urlparts[1],
-                            source_address=source_address_tuple
+                            source_address=source_address_tuple,
+                            socket_options=self._socket_options
                         )
                     else:
                         h = SpeedtestHTTPConnection(
                             urlparts[1],
-                            source_address=source_address_tuple
+                            source_address=source_address_tuple,
+                            socket_options=self._socket_options
                         )
                     headers = {'User-Agent': user_agent}
                     path = '%s?%s' % (urlparts[2], urlparts[4])
@@ -1473,6 +2586,11 @@ def get_best_server(self, servers=None):
                     h.request("GET", path, headers=headers)
                     r = h.getresponse()
                     total = (timeit.default_timer() - start)
+                    if self._tracer:
+                        self._tracer.connection('latency')
+                        self._tracer.complete('latency',
+                                              'latency %s' % server['id'],
+                                              start, start + total)
                 except HTTP_ERRORS:
                     e = get_exception()
                     printer('ERROR: %r' % e, debug=True)
@@ -1488,6 +2606,7 @@ def get_best_server(self, servers=None):
 
             avg = round((sum(cum) / 6) * 1000.0, 3)
             results[avg] = server
+            step.stop()
 
         try:
             fastest = sorted(results.keys())[0]
@@ -1504,13 +2623,19 @@ def get_best_server(self, servers=None):
         printer('Best Server:\n%r' % best, debug=True)
         return best
 
-    def download(self, callback=do_nothing, threads=None):
+    @timed('download')
+    def download(self, callback=do_nothing, threads=None, progress=None,
+                 progress_rate=10):
         """Test download speed against speedtest.net
 
         A ``threads`` value of ``None`` will fall back to those dictated
         by the speedtest.net configuration
+
+        ``progress`` is called with a ``ProgressEvent`` up to
+        ``progress_rate`` times per second
         """
 
+        step = self.timings.start('prepare')
         urls = []
         for size in self.config['sizes']['download']:
             for _ in range(0, self.config['counts']['download']):
@@ -1523,9 +2648,15 @@ def download(self, callback=do_nothing, threads=None):
             requests.append(
                 build_request(url, bump=i, secure=self._secure)
             )
+        step.stop()
 
         max_threads = threads or self.config['threads']['download']
         in_flight = {'threads': 0}
+        monitor = None
+        if progress:
+            monitor = ProgressMonitor('download', progress,
+                                      lambda thread: thread.received,
+                                      progress_rate)
 
         def producer(q, requests, request_count):
             for i, request in enumerate(requests):
@@ -1535,16 +2666,28 @@ def producer(q, requests, request_count):
                     start,
                     self.config['length']['download'],
                     opener=self._opener,
-                    shutdown_event=self._shutdown_event
+                    shutdown_event=self._shutdown_event,
+                    tcp_info_interval=self._tcp_info_interval,
+                    tracer=self._tracer
                 )
+                wait_start = None
                 while in_flight['threads'] >= max_threads:
+                    wait_start = wait_start or timeit.default_timer()
                     timeit.time.sleep(0.001)
+                if self._tracer and wait_start:
+                    self._tracer.complete('download producer',
+                                          'wait for slot', wait_start,
+                                          timeit.default_timer())
                 thread.start()
+                if monitor:
+                    monitor.add(thread)
                 q.put(thread, True)
                 in_flight['threads'] += 1
                 callback(i, request_count, start=True)
 
         finished = []
+        tcp_info = []
+        thread_times = []
 
         def consumer(q, request_count):
             _is_alive = thread_is_alive
@@ -1554,6 +2697,12 @@ def consumer(q, request_count):
                     thread.join(timeout=0.001)
                 in_flight['threads'] -= 1
                 finished.append(sum(thread.result))
+                if monitor:
+                    monitor.remove(thread, finished[-1])
+                thread_times.append(thread.cpu_time)
+                if thread.tcp_info:
+                    tcp_info.append(dict(thread.tcp_info.summary(),
+                                         stream=thread.i))
                 callback(thread.i, request_count, end=True)
 
         q = Queue(max_threads)
@@ -1561,7 +2710,14 @@ def consumer(q, request_count):
                                        args=(q, requests, request_count))
         cons_thread = threading.Thread(target=consumer,
                                        args=(q, request_count))
+        sampler = self._interface_sampler()
+        if sampler:
+            sampler.start()
+        cpu = CPUMeter(max_threads)
+        step = self.timings.start('transfer')
         start = timeit.default_timer()
+        if monitor:
+            monitor.start(start)
         prod_thread.start()
         cons_thread.start()
         _is_alive = thread_is_alive
@@ -1571,21 +2727,51 @@ def consumer(q, request_count):
             cons_thread.join(timeout=0.001)
 
         stop = timeit.default_timer()
+        if monitor:
+            monitor.stop()
         self.results.bytes_received = sum(finished)
+        step.bytes = self.results.bytes_received
+        step.stop()
+        self.timings.current.bytes = self.results.bytes_received
+        self.results.cpu['download'] = cpu.summary(
+            self.results.bytes_received, thread_times
+        )
+        if sampler:
+            sampler.stop()
+            self.results.interface['download'] = sampler.summary(
+                self.results.bytes_received, 'rx'
+            )
+        if tcp_info:
+            self.results.tcp_info['download'] = tcp_info
         self.results.download = (
             (self.results.bytes_received / (stop - start)) * 8.0
         )
-        if self.results.download > 100000:
-            self.config['threads']['upload'] = 8
+        if self._socket_options:
+            self.results.socket_options = dict(self._socket_options.effective)
         return self.results.download
 
-    def upload(self, callback=do_nothing, pre_allocate=True, threads=None):
+    def _upload_threads(self):
+        """Number of upload threads, raised to 8 after a download faster
+        than 100 kbit/s in this measurement
+        """
+
+        if self.results.download > 100000:
+            return 8
+        return self.config['threads']['upload']
+
+    @timed('upload')
+    def upload(self, callback=do_nothing, pre_allocate=True, threads=None,
+               progress=None, progress_rate=10):
         """Test upload speed against speedtest.net
 
         A ``threads`` value of ``None`` will fall back to those dictated
         by the speedtest.net configuration
+
+        ``progress`` is called with a ``ProgressEvent`` up to
+        ``progress_rate`` times per second
         """
 
+        step = self.timings.start('prepare')
         sizes = []
 
         for size in self.config['sizes']['upload']:
@@ -1603,7 +2789,8 @@ def upload(self, callback=do_nothing, pre_allocate=True, threads=None):
                 size,
                 0,
                 self.config['length']['upload'],
-                shutdown_event=self._shutdown_event
+                shutdown_event=self._shutdown_event,
+                tcp_info_interval=self._tcp_info_interval
             )
             if pre_allocate:
                 data.pre_allocate()
@@ -1616,9 +2803,15 @@ def upload(self, callback=do_nothing, pre_allocate=True, threads=None):
                     size
                 )
             )
+        step.stop()
 
-        max_threads = threads or self.config['threads']['upload']
+        max_threads = threads or self._upload_threads()
         in_flight = {'threads': 0}
+        monitor = None
+        if progress:
+            monitor = ProgressMonitor('upload', progress,
+                                      lambda thread: thread.request.data.sent,
+                                      progress_rate)
 
         def producer(q, requests, request_count):
             for i, request in enumerate(requests[:request_count]):
@@ -1629,16 +2822,27 @@ def producer(q, requests, request_count):
                     request[1],
                     self.config['length']['upload'],
                     opener=self._opener,
-                    shutdown_event=self._shutdown_event
+                    shutdown_event=self._shutdown_event,
+                    tracer=self._tracer
                 )
+                wait_start = None
                 while in_flight['threads'] >= max_threads:
+                    wait_start = wait_start or timeit.default_timer()
                     timeit.time.sleep(0.001)
+                if self._tracer and wait_start:
+                    self._tracer.complete('upload producer',
+                                          'wait for slot', wait_start,
+                                          timeit.default_timer())
                 thread.start()
+                if monitor:
+                    monitor.add(thread)
                 q.put(thread, True)
                 in_flight['threads'] += 1
                 callback(i, request_count, start=True)
 
         finished = []
+        tcp_info = []
+        thread_times = []
 
         def consumer(q, request_count):
             _is_alive = thread_is_alive
@@ -1648,14 +2852,27 @@ def consumer(q, request_count):
                     thread.join(timeout=0.001)
                 in_flight['threads'] -= 1
                 finished.append(thread.result)
+                if monitor:
+                    monitor.remove(thread, finished[-1])
+                thread_times.append(thread.cpu_time)
+                if thread.tcp_info:
+                    tcp_info.append(dict(thread.tcp_info.summary(),
+                                         stream=thread.i))
                 callback(thread.i, request_count, end=True)
 
-        q = Queue(threads or self.config['threads']['upload'])
+        q = Queue(threads or self._upload_threads())
         prod_thread = threading.Thread(target=producer,
                                        args=(q, requests, request_count))
         cons_thread = threading.Thread(target=consumer,
                                        args=(q, request_count))
+        sampler = self._interface_sampler()
+        if sampler:
+            sampler.start()
+        cpu = CPUMeter(max_threads)
+        step = self.timings.start('transfer')
         start = timeit.default_timer()
+        if monitor:
+            monitor.start(start)
         prod_thread.start()
         cons_thread.start()
         _is_alive = thread_is_alive
@@ -1665,13 +2882,124 @@ def consumer(q, request_count):
             cons_thread.join(timeout=0.1)
 
         stop = timeit.default_timer()
+        if monitor:
+            monitor.stop()
         self.results.bytes_sent = sum(finished)
+        step.bytes = self.results.bytes_sent
+        step.stop()
+        self.timings.current.bytes = self.results.bytes_sent
+        self.results.cpu['upload'] = cpu.summary(
+            self.results.bytes_sent, thread_times
+        )
+        if sampler:
+            sampler.stop()
+            self.results.interface['upload'] = sampler.summary(
+                self.results.bytes_sent, 'tx'
+            )
+        if tcp_info:
+            self.results.tcp_info['upload'] = tcp_info
         self.results.upload = (
             (self.results.bytes_sent / (stop - start)) * 8.0
         )
+        if self._socket_options:
+            self.results.socket_options = dict(self._socket_options.effective)
         return self.results.upload
 
 
+class SpeedtestSession(object):
+    """Long-lived ``Speedtest`` that runs any number of independent
+    measurements, e.g. for an agent that tests every few minutes
+
+    The opener, the speedtest.net configuration and the server selection
+    are set up once and reused. The configuration is downloaded again once
+    it is ``config_max_age`` seconds old and the best server is selected
+    again once that selection is ``server_max_age`` seconds old, otherwise
+    only the latency to the selected server is measured. ``servers`` and
+    ``exclude`` restrict the selection as in ``Speedtest.get_servers``, all
+    other keyword arguments are passed to ``Speedtest``. Nothing is
+    downloaded before the first measurement
+    """
+
+    def __init__(self, config_max_age=3600, server_max_age=3600,
+                 servers=None, exclude=None, **kwargs):
+        self.config_max_age = config_max_age
+        self.server_max_age = server_max_age
+        self._servers = servers
+        self._exclude = exclude
+        self._kwargs = kwargs
+        self._speedtest = None
+        self._config_time = None
+        self._server_time = None
+        self._lock = threading.Lock()
+
+    @property
+    def speedtest(self):
+        """The underlying ``Speedtest``, set up on first use"""
+
+        with self._lock:
+            self.refresh()
+            return self._speedtest
+
+    def refresh(self, force=False):
+        """Download the configuration and select the best server again if
+        they are stale, or in any case if ``force`` is set
+
+        Returns ``True`` if the best server was selected again
+        """
+
+        now = timeit.default_timer()
+        if self._speedtest is None:
+            self._speedtest = Speedtest(**self._kwargs)
+            self._config_time = now
+            self._server_time = None
+        elif force or now - self._config_time >= self.config_max_age:
+            self._speedtest.get_config()
+            self._speedtest.results.client = self._speedtest.config['client']
+            self._config_time = now
+            # The client location decides which servers are closest
+            self._server_time = None
+
+        if (not force and self._server_time is not None and
+                now - self._server_time < self.server_max_age):
+            return False
+
+        self._speedtest.closest = []
+        self._speedtest._best = {}
+        self._speedtest.get_servers(list(self._servers or []),
+                                    list(self._exclude or []))
+        self._speedtest.get_best_server()
+        self._server_time = now
+        return True
+
+    def measure(self, download=True, upload=True, threads=None,
+                pre_allocate=True, callback=do_nothing, progress=None,
+                progress_rate=10):
+        """Run one measurement and return its own ``SpeedtestResults``
+
+        Measurements of the same session never overlap, concurrent calls
+        wait for the running one to finish
+        """
+
+        with self._lock:
+            if self._speedtest is not None:
+                self._speedtest.new_results()
+            if not self.refresh():
+                test = self._speedtest
+                # Failed latency requests count as 3600 seconds each
+                if test.get_best_server([test.best])['latency'] >= 1800000:
+                    self.refresh(force=True)
+            test = self._speedtest
+
+            if download:
+                test.download(callback=callback, threads=threads,
+                              progress=progress, progress_rate=progress_rate)
+            if upload:
+                test.upload(callback=callback, pre_allocate=pre_allocate,
+                            threads=threads, progress=progress,
+                            progress_rate=progress_rate)
+            return test.results
+
+
 def ctrl_c(shutdown_event):
     """Catch Ctrl-C key sequence and set a SHUTDOWN_EVENT for our threaded
     operations
@@ -1764,6 +3092,30 @@ def parse_args():
     parser.add_argument('--secure', action='store_true',
                         help='Use HTTPS instead of HTTP when communicating '
                              'with speedtest.net operated servers')
+    parser.add_argument('--rcvbuf', type=PARSER_TYPE_INT,
+                        help='Set SO_RCVBUF in bytes on every test socket')
+    parser.add_argument('--sndbuf', type=PARSER_TYPE_INT,
+                        help='Set SO_SNDBUF in bytes on every test socket')
+    parser.add_argument('--tcp-nodelay', dest='nodelay', action='store_const',
+                        const=True, default=None,
+                        help='Set TCP_NODELAY on every test socket')
+    parser.add_argument('--tcp-congestion', dest='congestion',
+                        type=PARSER_TYPE_STR,
+                        help='TCP congestion control algorithm to use on '
+                             'every test socket, e.g. "bbr" (Linux only)')
+    parser.add_argument('--tcp-quickack', dest='quickack',
+                        action='store_const', const=True, default=None,
+                        help='Set TCP_QUICKACK on every test socket '
+                             '(Linux only)')
+    parser.add_argument('--interface-counters', nargs='?', const=True,
+                        default=None, metavar='INTERFACE',
+                        help='Sample the counters of the egress interface, '
+                             'or of INTERFACE, during each test and report '
+                             'interface level throughput (Linux only)')
+    parser.add_argument('--trace', metavar='FILE', type=PARSER_TYPE_STR,
+                        help='Write a Chrome trace-event timeline of the run '
+                             'to FILE, to be opened with chrome://tracing or '
+                             'https://ui.perfetto.dev')
     parser.add_argument('--no-pre-allocate', dest='pre_allocate',
                         action='store_const', default=True, const=False,
                         help='Do not pre allocate upload data. Pre allocation '
@@ -1865,22 +3217,51 @@ def shell():
     else:
         machine_format = False
 
-    # Don't set a callback if we are running quietly
+    # Don't report progress if we are running quietly
     if quiet or debug:
-        callback = do_nothing
+        callback = None
     else:
-        callback = print_dots(shutdown_event)
+        callback = print_progress(shutdown_event, args.units)
+
+    socket_options = SocketOptions(
+        rcvbuf=args.rcvbuf,
+        sndbuf=args.sndbuf,
+        nodelay=args.nodelay,
+        congestion=args.congestion,
+        quickack=args.quickack
+    )
+    if not socket_options.requested():
+        socket_options = None
+
+    tracer = Tracer() if args.trace else None
+    try:
+        _shell(args, debug, quiet, machine_format, callback, socket_options,
+               tracer)
+    finally:
+        if tracer:
+            tracer.write(args.trace)
+
+
+def _shell(args, debug, quiet, machine_format, callback, socket_options,
+           tracer):
+    """Run the tests of ``shell`` with parsed arguments"""
 
     printer('Retrieving speedtest.net configuration...', quiet)
     try:
         speedtest = Speedtest(
             source_address=args.source,
             timeout=args.timeout,
-            secure=args.secure
+            secure=args.secure,
+            socket_options=socket_options,
+            interface_counters=args.interface_counters,
+            tracer=tracer
         )
     except (ConfigRetrievalError,) + HTTP_ERRORS:
         printer('Cannot retrieve speedtest configuration', error=True)
         raise SpeedtestCLIError(get_exception())
+    except InterfaceCountersError:
+        printer('Cannot sample interface counters', error=True)
+        raise SpeedtestCLIError(get_exception())
 
     if args.list:
         try:
@@ -1939,7 +3320,7 @@ def shell():
         printer('Testing download speed', quiet,
                 end=('', '\n')[bool(debug)])
         speedtest.download(
-            callback=callback,
+            progress=callback,
             threads=(None, 1)[args.single]
         )
         printer('Download: %0.2f M%s/s' %
@@ -1953,7 +3334,7 @@ def shell():
         printer('Testing upload speed', quiet,
                 end=('', '\n')[bool(debug)])
         speedtest.upload(
-            callback=callback,
+            progress=callback,
             pre_allocate=args.pre_allocate,
             threads=(None, 1)[args.single]
         )
@@ -1964,6 +3345,34 @@ def shell():
     else:
         printer('Skipping upload test', quiet)
 
+    for phase, cpu in sorted(results.cpu.items()):
+        if cpu['client_bound']:
+            printer('Warning: the %s test was limited by this machine\'s CPU '
+                    '(%0.2f CPU seconds per second, the transfer threads '
+                    'share one core)' % (phase, cpu['utilization']),
+                    quiet, error=True)
+
+    for phase, counters in sorted(results.interface.items()):
+        printer('Interface %s (%s): %0.2f M%s/s received, %0.2f M%s/s sent, '
+                '%d foreign bytes' %
+                (counters['interface'], phase,
+                 (counters['rx'] / 1000.0 / 1000.0) / args.units[1],
+                 args.units[0],
+                 (counters['tx'] / 1000.0 / 1000.0) / args.units[1],
+                 args.units[0],
+                 counters['foreign_bytes']),
+                quiet)
+        if counters['error']:
+            printer('Warning: sampling interface %s stopped early (%s)' %
+                    (counters['interface'], counters['error']),
+                    quiet, error=True)
+
+    if results.socket_options:
+        printer('Socket options: %s' %
+                ', '.join('%s=%s' % item for item in
+                          sorted(results.socket_options.items())),
+                quiet)
+
     printer('Results:\n%r' % results.dict(), debug=True)
 
     if not args.simple and args.share:
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import math
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import utils
+from .history import METRICS, History
+
+PERCENTILES = (50, 95)
+
+#region loading
+
+class Samples:
+    """
+    Numeric history columns held in typed arrays. Targets are stored as
+    indices into `targets`, bandwidth results all share the target `None`.
+    Empty cells, e.g. round-trip times of unanswered pings, are stored as NaN.
+    """
+    def __init__(self, metrics: Sequence[str]):
+        self.timestamps = array('d')
+        self.groups = array('l')
+        self.targets: List[Optional[str]] = []
+        self.columns = {metric: array('d') for metric in metrics}
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @classmethod
+    def load(cls, history: History, since: Optional[float]=None, until: Optional[float]=None, target: Optional[str]=None) -> 'Samples':
+        samples = cls(METRICS[history.name])
+        codes: Dict[Optional[str], int] = {}
+        columns = list(samples.columns.items())
+        for row in history.query(since, until, target):
+            name = row.get('Target')
+            if name not in codes:
+                codes[name] = len(samples.targets)
+                samples.targets.append(name)
+            samples.timestamps.append(utils.parse_timestamp(row['DateTime']))
+            samples.groups.append(codes[name])
+            for metric, values in columns:
+                values.append(math.nan if row.get(metric) in (None, '') else float(row[metric]))
+        return samples
+
+#endregion loading
+
+#region aggregation
+
+def _origin(samples: Samples, width: Optional[float]) -> float:
+    origin = min(samples.timestamps)
+    return math.floor(origin / width) * width if width else origin
+
+def _percentile(ordered: Sequence[float], percentile: float) -> float:
+    """
+    Linearly interpolated percentile of sorted values, the same definition
+    NumPy uses by default.
+    """
+    position = (len(ordered) - 1) * percentile / 100
+    low = math.floor(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+def _aggregate_numpy(samples: Samples, width: Optional[float]) -> List[Dict]:
+    origin = _origin(samples, width)
+    timestamps = np.frombuffer(samples.timestamps, dtype=np.float64)
+    groups = np.asarray(samples.groups, dtype=np.int64)
+    buckets = ((timestamps - origin) // width).astype(np.int64) if width else np.zeros(len(samples), dtype=np.int64)
+
+    span = int(buckets.max()) + 1
+    order = np.argsort(groups * span + buckets, kind='stable')
+    keys = (groups * span + buckets)[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+    ids = np.repeat(np.arange(len(starts)), counts)
+
+    metrics = {}
+    for metric, column in samples.columns.items():
+        values = np.frombuffer(column, dtype=np.float64)[order]
+        # Sorting by value with the group as primary key keeps every group
+        # contiguous, empty cells (NaN) sort last and are left out
+        values = values[np.lexsort((values, ids))]
+        present = np.add.reduceat((~np.isnan(values)).astype(np.int64), starts)
+        last = starts + np.maximum(present, 1) - 1
+        summary = {'min': values[starts]}
+        for percentile in PERCENTILES:
+            position = starts + (last - starts) * percentile / 100
+            low = np.floor(position).astype(np.int64)
+            high = np.minimum(low + 1, last)
+            summary[f"p{percentile}"] = values[low] + (values[high] - values[low]) * (position - low)
+        summary['max'] = values[last]
+        summary['mean'] = np.where(present > 0, np.add.reduceat(np.nan_to_num(values), starts) / np.maximum(present, 1), np.nan)
+        metrics[metric] = {name: [None if math.isnan(value) else value for value in result.tolist()] for name, result in summary.items()}
+
+    return [
+        {
+            'target': samples.targets[int(key // span)],
+            'start': origin + int(key % span) * width if width else origin,
+            'count': int(count),
+            'metrics': {metric: {name: results[index] for name, results in summary.items()} for metric, summary in metrics.items()},
+        }
+        for index, (key, count) in enumerate(zip(keys[starts].tolist(), counts.tolist()))
+    ]
+
+def _aggregate_python(samples: Samples, width: Optional[float]) -> List[Dict]:
+    origin = _origin(samples, width)
+    grouped: Dict[tuple, array] = {}
+    for index, (group, timestamp) in enumerate(zip(samples.groups, samples.timestamps)):
+        grouped.setdefault((group, int((timestamp - origin) // width) if width else 0), array('l')).append(index)
+
+    buckets = []
+    for (group, bucket), indices in sorted(grouped.items()):
+        metrics = {}
+        for metric, column in samples.columns.items():
+            ordered = sorted(value for value in (column[index] for index in indices) if not math.isnan(value))
+            metrics[metric] = {
+                'min': ordered[0],
+                **{f"p{percentile}": _percentile(ordered, percentile) for percentile in PERCENTILES},
+                'max': ordered[-1],
+                'mean': math.fsum(ordered) / len(ordered),
+            } if ordered else dict.fromkeys(('min', *(f"p{percentile}" for percentile in PERCENTILES), 'max', 'mean'))
+        buckets.append({'target': samples.targets[group], 'start': origin + bucket * width if width else origin, 'count': len(indices), 'metrics': metrics})
+    return buckets
+
+def aggregate(samples: Samples, width: Optional[float]=None) -> List[Dict]:
+    """
+    Compute the minimum, percentiles, maximum and mean of every metric per
+    target and per `width` seconds wide time bucket, or over the whole time
+    range without a `width`. Buckets are ordered by target and start time.
+    Empty cells are left out, metrics without any value summarize to `None`.
+    """
+    if not len(samples):
+        return []
+    return (_aggregate_numpy if np is not None else _aggregate_python)(samples, width)
+
+#endregion aggregation
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import math
+from typing import List
+
+#region estimators
+
+class RunningStats:
+    """
+    Count, mean, variance, minimum and maximum of a stream of values in
+    constant memory, using Welford's numerically stable update.
+    """
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def variance(self) -> float:
+        """
+        Sample variance, zero for fewer than two values.
+        """
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self) -> float:
+        return math.sqrt(self.variance)
+
+
+class Jitter:
+    """
+    Interarrival jitter as defined in RFC 3550, section 6.4.1: a running
+    average of the absolute difference between consecutive transit times,
+    smoothed with a gain of 1/16. Round-trip times take the place of transit
+    times, which avoids the need for synchronized clocks.
+    """
+    __slots__ = ('value', 'last')
+
+    def __init__(self):
+        self.value = 0.0
+        self.last = None
+
+    def add(self, transit: float) -> None:
+        if self.last is not None:
+            self.value += (abs(transit - self.last) - self.value) / 16
+        self.last = transit
+
+
+class TDigest:
+    """
+    Merging t-digest (Dunning and Ertl) for estimating quantiles of a stream
+    in bounded memory. New values are buffered and merged into at most about
+    `compression` centroids whenever the buffer fills up. Centroids near the
+    tails stay small, so extreme quantiles such as p99 remain accurate.
+    """
+    def __init__(self, compression: float=100):
+        self.compression = compression
+        self.means: List[float] = []
+        self.weights: List[float] = []
+        self.buffer: List[float] = []
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        self.buffer.append(value)
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self.buffer) >= 5 * self.compression:
+            self._merge()
+
+    def _k(self, quantile: float) -> float:
+        # Scale function k1, which allots less weight to centroids near the tails
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(quantile, 0), 1) - 1)
+
+    def _limit(self, k: float) -> float:
+        return 1.0 if k >= self.compression / 4 else (math.sin(2 * math.pi * k / self.compression) + 1) / 2
+
+    def _merge(self) -> None:
+        if not self.buffer:
+            return
+        points = sorted([*zip(self.means, self.weights), *((value, 1.0) for value in self.buffer)])
+        self.buffer = []
+        total = sum(weight for _, weight in points)
+
+        means, weights, merged = [], [], 0.0
+        mean, weight = points[0]
+        limit = self._limit(self._k(0) + 1)
+        for next_mean, next_weight in points[1:]:
+            if (merged + weight + next_weight) / total <= limit:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                merged += weight
+                limit = self._limit(self._k(merged / total) + 1)
+                mean, weight = next_mean, next_weight
+        means.append(mean)
+        weights.append(weight)
+        self.means, self.weights = means, weights
+
+    def quantile(self, quantile: float) -> float:
+        """
+        Estimate the value below which `quantile` (0 to 1) of all values fall,
+        interpolating linearly between the centers of neighbouring centroids.
+        """
+        self._merge()
+        if not self.means:
+            return math.nan
+        if len(self.means) == 1:
+            return self.means[0]
+
+        target = quantile * self.count
+        means, weights = self.means, self.weights
+        if target < weights[0] / 2:
+            return self.min + (means[0] - self.min) * target / (weights[0] / 2)
+        if target > self.count - weights[-1] / 2:
+            return means[-1] + (self.max - means[-1]) * (target - self.count + weights[-1] / 2) / (weights[-1] / 2)
+        cumulative = weights[0] / 2
+        for index in range(len(means) - 1):
+            step = (weights[index] + weights[index + 1]) / 2
+            if cumulative + step >= target:
+                return means[index] + (means[index + 1] - means[index]) * (target - cumulative) / step
+            cumulative += step
+        return means[-1]
+
+#endregion estimators
+
+class RTTStatistics:
+    """
+    Streaming summary of the round-trip times of one ping target: how many
+    requests were sent and answered, the mean and standard deviation, the
+    jitter and a t-digest for percentiles. Memory use does not grow with the
+    number of requests.
+    """
+    __slots__ = ('sent', 'running', 'jitter', 'digest')
+
+    def __init__(self):
+        self.sent = 0
+        self.running = RunningStats()
+        self.jitter = Jitter()
+        self.digest = TDigest()
+
+    @property
+    def received(self) -> int:
+        return self.running.count
+
+    def add(self, rtt: float) -> None:
+        """
+        Record the round-trip time of an answered request, in order of arrival.
+        """
+        self.running.add(rtt)
+        self.jitter.add(rtt)
+        self.digest.add(rtt)
+
+    def percentile(self, percentile: float) -> float:
+        return self.digest.quantile(percentile / 100)
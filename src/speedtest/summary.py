@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import json
+import math
+import os
+import threading
+from json.decoder import JSONDecodeError
+from pathlib import Path
+from time import time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from . import utils
+
+# Running aggregates are kept per hour, so summary windows start at a full hour
+BUCKET = 3600
+WINDOWS = {'day': 86400, 'week': 604800}
+
+
+def window_start(window: float, now: float) -> float:
+    """
+    Return the start of the bucket that contains the moment `window` seconds before `now`.
+    """
+    return math.floor((now - window) / BUCKET) * BUCKET
+
+
+class SummaryIndex:
+    """
+    Running aggregates of a CSV history kept in a small JSON file next to it.
+    For every target the index holds the last row and, for the last week, the
+    count, sum, minimum and maximum of every metric per hour, so that summaries
+    never have to read the history itself. Empty cells are not counted. The
+    index also records the size and metrics of the history it describes and
+    is considered stale once either differs.
+
+    ```json
+    {"size": 1024, "metrics": [...], "targets": {"google.com": {"last": {...}, "buckets": {"1633046400": {"Count": 60, "PingMin": [sum, min, max, count]}}}}}
+    ```
+    """
+    def __init__(self, path: Path, metrics: Sequence[str], keyed: bool):
+        self.path = path
+        self.metrics = metrics
+        self.keyed = keyed
+
+    def load(self, size: int) -> Optional[Dict]:
+        """
+        Return the index if it describes a history of `size` bytes.
+        """
+        try:
+            with open(self.path, mode='r', encoding='utf-8') as file_handler:
+                index = json.load(file_handler)
+        except (OSError, JSONDecodeError):
+            return None
+        return index if index.get('size') == size and index.get('metrics') == list(self.metrics) else None
+
+    def save(self, index: Dict) -> None:
+        """
+        Replace the index atomically so that readers never see a partial file.
+        """
+        temporary = self.path.with_name(f".{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temporary, mode='w', encoding='utf-8') as file_handler:
+            json.dump(index, file_handler, separators=(',', ':'))
+        os.replace(temporary, self.path)
+
+    def key(self, row: Dict) -> str:
+        return row.get('Target', '') if self.keyed else ''
+
+    def update(self, index: Optional[Dict], rows: Iterable[Dict], size: int, now: Optional[float]=None) -> Dict:
+        """
+        Add `rows` to `index`, or to an empty index if there is none, drop
+        buckets older than a week and record the new history `size`.
+        """
+        index = index or {'targets': {}}
+        cutoff = window_start(max(WINDOWS.values()), time() if now is None else now)
+        for row in rows:
+            if (timestamp := utils.read_timestamp(row.get('DateTime'))) is None:
+                continue
+            entry = index['targets'].setdefault(self.key(row), {'last': None, 'buckets': {}})
+            if entry['last'] is None or timestamp >= float(entry['last']['DateTime']):
+                entry['last'] = {column: '' if value is None else str(value) for column, value in row.items()}
+            if timestamp < cutoff:
+                continue
+            bucket = entry['buckets'].setdefault(str(math.floor(timestamp / BUCKET) * BUCKET), {'Count': 0})
+            bucket['Count'] += 1
+            for metric in self.metrics:
+                if row.get(metric) in (None, ''):
+                    continue
+                value = float(row[metric])
+                total, low, high, count = bucket.get(metric, (0.0, value, value, 0))
+                bucket[metric] = [total + value, min(low, value), max(high, value), count + 1]
+        self.prune(index, cutoff)
+        index['size'] = size
+        index['metrics'] = list(self.metrics)
+        return index
+
+    @staticmethod
+    def prune(index: Dict, cutoff: float) -> None:
+        """
+        Drop all buckets that start before `cutoff`.
+        """
+        for entry in index['targets'].values():
+            entry['buckets'] = {start: bucket for start, bucket in entry['buckets'].items() if float(start) >= cutoff}
+
+    def summarize(self, index: Dict, target: Optional[str]=None, now: Optional[float]=None) -> List[Dict]:
+        """
+        Return the last row and the count, minimum, maximum and mean of every
+        metric over each of the `WINDOWS` per target, or only for `target`.
+        """
+        now = time() if now is None else now
+        summaries = []
+        for key, entry in sorted(index['targets'].items()):
+            if target is not None and key != target:
+                continue
+            windows = {}
+            for window, length in WINDOWS.items():
+                start = window_start(length, now)
+                buckets = [bucket for begin, bucket in entry['buckets'].items() if float(begin) >= start]
+                metrics = {}
+                for metric in self.metrics:
+                    aggregates = [bucket[metric] for bucket in buckets if metric in bucket]
+                    count = sum(aggregate[3] for aggregate in aggregates)
+                    metrics[metric] = {
+                        'min': min(aggregate[1] for aggregate in aggregates),
+                        'max': max(aggregate[2] for aggregate in aggregates),
+                        'mean': math.fsum(aggregate[0] for aggregate in aggregates) / count,
+                    } if count else None
+                windows[window] = {'count': sum(bucket['Count'] for bucket in buckets), 'metrics': metrics}
+            summaries.append({'target': key if self.keyed else None, 'last': entry['last'], 'windows': windows})
+        return summaries
@@ -1,16 +1,27 @@
 #!/usr/bin/env python3
 
+import argparse
 import csv
+import io
 import json
 import logging
 import os
 import platform
 import sys
+from contextlib import contextmanager
+from datetime import datetime as dt
+from datetime import timezone
 from itertools import chain
 from json.decoder import JSONDecodeError
 from pathlib import Path
+from time import time
 from types import FrameType
-from typing import Dict, Union
+from typing import Dict, Iterator, List, Optional, Union
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from .__init__ import package_name
 from .config import BRIGHT, CYAN, DIM, GREEN, LOGFILE, NORMAL, RED, RESET_ALL, YELLOW
@@ -68,11 +79,156 @@ def reset_file(filename: Union[str, Path]) -> None:
     open(get_resource_path(filename), mode='w', encoding='utf-8').close()
 
 def write_csv(filename: Union[str, Path], data: Dict[str, str]) -> None:
-    with open(filename, mode='a', encoding='utf-8') as file_handler:
-        writer = csv.DictWriter(file_handler, delimiter=',', lineterminator='\n', fieldnames=data.keys())
-        if os.stat(filename).st_size == 0:
-            writer.writeheader()
-        writer.writerow(data)
+    write_csv_rows(filename, [data])
+
+@contextmanager
+def locked_file(filename: Union[str, Path], blocking: bool=True) -> Iterator[int]:
+    """
+    Open `filename` for appending and hold an exclusive advisory lock on it for
+    the duration of the block, yielding its file descriptor. Other processes
+    that append through this function wait for the lock, or raise `BlockingIOError`
+    if not `blocking`. Locking is skipped on platforms without `fcntl`, i.e. on Windows.
+    """
+    while True:
+        fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+        if fcntl is None:
+            break
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise
+        # The file may have been replaced by a rewrite while waiting for the lock
+        try:
+            if os.fstat(fd).st_ino == os.stat(filename).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+    try:
+        yield fd
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+def append_csv_rows(fd: int, rows: List[Dict[str, str]]) -> int:
+    """
+    Append `rows` to the file locked by `locked_file` in a single write that
+    starts with the header if the file is empty, and return the new file size.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, delimiter=',', lineterminator='\n', fieldnames=rows[0].keys())
+    if os.fstat(fd).st_size == 0:
+        writer.writeheader()
+    writer.writerows(rows)
+    data = memoryview(buffer.getvalue().encode('utf-8'))
+    while data:
+        data = data[os.write(fd, data):]
+    return os.fstat(fd).st_size
+
+def write_csv_rows(filename: Union[str, Path], rows: List[Dict[str, str]]) -> None:
+    """
+    Append `rows` to `filename` in one go, writing the header first if the file
+    is empty. Safe to call from several processes at once, see `locked_file`.
+    """
+    if not rows:
+        return
+    with locked_file(filename) as fd:
+        append_csv_rows(fd, rows)
+
+def read_csv_reversed(filename: Union[str, Path], block_size: int=65536) -> Iterator[Dict[str, str]]:
+    """
+    Yield the rows of `filename` from last to first, reading the file backwards
+    in blocks so that only its header and tail are read if the caller stops early.
+    """
+    with open(filename, mode='rb') as file_handler:
+        header = file_handler.readline()
+        if not header:
+            return
+        fieldnames = next(csv.reader([header.decode('utf-8')]))
+        offset = file_handler.seek(0, os.SEEK_END)
+        remainder = b''
+        while offset > len(header):
+            size = min(block_size, offset - len(header))
+            offset -= size
+            file_handler.seek(offset)
+            lines = (file_handler.read(size) + remainder).split(b'\n')
+            # The first line may be incomplete unless the header was reached
+            remainder = lines.pop(0) if offset > len(header) else b''
+            for line in reversed(lines):
+                if line.strip():
+                    yield dict(zip(fieldnames, next(csv.reader([line.decode('utf-8')]))))
+
+def read_recent_row(filename: Union[str, Path], max_age: float, disorder: float=0, **columns: str) -> Optional[Dict[str, str]]:
+    """
+    Return the newest row of `filename` that is at most `max_age` seconds old and
+    matches all `columns`, if any. Rows may be appended up to `disorder` seconds
+    out of chronological order.
+    """
+    cutoff = time() - max_age
+    newest = None
+    for row in read_csv_reversed(filename):
+        if (timestamp := read_timestamp(row.get('DateTime'))) is None:
+            continue
+        if timestamp < cutoff - disorder or (newest is not None and timestamp < newest[0] - disorder):
+            break
+        if timestamp >= cutoff and all(row.get(column) == value for column, value in columns.items()):
+            if newest is None or timestamp > newest[0]:
+                newest = (timestamp, row)
+    return newest[1] if newest else None
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+def parse_duration(value: str) -> float:
+    """
+    Parse a duration such as `90`, `30m`, `1h` or `7d` into seconds.
+    """
+    value = value.strip()
+    try:
+        if value[-1:] in DURATION_UNITS:
+            return float(value[:-1]) * DURATION_UNITS[value[-1]]
+        return float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration: {value!r}")
+
+def parse_time(value: str) -> float:
+    """
+    Parse a UNIX time, an ISO 8601 date or date and time (UTC unless an offset is
+    given) or a duration such as `30m`, `12h` or `7d` before now into a UNIX time.
+    """
+    value = value.strip()
+    try:
+        if value[-1:] in DURATION_UNITS:
+            return time() - parse_duration(value)
+        return float(value)
+    except (ValueError, argparse.ArgumentTypeError):
+        pass
+    try:
+        timestamp = dt.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time: {value!r}")
+    return (timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)).timestamp()
+
+def parse_timestamp(value: Union[str, float]) -> float:
+    """
+    Parse the `DateTime` of a history row into a UNIX time. Versions up to 2.0.0
+    saved the date and time in UTC instead, e.g. `2021-10-01 12:00:00`.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        timestamp = dt.fromisoformat(value.strip())
+    return (timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)).timestamp()
+
+def read_timestamp(value: Optional[Union[str, float]]) -> Optional[float]:
+    """
+    Parse a `DateTime` cell like `parse_timestamp`, but return `None` if it is
+    missing or unreadable, e.g. because the history was edited by hand.
+    """
+    try:
+        return parse_timestamp(value)
+    except (TypeError, ValueError, AttributeError):
+        return None
 
 #endregion logging and resource access
 
@@ -112,6 +268,16 @@ def print_on_error(message: str, verbose: bool=True) -> None:
     if verbose:
         print(BRIGHT + RED + "[ ERROR ]".ljust(12, ' ') + RESET_ALL + message, file=sys.stderr)
 
+def print_progress(event) -> None:
+    """
+    Rewrite a status line on stderr with the progress of a bandwidth test if
+    stderr is a terminal.
+    """
+    if not sys.stderr.isatty():
+        return
+    status = f"{event.phase.title()}: {BRIGHT}{YELLOW}{event.throughput / 1_000_000:6.2F}MB/s{RESET_ALL} | {event.bytes / 1_000_000:8.2F}MB | {event.active:>2} streams | {event.elapsed:5.2F}s"
+    print('\r' + status + '\033[K', end='\n' if event.done else '', file=sys.stderr, flush=True)
+
 def clear():
     """
     Reset terminal screen.
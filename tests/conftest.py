@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import tempfile
+
+# The log file is opened in the config directory as soon as the package is imported
+os.environ['HOME'] = tempfile.mkdtemp(prefix='speedtest-')
+os.environ.pop('SUDO_USER', None)
+
+import pytest
+
+from speedtest import utils
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    """
+    Point the config directory to a temporary HOME and return it.
+    """
+    monkeypatch.setenv('HOME', str(tmp_path))
+    return utils.get_config_dir()
+
+
+@pytest.fixture
+def run(home, monkeypatch, capsys):
+    """
+    Run the command line interface with the given arguments and return its output.
+    """
+    from speedtest.cli import cli
+
+    def run(*args: str) -> str:
+        monkeypatch.setattr(sys, 'argv', ['speedtest', *args])
+        cli()
+        return capsys.readouterr().out
+
+    return run
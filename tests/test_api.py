@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+import sqlite3
+
+from speedtest.api import SpeedtestService
+from speedtest.history import open_history
+from speedtest.mockserver import MockSpeedtestServer
+from speedtest.push import Collector, Pusher, Spool
+
+#region saving
+
+def test_results_are_answered_when_saving_fails(home, monkeypatch):
+    history = open_history('ping')
+    def unavailable(rows):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(history, 'append', unavailable)
+    spool = Spool(home.joinpath('spool'))
+    # The spool can't be opened either while its pending file is a directory
+    spool.pending.mkdir()
+
+    with MockSpeedtestServer() as server:
+        service = SpeedtestService(None, ping_history=history, pusher=Pusher(spool, Collector(server.collector_url)))
+        target = f"127.0.0.1:{server.server_port}"
+        result, _, cached = service.ping(target, 2, 1, method='tcp')
+        assert result.target == target and result.received == 2 and not cached
+        again, _, cached = service.ping(target, 2, 1, max_age=60, method='tcp')
+        assert again is result and cached
+    assert target.encode() in service.metrics.render()
+
+#endregion saving
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+import json
+import sqlite3
+
+from speedtest.daemon import BatchWriter
+from speedtest.history import open_history
+from speedtest.push import Spool
+
+#region batch writer
+
+def row(timestamp: float) -> dict:
+    return {'DateTime': timestamp, 'Country': 'Germany', 'IP': '192.0.2.1', 'Download': 1.0, 'Upload': 2.0, 'ISP': 'Example'}
+
+def spooled(spool: Spool) -> list:
+    return [json.loads(line)['row']['DateTime'] for line in spool.pending.read_text().splitlines()]
+
+def test_failed_writes_are_retried(home, monkeypatch):
+    history, spool = open_history('bandwidth'), Spool(home.joinpath('spool'))
+    writer = BatchWriter(batch_size=2, spool=spool, max_retained=3)
+    append = history.append
+    def unavailable(rows):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(history, 'append', unavailable)
+    # The spool can't be opened either while its pending file is a directory
+    spool.pending.mkdir()
+
+    for timestamp in range(1, 6):
+        writer.write(history, row(timestamp))
+    writer.flush()
+    assert [float(row['DateTime']) for row in writer.buffers[history]] == [3, 4, 5]
+    assert [float(row['DateTime']) for row in writer.spooled[history]] == [3, 4, 5]
+
+    monkeypatch.setattr(history, 'append', append)
+    writer.write(history, row(6))
+    writer.flush()
+    assert [float(row['DateTime']) for row in history.query()] == [3, 4, 5, 6]
+    # Only the spool still fails, and keeps no more than three rows
+    assert writer.buffers == {} and [float(row['DateTime']) for row in writer.spooled[history]] == [4, 5, 6]
+
+    spool.pending.rmdir()
+    writer.flush()
+    assert spooled(spool) == [4, 5, 6] and writer.spooled == {}
+    writer.flush()
+    assert [float(row['DateTime']) for row in history.query()] == [3, 4, 5, 6] and spooled(spool) == [4, 5, 6]
+
+#endregion batch writer
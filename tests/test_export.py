@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import json
+from time import time
+
+import pytest
+
+from speedtest.export import export
+from speedtest.history import BACKENDS, open_history
+from speedtest.retention import RetentionPolicy, compact
+
+#region high-water marks
+
+def rows(now: float, *days: float) -> list:
+    return [{'DateTime': now - day * 86400, 'Country': 'Germany', 'IP': '192.0.2.1', 'Download': day, 'Upload': 1.0, 'ISP': 'Example'} for day in days]
+
+def exported(path) -> list:
+    return [json.loads(line)['Download'] for line in path.read_text().splitlines()]
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_marks_survive_compaction(home, tmp_path, backend):
+    now = time()
+    history = open_history('bandwidth', backend)
+    output = tmp_path.joinpath('export.ndjson')
+    history.append(rows(now, 10, 9, 8, 1))
+    count, mark = export(history, output, batch_size=3)
+    assert count == 4 and exported(output) == [10, 9, 8, 1]
+
+    # Compaction removes rows in front of the mark, rows arrive out of order
+    history.append(rows(now, 0.5, 1.5))
+    assert compact(history, RetentionPolicy(raw_days=3), now) == 3
+    count, mark = export(history, output, mark=mark, batch_size=3)
+    assert count == 2 and exported(output) == [0.5, 1.5]
+    assert export(history, output, mark=mark) == (0, mark)
+
+    # Rows may start over once the history was emptied
+    history.remove_before(now + 1)
+    history.append(rows(now, 0.25))
+    count, mark = export(history, output, mark=mark)
+    assert count == 1 and exported(output) == [0.25]
+    history.close()
+
+#endregion high-water marks
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import csv
+import random
+import re
+import sqlite3
+from datetime import datetime as dt
+from datetime import timezone
+from time import time
+
+import pytest
+
+from speedtest.config import BANDWIDTHFILE, HISTORYDB, PINGFILE
+from speedtest.history import BACKENDS, DISORDER, open_history
+from speedtest.retention import RetentionPolicy, compact
+
+#region legacy layout
+
+def legacy(timestamp: float) -> str:
+    return dt.fromtimestamp(timestamp, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def write_legacy_histories(home, now: float) -> None:
+    """
+    Save a ping and a bandwidth history the way version 2.0.0 did.
+    """
+    home.mkdir(parents=True, exist_ok=True)
+    with open(home.joinpath(PINGFILE), mode='w', encoding='utf-8', newline='') as file_handler:
+        writer = csv.writer(file_handler, lineterminator='\n')
+        writer.writerow(['DateTime', 'Target', 'PingMin', 'PingMax', 'PackageSent', 'PackageReceived', 'PackageLost'])
+        writer.writerow([legacy(now - 7200), 'google.com', ' 10.23ms', ' 12.50ms', '  4', '  4', '  0%'])
+        writer.writerow([legacy(now - 60), 'google.com', '  9.87ms', ' 11.00ms', '  4', '  3', ' 25%'])
+    with open(home.joinpath(BANDWIDTHFILE), mode='w', encoding='utf-8', newline='') as file_handler:
+        writer = csv.writer(file_handler, lineterminator='\n')
+        writer.writerow(['DateTime', 'Country', 'IP', 'Download', 'Upload', 'ISP'])
+        writer.writerow([legacy(now - 7200), 'Germany', '192.0.2.1', ' 12.34MB/s', '  5.67MB/s', 'Example'])
+        writer.writerow([legacy(now - 60), 'Germany', '192.0.2.1', '123.45MB/s', ' 10.00MB/s', 'Example'])
+
+def test_legacy_histories_are_converted(home, run):
+    now = round(time())
+    write_legacy_histories(home, now)
+
+    rows = list(open_history('ping').query())
+    assert [float(row['DateTime']) for row in rows] == [now - 7200, now - 60]
+    assert rows[1]['PingMin'] == '9.87' and rows[1]['PackageReceived'] == '3' and rows[1]['PackageLost'] == '25'
+    assert rows[1]['PingAvg'] == ''
+    rows = list(open_history('bandwidth').query())
+    assert [(row['Download'], row['Upload']) for row in rows] == [('12.34', '5.67'), ('123.45', '10.00')]
+
+    for command in ('ping', 'bandwidth'):
+        assert len(run(command, '--list').strip().splitlines()) == 3
+        assert len(run(command, '--list', '--tail', '1').strip().splitlines()) == 2
+        assert len(run(command, '--list', '--since', '1h').strip().splitlines()) == 2
+        assert 'Mean' in run(command, '--stats')
+        assert 'Week' in run(command, '--summary')
+    # The result was saved a minute ago, give or take the rounding of the clock
+    assert re.search(r'\[saved (59|60|61)s ago\]', run('ping', '--max-age', '3600', '--target', 'google.com', '--count', '4'))
+    assert '123.45MB/s' in run('bandwidth', '--max-age', '3600')
+
+def test_legacy_histories_are_migrated(home, run):
+    now = round(time())
+    write_legacy_histories(home, now)
+    run('config', '--history', 'sqlite')
+    with sqlite3.connect(home.joinpath(HISTORYDB)) as connection:
+        assert connection.execute('SELECT "DateTime", "PingMin", "PackageLost" FROM ping ORDER BY "DateTime"').fetchall() == [(now - 7200, 10.23, 0.0), (now - 60, 9.87, 25.0)]
+        assert connection.execute('SELECT typeof("Download") FROM bandwidth').fetchall() == [('real',), ('real',)]
+
+#endregion legacy layout
+
+#region hand-edited rows
+
+def test_unreadable_rows_are_skipped(home, run):
+    now = round(time())
+    write_legacy_histories(home, now)
+    history = open_history('ping')
+    with open(home.joinpath(PINGFILE), mode='a', encoding='utf-8') as file_handler:
+        file_handler.write('yesterday,google.com,1,2,4,4,0,,,,,,\n\n')
+    history.append([{'DateTime': now - 30, 'Target': 'google.com', 'PingMin': 1 / 3, 'PingMax': 2, 'PackageSent': 4, 'PackageReceived': 4, 'PackageLost': 0}])
+
+    assert [float(row['DateTime']) for row in history.query()] == [now - 7200, now - 60, now - 30]
+    assert [float(row['DateTime']) for row in history.query(since=now - 45)] == [now - 30]
+    assert [float(row['DateTime']) for row in history.tail(2)] == [now - 60, now - 30]
+    history.remove_before(now - 3600)
+    assert history.oldest() == now - 60
+
+    lines = run('ping', '--list').strip().splitlines()
+    assert len(lines) == 3
+    assert lines[-1].startswith(dt.fromtimestamp(now - 30, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S'))
+    assert '0.33' in lines[-1].split() and '0.3333' not in lines[-1]
+
+#endregion hand-edited rows
+
+#region compaction
+
+def test_stats_warn_about_compacted_results(home, run):
+    now = round(time())
+    history = open_history('bandwidth')
+    history.append([{'DateTime': now - days * 86400, 'Country': 'Germany', 'IP': '192.0.2.1', 'Download': days, 'Upload': 1.0, 'ISP': 'Example'} for days in (10, 5, 0)])
+    assert compact(history, RetentionPolicy(raw_days=2), now) == 2
+
+    output = run('bandwidth', '--stats', '--since', '30d')
+    assert 'were compacted into rollups' in output
+    assert 'compacted' not in run('bandwidth', '--stats', '--since', '1h')
+    assert 'compacted' not in run('bandwidth', '--stats', '--json')
+    assert len(run('bandwidth', '--list', '--rollup', 'daily').strip().splitlines()) == 3
+
+#endregion compaction
+
+#region out-of-order rows
+
+def disordered(count: int, now: float) -> list:
+    """
+    Timestamps ten minutes apart, each appended up to half a `DISORDER` late.
+    """
+    generator = random.Random(count)
+    return [now - (count - index) * 600 - generator.uniform(0, DISORDER / 2) for index in range(count)]
+
+def ping_row(timestamp: float, target: str='google.com') -> dict:
+    return {'DateTime': timestamp, 'Target': target, 'PingMin': 1.0, 'PingMax': 2.0, 'PackageSent': 4, 'PackageReceived': 4, 'PackageLost': 0}
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_range_queries_of_disordered_rows(home, backend):
+    now = time()
+    timestamps = disordered(2000, now)
+    history = open_history('ping', backend)
+    for start in range(0, len(timestamps), 100):
+        history.append([ping_row(timestamp, 'google.com' if index % 2 else 'example.com') for index, timestamp in enumerate(timestamps[start:start + 100], start)])
+
+    for since, until in ((now - 7 * 86400, None), (now - 3 * 86400, now - 86400), (None, now - 10 * 86400), (now - 600, None), (now, None)):
+        expected = sorted(timestamp for timestamp in timestamps if (since is None or timestamp >= since) and (until is None or timestamp < until))
+        assert [float(row['DateTime']) for row in history.query(since, until)] == expected
+        assert [float(row['DateTime']) for row in history.tail(5, since, until)] == expected[-5:]
+    expected = sorted(timestamp for index, timestamp in enumerate(timestamps) if index % 2)
+    assert [float(row['DateTime']) for row in history.query(now - 86400, target='google.com')] == [timestamp for timestamp in expected if timestamp >= now - 86400]
+    assert [float(row['DateTime']) for row in history.query(limit=3)] == sorted(timestamps)[:3]
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_remove_before_disordered_rows(home, backend):
+    now = time()
+    timestamps = disordered(500, now)
+    history = open_history('ping', backend)
+    history.append([ping_row(timestamp) for timestamp in timestamps])
+
+    history.remove_before(now - 2 * 86400)
+    expected = sorted(timestamp for timestamp in timestamps if timestamp >= now - 2 * 86400)
+    assert [float(row['DateTime']) for row in history.query()] == expected
+    assert history.oldest() in expected
+    history.append([ping_row(now - 3 * 86400), ping_row(now)])
+    history.remove_before(now - 86400)
+    assert [float(row['DateTime']) for row in history.query()] == [timestamp for timestamp in [*expected, now] if timestamp >= now - 86400]
+    history.remove_before(now + 1)
+    assert list(history.query()) == [] and history.oldest() is None
+
+#endregion out-of-order rows
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+
+from time import monotonic
+from urllib.request import urlopen
+
+from speedtest.mockserver import MockSpeedtestServer
+
+#region shaping
+
+def download(server: MockSpeedtestServer) -> float:
+    """
+    Fetch a 2 MB image and return how long it took.
+    """
+    start = monotonic()
+    with urlopen(f"{server.url}/random1000x1000.jpg") as response:
+        assert len(response.read()) == 2_000_000
+    return monotonic() - start
+
+def test_bandwidth_may_change_while_running():
+    with MockSpeedtestServer() as server:
+        assert server.bucket is None and download(server) < 0.5
+        server.settings.bandwidth = 4_000_000
+        assert server.bucket.rate == 4_000_000 and download(server) >= 0.4
+        server.settings.bandwidth = None
+        assert server.bucket is None and download(server) < 0.5
+
+#endregion shaping
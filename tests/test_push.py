@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import json
+
+from speedtest.mockserver import MockSpeedtestServer
+from speedtest.push import Collector, Pusher, Spool
+
+#region spool
+
+def rows(*timestamps: float) -> list:
+    return [{'DateTime': timestamp, 'Target': 'google.com', 'PingMin': 1.0} for timestamp in timestamps]
+
+def delivered(server: MockSpeedtestServer) -> list:
+    return [record['row']['DateTime'] for record in server.results]
+
+def test_spool_rotates_pending_records(home):
+    spool = Spool(home.joinpath('spool'))
+    spool.write('ping', rows(1, 2, 3))
+    assert len(spool) == 3 and spool.segments() == []
+
+    spool.rotate()
+    assert len(spool) == 3 and len(spool.segments()) == 1 and not spool.pending.exists()
+    # Nothing is pending, so there is nothing to rotate
+    spool.rotate()
+    assert len(spool.segments()) == 1
+
+    spool.write('ping', rows(4))
+    spool.rotate()
+    segments = spool.segments()
+    assert len(spool) == 4 and len(segments) == 2
+    assert [json.loads(line)['row']['DateTime'] for line in segments[-1].read_text().splitlines()] == [4]
+
+def test_spool_trims_rejected_batches_and_oldest_segments_first(home):
+    spool = Spool(home.joinpath('spool'))
+    for timestamp in range(3):
+        spool.write('ping', rows(timestamp))
+        spool.rotate()
+    oldest, *newer = spool.segments()
+    spool.reject(newer[0], [newer[0].read_bytes()])
+    size = oldest.stat().st_size
+    spool.write('ping', rows(3))
+
+    spool.max_bytes = 4 * size
+    assert spool.trim() == 1 and spool.rejected() == [] and spool.segments() == [oldest, *newer]
+    spool.max_bytes = 2 * size
+    assert spool.trim() == 2 and spool.segments() == [newer[-1]] and len(spool) == 2
+    assert spool.trim() == 0
+
+#endregion spool
+
+#region pushing
+
+def test_rejected_batches_are_set_aside(home):
+    spool = Spool(home.joinpath('spool'))
+    spool.write('ping', rows(0, 1))
+    with open(spool.pending, mode='ab') as file_handler:
+        file_handler.write(b'not json\n')
+    spool.write('ping', rows(3, 4))
+
+    with MockSpeedtestServer() as server:
+        pusher = Pusher(spool, Collector(server.collector_url), batch_size=2)
+        assert pusher.push() == 3
+        pusher.close()
+        assert delivered(server) == [0, 1, 4]
+    assert len(spool) == 0 and pusher.backoff.failures == 0
+    rejected, = spool.rejected()
+    assert rejected.read_bytes().splitlines()[0] == b'not json'
+    assert json.loads(rejected.read_bytes().splitlines()[1])['row']['DateTime'] == 3
+
+def test_delivery_resumes_after_a_failed_batch(home, monkeypatch):
+    spool = Spool(home.joinpath('spool'))
+    spool.write('ping', rows(*range(5)))
+
+    with MockSpeedtestServer(faults=('error',)) as server:
+        collector = Collector(server.collector_url)
+        post = collector.post
+        def fail_after_post(lines):
+            post(lines)
+            server.settings.fault_rate = 1
+        monkeypatch.setattr(collector, 'post', fail_after_post)
+        pusher = Pusher(spool, collector, batch_size=2)
+
+        # The collector answers 503 from the second batch on
+        assert pusher.push() == 0
+        assert delivered(server) == [0, 1] and pusher.backoff.failures == 1
+        assert len(spool) == 3 and len(spool.segments()) == 1
+
+        # Results saved meanwhile queue up behind the remainder
+        spool.write('ping', rows(5))
+        monkeypatch.setattr(collector, 'post', post)
+        server.settings.fault_rate = 0
+        assert pusher.push(force=True) == 4
+        pusher.close()
+        assert delivered(server) == [0, 1, 2, 3, 4, 5]
+    assert len(spool) == 0 and spool.segments() == [] and pusher.backoff.failures == 0
+
+#endregion pushing
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+from speedtest import speedtest
+
+#region client-bound phases
+
+def measure(monkeypatch, wall: float, process: float, thread_times: list) -> dict:
+    """
+    Summarize a phase that took `wall` seconds and `process` CPU seconds.
+    """
+    clock, cpu = iter([100.0, 100.0 + wall]), iter([(10.0, 2.0), (10.0 + process * 0.75, 2.0 + process * 0.25)])
+    monkeypatch.setattr(speedtest.timeit, 'default_timer', lambda: next(clock))
+    monkeypatch.setattr(speedtest, 'process_cpu_time', lambda: next(cpu))
+    return speedtest.CPUMeter(len(thread_times)).summary(10_000_000, thread_times)
+
+def test_many_threads_sharing_one_core_are_client_bound(monkeypatch):
+    # 32 short-lived threads, none busy for long, that keep one core busy
+    summary = measure(monkeypatch, 10.0, 9.5, [0.3] * 32)
+    assert summary['max_thread'] == 0.3 and summary['utilization'] == 0.95
+    assert summary['client_bound']
+
+def test_threads_keeping_one_core_busy_are_client_bound(monkeypatch):
+    assert measure(monkeypatch, 10.0, 5.0, [2.0] * 4)['client_bound'] is False
+    assert measure(monkeypatch, 10.0, 5.0, [2.0] * 4 + [1.5])['client_bound'] is True
+
+def test_idle_phases_are_not_client_bound(monkeypatch):
+    summary = measure(monkeypatch, 10.0, 1.0, [0.1, None, 0.2])
+    assert summary['threads'] == 0.1 + 0.2 and summary['bytes_per_cpu_second'] == 10_000_000
+    assert not summary['client_bound']
+    assert not measure(monkeypatch, 0.0, 0.0, [])['client_bound']
+
+#endregion client-bound phases
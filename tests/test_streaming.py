@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import math
+import random
+import statistics
+
+from speedtest.streaming import Jitter, RTTStatistics, TDigest
+
+#region estimators
+
+def test_jitter_follows_rfc_3550():
+    jitter = Jitter()
+    for transit in (0.010, 0.010):
+        jitter.add(transit)
+    assert jitter.value == 0
+    jitter.add(0.026)
+    assert math.isclose(jitter.value, 0.001)
+    jitter.add(0.010)
+    assert math.isclose(jitter.value, 0.001 + (0.016 - 0.001) / 16)
+
+def test_tdigest_estimates_quantiles():
+    generator = random.Random(42)
+    values = [generator.lognormvariate(math.log(0.02), 0.5) for _ in range(20_000)]
+    digest = TDigest()
+    for value in values:
+        digest.add(value)
+    assert len(digest.means) <= 2 * digest.compression
+
+    ordered = sorted(values)
+    for quantile in (0.01, 0.25, 0.5, 0.9, 0.99, 0.999):
+        estimate = digest.quantile(quantile)
+        # Within half a percentile of the exact rank, tighter towards the tails
+        rank = sum(1 for value in ordered if value <= estimate) / len(ordered)
+        assert abs(rank - quantile) <= 0.005 * min(1, 4 * min(quantile, 1 - quantile) + 0.2), quantile
+    assert digest.quantile(0) == ordered[0] and digest.quantile(1) == ordered[-1]
+
+def test_tdigest_with_few_values():
+    digest = TDigest()
+    assert math.isnan(digest.quantile(0.5))
+    digest.add(3.0)
+    assert digest.quantile(0.5) == 3.0
+    for value in (1.0, 2.0):
+        digest.add(value)
+    assert digest.quantile(0.5) == 2.0 and digest.quantile(0) == 1.0 and digest.quantile(1) == 3.0
+
+def test_rtt_statistics():
+    rtts = RTTStatistics()
+    rtts.sent = 5
+    for rtt in (0.010, 0.012, 0.011, 0.030):
+        rtts.add(rtt)
+    assert rtts.received == 4 and rtts.running.min == 0.010 and rtts.running.max == 0.030
+    assert math.isclose(rtts.running.mean, 0.01575) and math.isclose(rtts.running.stddev, statistics.stdev((0.010, 0.012, 0.011, 0.030)))
+    assert 0.010 <= rtts.percentile(50) <= 0.012
+
+#endregion estimators